@@ -3,29 +3,50 @@ main.py
 
 What is this file for: FastAPI server that provides LLM chat endpoints with RAG, stock data, and web search capabilities.
 
-What the flow of the functions are: initialize_ollama() sets up embeddings and LLM models, initialize_services() creates all service instances, and chat endpoints process user queries through the RAG pipeline.
+What the flow of the functions are: initialize_ollama() sets up embeddings and LLM models, initialize_services() creates all service instances, and chat endpoints process user queries through the RAG pipeline within a per-request deadline, with optional server-side sessions and response profiles.
 
 How this service is used: Receives chat requests from the backend API gateway and returns AI-generated responses with citations and service usage indicators.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, HTTPException, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uvicorn
 from langchain_ollama import OllamaEmbeddings, OllamaLLM
 from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from services.vector_store import VectorStoreService
-from services.document_processor import DocumentProcessor
+from services.document_processor import DocumentProcessor, REFERENCE_DOCUMENT_METADATA
 from services.rag_service import RAGService
 from services.advanced_rag_service import AdvancedRAGService
 from services.stock_service import StockService
+from services.price_store import PriceStore
 from services.web_search_service import WebSearchService
+from services.session_store import SessionStore
+from services.model_warmup import ModelWarmer
+from services.profiler import RequestProfiler
+from services.ingestion_queue import IngestionQueue, IngestionQueueFullError
+from services.deadline import DeadlineExceededError, deadline_scope
+from services.resilience import DependencyGuard
+from services.rate_limiter import RateLimitedClient
+from services.onnx_embeddings import OnnxEmbeddings
+from services.token_usage import usage_scope
+from services.prompt_cache import PromptPrefixCache, prefix_scope
+from services.response_shaping import PROFILES, json_response, render_json, shape_response
+from services.llm_scheduler import LLMScheduler, ScheduledLLM, SchedulerOverloadedError, start_batch_tracking, start_request_tracking
+from services.metrics import CONTENT_TYPE, IN_FLIGHT_REQUESTS, REQUESTS_TOTAL, REQUEST_LATENCY, render_metrics, request_mode
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import logging
+import math
+import multiprocessing
 import os
 import time
-from datetime import datetime
+from datetime import date, datetime
 import sys
 
 
@@ -34,7 +55,8 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
     handlers=[
         logging.StreamHandler(sys.stdout),
-        logging.FileHandler("llm_service.log", mode="w")
+        # workers and ingestion parser processes share the log file, so only a single process may truncate it on start
+        logging.FileHandler("llm_service.log", mode="a" if int(os.getenv("LLM_SERVICE_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1") > 1 or multiprocessing.parent_process() is not None else "w")
     ]
 )
 
@@ -43,7 +65,26 @@ logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="LLM Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # every worker process initializes its own services; skipped when they were installed beforehand (e.g. fakes)
+    if rag_service is None:
+        logger.info(f"Starting LLM Service worker (pid {os.getpid()})...")
+        if LLM_SERVICE_WORKERS == 1 and multiprocessing.parent_process() is not None:
+            logger.warning("Running in a child process with LLM_SERVICE_WORKERS and WEB_CONCURRENCY unset; if there are several workers, each gets the full Polygon and Ollama limits")
+        if await run_in_threadpool(initialize_services):
+            logger.info("All services initialized successfully")
+        else:
+            logger.error("Failed to initialize some services")
+    yield
+    if model_warmer is not None:
+        model_warmer.stop()
+    if ingestion_queue is not None:
+        ingestion_queue.stop()
+    if vector_store_service is not None:
+        vector_store_service.close()
+
+app = FastAPI(title="LLM Service", version="1.0.0", lifespan=lifespan)
 backend_port = "http://localhost:3000"
 
 app.add_middleware(
@@ -54,6 +95,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+MODE_BY_PATH = {"/chat": "advanced", "/chat/normal": "normal", "/chat/batch": "normal", "/chat/compare": "compare"}
+
+@app.middleware("http")
+async def track_request_metrics(request: Request, call_next):
+    endpoint = request.url.path
+    mode = MODE_BY_PATH.get(endpoint)
+    if mode is None:
+        return await call_next(request)
+
+    request_mode.set(mode)
+    start_request_tracking()
+    start = time.perf_counter()
+    status = "500"
+    with IN_FLIGHT_REQUESTS.track_inprogress(endpoint=endpoint, mode=mode):
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            response.headers["X-Process-Time"] = f"{time.perf_counter() - start:.6f}"
+            return response
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, mode=mode, status=status)
+            REQUESTS_TOTAL.inc(endpoint=endpoint, mode=mode, status=status)
+
 
 embeddings = None
 llm = None
@@ -62,14 +126,151 @@ rag_service = None
 advanced_rag_service = None
 stock_service = None
 web_search_service = None
+model_warmer = None
+ingestion_queue = None
 document_loaded = False
 
+# the Polygon and Ollama limits below are split by this count; uvicorn and gunicorn take their default --workers from WEB_CONCURRENCY
+LLM_SERVICE_WORKERS = int(os.getenv("LLM_SERVICE_WORKERS") or os.getenv("WEB_CONCURRENCY") or "1")
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() in ("1", "true", "yes")
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "16"))
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
+OLLAMA_LLM_MODEL = os.getenv("OLLAMA_LLM_MODEL", "llama3.2:3b")
+OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+OLLAMA_KEEP_ALIVE_SECONDS = int(os.getenv("OLLAMA_KEEP_ALIVE_SECONDS", "1800"))
+OLLAMA_KEEP_WARM_INTERVAL_SECONDS = float(os.getenv("OLLAMA_KEEP_WARM_INTERVAL_SECONDS", "0")) or None
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "ollama").lower() # "onnx" embeds in-process on CPU
+ONNX_EMBEDDING_MODEL_DIR = os.getenv("ONNX_EMBEDDING_MODEL_DIR") # tokenizer.json + model ONNX file, downloaded from the hub when unset
+ONNX_EMBEDDING_THREADS = int(os.getenv("ONNX_EMBEDDING_THREADS", "0")) or None
+ONNX_EMBEDDING_MAX_LENGTH = int(os.getenv("ONNX_EMBEDDING_MAX_LENGTH", "512"))
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() in ("1", "true", "yes") # false loads the models in the background instead of before startup
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2")) # Ollama generations at once across all workers
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "16")) # across all workers, like the concurrency
+LLM_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", "30"))
+RETRIEVER_K = 4
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", str(LLM_MAX_CONCURRENCY * 2)))
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH")
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+SESSION_MAX_HISTORY_TOKENS = int(os.getenv("SESSION_MAX_HISTORY_TOKENS", "2000"))
+SESSION_COMPACT_TO_RATIO = float(os.getenv("SESSION_COMPACT_TO_RATIO", "0.6")) # share of the history budget kept when compacting, lower keeps the prompt prefix stable for more turns
+
+# prompt parts above these estimated token counts are logged, counted and reported in usage
+PROMPT_LIMITS = {
+    "chat_context": int(os.getenv("PROMPT_CHAT_CONTEXT_MAX_TOKENS", str(SESSION_MAX_HISTORY_TOKENS))),
+    "final_context": int(os.getenv("PROMPT_FINAL_CONTEXT_MAX_TOKENS", "3000")),
+}
+
+PRICE_STORE_PATH = os.getenv("PRICE_STORE_PATH", "../price-data")
+PRICE_HISTORY_DAYS = int(os.getenv("PRICE_HISTORY_DAYS", "730"))
+PRICE_REFRESH_SECONDS = float(os.getenv("PRICE_REFRESH_SECONDS", "900"))
+STOCK_PROMPT_BLOCK_TOKENS = int(os.getenv("STOCK_PROMPT_BLOCK_TOKENS", "300"))
+
+WEB_SEARCH_IN_CORPUS_SCORE = float(os.getenv("WEB_SEARCH_IN_CORPUS_SCORE", "0.62"))
+WEB_SEARCH_OUT_OF_CORPUS_SCORE = float(os.getenv("WEB_SEARCH_OUT_OF_CORPUS_SCORE", "0.45"))
+WEB_SEARCH_SNIPPET_TOKENS = int(os.getenv("WEB_SEARCH_SNIPPET_TOKENS", "400")) # prompt budget for web search snippets, the most relevant ones go in first
+WEB_SEARCH_MIN_RELEVANCE = float(os.getenv("WEB_SEARCH_MIN_RELEVANCE", "0.3")) # snippets scoring below this against the query are dropped
+
+DOCUMENT_UPLOAD_DIR = os.getenv("DOCUMENT_UPLOAD_DIR", "../uploads")
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+INGESTION_MAX_QUEUED = int(os.getenv("INGESTION_MAX_QUEUED", "50"))
+INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", "32"))
+
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "60")) # 0 disables the per-request deadline
+DEADLINE_MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", "0.5"))
+DEADLINE_TOKENS_PER_SECOND = float(os.getenv("DEADLINE_TOKENS_PER_SECOND", "20"))
+
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+HEDGED_SERVICES = [name.strip() for name in os.getenv("HEDGED_SERVICES", "").split(",") if name.strip()] # e.g. "serpapi,polygon"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+
+POLYGON_REQUESTS_PER_MINUTE = float(os.getenv("POLYGON_REQUESTS_PER_MINUTE", "5")) # the free plan's limit, 0 disables client-side rate limiting
+POLYGON_BURST = int(os.getenv("POLYGON_BURST", "0")) or max(1, int(POLYGON_REQUESTS_PER_MINUTE)) # plan-wide, split between the workers like the rate
+POLYGON_MAX_WAIT_SECONDS = float(os.getenv("POLYGON_MAX_WAIT_SECONDS", "2"))
+POLYGON_CACHE_TTL_SECONDS = float(os.getenv("POLYGON_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+RESPONSE_PROFILE = os.getenv("RESPONSE_PROFILE", "full").lower() # "compact" drops raw stock, web search and source metadata blobs
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "../profiles")
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "20"))
+PROFILE_TRACE_MEMORY = os.getenv("PROFILE_TRACE_MEMORY", "true").lower() in ("1", "true", "yes")
+
+dependency_guard = DependencyGuard(
+    window_seconds=BREAKER_WINDOW_SECONDS,
+    min_calls=BREAKER_MIN_CALLS,
+    failure_rate=BREAKER_FAILURE_RATE,
+    open_seconds=BREAKER_OPEN_SECONDS,
+    hedged_services=HEDGED_SERVICES,
+    hedge_percentile=HEDGE_PERCENTILE,
+)
+
+# every worker process has its own bucket, so each gets its share of the plan's rate and burst; with several
+# workers on a small plan a worker's tokens refill slower than POLYGON_MAX_WAIT_SECONDS, so once its burst is
+# spent stock answers fall back to cached responses or go without news, financials or prices
+polygon_limiter = RateLimitedClient(
+    dependency_guard,
+    "polygon",
+    requests_per_minute=POLYGON_REQUESTS_PER_MINUTE / max(1, LLM_SERVICE_WORKERS),
+    burst=math.ceil(POLYGON_BURST / max(1, LLM_SERVICE_WORKERS)),
+    max_wait_seconds=POLYGON_MAX_WAIT_SECONDS,
+    cache_ttl_seconds=POLYGON_CACHE_TTL_SECONDS,
+)
+
+request_profiler = RequestProfiler(
+    enabled=PROFILING_ENABLED,
+    sample_rate=PROFILE_SAMPLE_RATE,
+    interval_seconds=PROFILE_INTERVAL_SECONDS,
+    directory=PROFILE_DIR,
+    max_profiles=PROFILE_MAX_STORED,
+    trace_memory=PROFILE_TRACE_MEMORY,
+)
+
+session_store = SessionStore(
+    max_sessions=SESSION_MAX,
+    idle_ttl_seconds=SESSION_IDLE_TTL_SECONDS,
+    max_history_tokens=SESSION_MAX_HISTORY_TOKENS,
+    persist_path=SESSION_STORE_PATH,
+    compact_to_ratio=SESSION_COMPACT_TO_RATIO,
+)
+
+prompt_prefix_cache = PromptPrefixCache(max_entries=SESSION_MAX * 4)
+
+# every worker process schedules its own calls, so each gets its share of the Ollama limits (at least one call)
+llm_scheduler = LLMScheduler(
+    max_concurrency=max(1, LLM_MAX_CONCURRENCY // max(1, LLM_SERVICE_WORKERS)),
+    max_queue_depth=max(1, LLM_MAX_QUEUE_DEPTH // max(1, LLM_SERVICE_WORKERS)),
+    max_wait_seconds=LLM_MAX_QUEUE_WAIT_SECONDS,
+)
+
+def create_embeddings():
+    if EMBEDDINGS_BACKEND == "onnx":
+        try:
+            return OnnxEmbeddings(model_dir=ONNX_EMBEDDING_MODEL_DIR, max_length=ONNX_EMBEDDING_MAX_LENGTH, threads=ONNX_EMBEDDING_THREADS)
+        except Exception as e:
+            logger.error(f"Failed to load ONNX embeddings, falling back to Ollama: {e}")
+    return OllamaEmbeddings(model=OLLAMA_EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL, keep_alive=OLLAMA_KEEP_ALIVE_SECONDS)
+
 def initialize_ollama(max_retries=3):
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to initialize Ollama (attempt {attempt + 1}/{max_retries})")
-            embeddings = OllamaEmbeddings(model="nomic-embed-text")
-            llm = OllamaLLM(model="llama3.2:3b")
+            embeddings = create_embeddings()
+            llm = OllamaLLM(model=OLLAMA_LLM_MODEL, base_url=OLLAMA_BASE_URL, keep_alive=OLLAMA_KEEP_ALIVE_SECONDS)
             logger.info("Ollama components initialized successfully")
             return embeddings, llm
             
@@ -93,7 +294,7 @@ def load_default_document():
         
         if os.path.exists(txt_path):
             logger.info(f"Loading from existing text file: {txt_path}")
-            chunks = doc_processor.load_from_txt(txt_path, "reference_doc.pdf")
+            chunks = doc_processor.load_from_txt(txt_path, "reference_doc.pdf", REFERENCE_DOCUMENT_METADATA)
         else:
             if not os.path.exists(pdf_path):
                 logger.warning(f"Default document not found: {pdf_path}")
@@ -103,7 +304,7 @@ def load_default_document():
             
 
             logger.info("Starting PDF processing...")
-            chunks = doc_processor.process_pdf(pdf_path)
+            chunks = doc_processor.process_pdf(pdf_path, document_metadata=REFERENCE_DOCUMENT_METADATA)
             logger.info(f"PDF processing completed. Created {len(chunks)} chunks")
         
 
@@ -125,17 +326,53 @@ def load_default_document():
         logger.error(f"Error loading default document: {e}")
         return False
 
+def create_ingestion_queue(vector_store_service, upload_dir: str = DOCUMENT_UPLOAD_DIR) -> IngestionQueue:
+    queue = IngestionQueue(
+        vector_store_service,
+        upload_dir=upload_dir,
+        max_workers=INGESTION_WORKERS,
+        max_queued=INGESTION_MAX_QUEUED,
+        batch_size=INGESTION_BATCH_SIZE,
+        # embedding uploads competes with chat for Ollama, so ingestion pauses while chat requests are in flight
+        busy=lambda: IN_FLIGHT_REQUESTS.total() > 0,
+    )
+    queue.start()
+    return queue
+
 def initialize_services():
-    global embeddings, llm, vector_store_service, rag_service, advanced_rag_service, stock_service, web_search_service
+    global embeddings, llm, vector_store_service, rag_service, advanced_rag_service, stock_service, web_search_service, model_warmer, ingestion_queue
     
     result = initialize_ollama()
     if result is None or result[0] is None or result[1] is None:
         logger.error("Failed to initialize Ollama components")
         return False
     embeddings, llm = result
+    llm = ScheduledLLM(llm, llm_scheduler)
+
+    model_warmer = ModelWarmer(
+        OLLAMA_LLM_MODEL,
+        None if isinstance(embeddings, OnnxEmbeddings) else OLLAMA_EMBEDDING_MODEL,
+        base_url=OLLAMA_BASE_URL,
+        keep_alive_seconds=OLLAMA_KEEP_ALIVE_SECONDS,
+        interval_seconds=OLLAMA_KEEP_WARM_INTERVAL_SECONDS,
+    )
+    if OLLAMA_WARMUP:
+        logger.info("Warming up Ollama models...")
+        if not model_warmer.warm_up():
+            logger.warning("Model warm-up incomplete, first requests may pay the model load time")
+    # /ready waits for the models either way, so without the blocking warm-up they load in the background
+    model_warmer.start(load_now=not OLLAMA_WARMUP)
 
     try:
-        vector_store_service = VectorStoreService(embeddings)
+        vector_store_service = VectorStoreService(
+            embeddings,
+            cache_size=EMBEDDING_CACHE_SIZE,
+            cache_ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            pool_size=QDRANT_POOL_SIZE,
+        )
         logger.info("Vector store service initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize vector store service: {e}")
@@ -145,9 +382,12 @@ def initialize_services():
     if not load_default_document():
         logger.warning("Failed to load default document, but continuing...")
 
+    ingestion_queue = create_ingestion_queue(vector_store_service)
+
     try:
         logger.info("Initializing stock service...")
-        stock_service = StockService(llm=llm)
+        price_store = PriceStore(PRICE_STORE_PATH, lookback_days=PRICE_HISTORY_DAYS, refresh_seconds=PRICE_REFRESH_SECONDS)
+        stock_service = StockService(llm=llm, price_store=price_store, prompt_block_tokens=STOCK_PROMPT_BLOCK_TOKENS, guard=dependency_guard, limiter=polygon_limiter)
         logger.info("Stock service initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize stock service: {e}")
@@ -156,7 +396,7 @@ def initialize_services():
 
     try:
         logger.info("Initializing web search service...")
-        web_search_service = WebSearchService()
+        web_search_service = WebSearchService(in_corpus_score=WEB_SEARCH_IN_CORPUS_SCORE, out_of_corpus_score=WEB_SEARCH_OUT_OF_CORPUS_SCORE, guard=dependency_guard, embeddings=vector_store_service.embeddings, snippet_token_budget=WEB_SEARCH_SNIPPET_TOKENS, min_relevance=WEB_SEARCH_MIN_RELEVANCE)
         logger.info("Web search service initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize web search service: {e}")
@@ -165,15 +405,15 @@ def initialize_services():
 
     try:
         logger.info("Creating vector store retriever...")
-        retriever = vector_store_service.get_retriever(k=4)
+        retriever = vector_store_service.get_retriever(k=RETRIEVER_K)
         logger.info("Vector store retriever created successfully")
         
         logger.info("Initializing basic RAG service...")
-        rag_service = RAGService(llm, retriever)
+        rag_service = RAGService(llm, retriever, prompt_limits=PROMPT_LIMITS)
         logger.info("Basic RAG service initialized successfully")
         
         logger.info("Initializing advanced RAG service...")
-        advanced_rag_service = AdvancedRAGService(llm, retriever, stock_service, web_search_service)
+        advanced_rag_service = AdvancedRAGService(llm, retriever, stock_service, web_search_service, prompt_limits=PROMPT_LIMITS)
         logger.info("Advanced RAG service initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize RAG services: {e}")
@@ -181,10 +421,25 @@ def initialize_services():
     
     return True
 
+class DocumentFilters(BaseModel):
+    sources: Optional[List[str]] = None
+    doc_types: Optional[List[str]] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+def filters_dict(filters: Optional[DocumentFilters]) -> Optional[dict]:
+    if filters is None:
+        return None
+    return filters.model_dump(mode="json", exclude_none=True) or None
+
 class ChatRequest(BaseModel):
     query: str
-    chat_history: Optional[List[dict]] = []
+    chat_history: Optional[List[dict]] = None # omit when session_id is set to use the server-side history
     session_id: Optional[str] = None
+    filters: Optional[DocumentFilters] = None # restrict retrieval to some documents, types or a date range
+    response_profile: Optional[Literal["full", "compact"]] = None # defaults to RESPONSE_PROFILE
+    fields: Optional[List[str]] = None # top-level ChatResponse fields to return, answer is always included
+    include_usage: bool = False # return per-call LLM token counts and timings as usage
 
 class ChatResponse(BaseModel):
     answer: str
@@ -197,67 +452,396 @@ class ChatResponse(BaseModel):
     web_search_query: Optional[str] = None
     stock_tickers: Optional[List[str]] = None
     session_id: Optional[str] = None
+    degraded_stages: Optional[List[dict]] = None
+    usage: Optional[dict] = None
+
+def response_options(profile: Optional[str], fields: Optional[List[str]]) -> tuple:
+    unknown = sorted(set(fields or []) - set(ChatResponse.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown response fields {unknown}, expected any of {list(ChatResponse.model_fields)}")
+    return (profile or (RESPONSE_PROFILE if RESPONSE_PROFILE in PROFILES else "full"), fields)
+
+def resolve_chat_context(request: ChatRequest) -> tuple:
+    if not request.session_id:
+        return (request.chat_history or [], None)
+    # clients that always send chat_history send an empty list to mean "only the new message"
+    if request.chat_history:
+        session = session_store.sync_history(request.session_id, request.chat_history)
+    else:
+        session = session_store.get_or_create(request.session_id)
+    return ([], session.render_context())
+
+def record_turn(request: ChatRequest, answer: str):
+    if request.session_id:
+        session_store.append_turn(request.session_id, request.query, answer)
+
+def build_advanced_response(result: dict, session_id: Optional[str] = None) -> ChatResponse:
+    return ChatResponse(
+        answer=result["answer"],
+        sources=result["sources"],
+        timestamp=datetime.now().isoformat(),
+        document_loaded=document_loaded,
+        services_used=result.get("services_used"),
+        stock_data=result.get("stock_data"),
+        web_search_results=result.get("web_search_results"),
+        web_search_query=result.get("web_search_query"),
+        stock_tickers=result.get("stock_tickers"),
+        session_id=session_id,
+        degraded_stages=result.get("degraded_stages") or None,
+        usage=result.get("usage")
+    )
+
+def build_normal_response(result: dict, session_id: Optional[str] = None) -> ChatResponse:
+    return ChatResponse(
+        answer=result["answer"],
+        sources=result["sources"],
+        timestamp=datetime.now().isoformat(),
+        document_loaded=document_loaded,
+        services_used={"rag_used": True, "stock_api_used": False, "web_search_used": False},
+        stock_data=None,
+        web_search_results=None,
+        web_search_query=None,
+        stock_tickers=None,
+        session_id=session_id,
+        degraded_stages=result.get("degraded_stages") or None,
+        usage=result.get("usage")
+    )
+
+def request_deadline_seconds(http_request: Optional[Request] = None, spent_seconds: float = 0.0) -> float:
+    budget = CHAT_DEADLINE_SECONDS
+    requested = http_request.headers.get("X-Deadline-Seconds") if http_request is not None else None
+    if requested:
+        try:
+            requested = float(requested)
+        except ValueError:
+            requested = None
+        # clients may ask for a tighter budget, never a looser one, and cannot turn the deadline off
+        if requested is not None and math.isfinite(requested) and requested > 0 and (budget <= 0 or requested < budget):
+            budget = requested
+    return max(budget - spent_seconds, 0.001) if budget > 0 else 0
+
+def open_deadline(budget_seconds: float):
+    return deadline_scope(budget_seconds, min_stage_seconds=DEADLINE_MIN_STAGE_SECONDS, tokens_per_second=DEADLINE_TOKENS_PER_SECOND)
+
+async def run_pipeline(http_request: Request, response: Response, query: str, func, *args, include_usage: bool = False, session_id: Optional[str] = None):
+    with open_deadline(request_deadline_seconds(http_request)) as deadline, usage_scope() as usage, prefix_scope(prompt_prefix_cache, session_id):
+        if not request_profiler.should_profile(http_request.headers.get("X-Profile")):
+            result = await run_in_threadpool(func, *args)
+        else:
+            profile = await run_in_threadpool(request_profiler.begin, http_request.url.path, request_mode.get(), query)
+            response.headers["X-Profile-Id"] = profile.profile_id
+            try:
+                result = await run_in_threadpool(request_profiler.run, profile, func, *args)
+            finally:
+                await run_in_threadpool(request_profiler.finish, profile)
+        if deadline is not None:
+            result["degraded_stages"] = deadline.degraded_stages()
+        if include_usage:
+            result["usage"] = usage.summary()
+        return result
 
 @app.post("/chat", response_model=ChatResponse) # base mode
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request, response: Response):
+    profile, fields = response_options(request.response_profile, request.fields)
     try:
         if not advanced_rag_service:
             raise HTTPException(status_code=500, detail="Advanced RAG service not available. Please ensure all services are initialized.")
         
 
-        chat_history = request.chat_history if request.chat_history else []
-        result = advanced_rag_service.get_answer(request.query, chat_history)
+        llm_scheduler.check_admission()
+
+        chat_history, chat_context = resolve_chat_context(request)
+        result = await run_pipeline(http_request, response, request.query, advanced_rag_service.get_answer, request.query, chat_history, None, chat_context, filters_dict(request.filters), include_usage=request.include_usage, session_id=request.session_id)
+        record_turn(request, result["answer"])
         
-        return ChatResponse(
-            answer=result["answer"],
-            sources=result["sources"],
-            timestamp=datetime.now().isoformat(),
-            document_loaded=document_loaded,
-            services_used=result.get("services_used"),
-            stock_data=result.get("stock_data"),
-            web_search_results=result.get("web_search_results"),
-            web_search_query=result.get("web_search_query"),
-            stock_tickers=result.get("stock_tickers"),
-            session_id=request.session_id
-        )
+        return json_response(build_advanced_response(result, request.session_id), http_request.url.path, profile, fields, headers=dict(response.headers))
+    except SchedulerOverloadedError as e:
+        logger.warning(f"Shedding request in advanced chat endpoint: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceededError as e:
+        logger.warning(f"Deadline exceeded in advanced chat endpoint: {e}")
+        raise HTTPException(status_code=504, detail={"error": str(e), "degraded_stages": e.degraded_stages})
     except Exception as e:
         logger.error(f"Error in advanced chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat/normal", response_model=ChatResponse) #ultra mode
-async def chat_normal(request: ChatRequest):
+async def chat_normal(request: ChatRequest, http_request: Request, response: Response):
+    profile, fields = response_options(request.response_profile, request.fields)
     try:
         if not rag_service:
             raise HTTPException(status_code=500, detail="RAG service not available. Please ensure all services are initialized.")
         
-        chat_history = request.chat_history if request.chat_history else []
-        result = rag_service.get_answer(request.query, chat_history)
+        llm_scheduler.check_admission()
+
+        chat_history, chat_context = resolve_chat_context(request)
+        result = await run_pipeline(http_request, response, request.query, rag_service.get_answer, request.query, chat_history, chat_context, filters_dict(request.filters), include_usage=request.include_usage, session_id=request.session_id)
+        record_turn(request, result["answer"])
         
-        return ChatResponse(
-            answer=result["answer"],
-            sources=result["sources"],
-            timestamp=datetime.now().isoformat(),
-            document_loaded=document_loaded,
-            services_used={"rag_used": True, "stock_api_used": False, "web_search_used": False},
-            stock_data=None,
-            web_search_results=None,
-            web_search_query=None,
-            stock_tickers=None,
-            session_id=request.session_id
-        )
+        return json_response(build_normal_response(result, request.session_id), http_request.url.path, profile, fields, headers=dict(response.headers))
+    except SchedulerOverloadedError as e:
+        logger.warning(f"Shedding request in normal chat endpoint: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceededError as e:
+        logger.warning(f"Deadline exceeded in normal chat endpoint: {e}")
+        raise HTTPException(status_code=504, detail={"error": str(e), "degraded_stages": e.degraded_stages})
     except Exception as e:
         logger.error(f"Error in normal chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class CompareRequest(ChatRequest):
+    stream: bool = False
 
-if __name__ == "__main__":
-    logger.info("Starting LLM Service...")
-    
+class CompareResponse(BaseModel):
+    normal: Optional[ChatResponse] = None
+    advanced: Optional[ChatResponse] = None
+    errors: Optional[dict] = None
+    timings: dict
+    session_id: Optional[str] = None
+
+@app.post("/chat/compare", response_model=CompareResponse) # both modes over one retrieval
+async def chat_compare(request: CompareRequest, http_request: Request):
+    if not rag_service or not advanced_rag_service:
+        raise HTTPException(status_code=500, detail="RAG services not available. Please ensure all services are initialized.")
+
+    profile, fields = response_options(request.response_profile, request.fields)
+    started = time.perf_counter()
+    chat_history, chat_context = resolve_chat_context(request)
+    try:
+        llm_scheduler.check_admission()
+        retrieved_docs = await run_in_threadpool(rag_service.retrieve, request.query, filters_dict(request.filters))
+    except SchedulerOverloadedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Error in compare retrieval: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    retrieval_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    async def run_mode(mode: str) -> dict:
+        mode_started = time.perf_counter()
+        try:
+            # each mode gets what is left of the request deadline after the shared retrieval
+            with open_deadline(request_deadline_seconds(http_request, mode_started - started)) as deadline, usage_scope() as usage, prefix_scope(prompt_prefix_cache, request.session_id):
+                if mode == "normal":
+                    result = await run_in_threadpool(rag_service.generate_answer, request.query, retrieved_docs, chat_history, chat_context)
+                else:
+                    result = await run_in_threadpool(advanced_rag_service.get_answer, request.query, chat_history, retrieved_docs, chat_context)
+                if deadline is not None:
+                    result["degraded_stages"] = deadline.degraded_stages()
+                if request.include_usage:
+                    result["usage"] = usage.summary()
+            response = build_normal_response(result, request.session_id) if mode == "normal" else build_advanced_response(result, request.session_id)
+            return {"mode": mode, "response": response, "elapsed_ms": round((time.perf_counter() - mode_started) * 1000, 1)}
+        except Exception as e:
+            logger.error(f"Error in compare endpoint ({mode} mode): {e}")
+            return {"mode": mode, "error": str(e), "elapsed_ms": round((time.perf_counter() - mode_started) * 1000, 1)}
+
+    tasks = [asyncio.create_task(run_mode("normal")), asyncio.create_task(run_mode("advanced"))]
+
+    if request.stream:
+        async def stream_results():
+            yield json.dumps({"event": "retrieval", "retrieval_ms": retrieval_ms, "documents": len(retrieved_docs)}) + "\n"
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    item = await finished
+                    if "response" in item:
+                        item["response"] = shape_response(item["response"], profile, fields)
+                    yield render_json({"event": "answer", **item}, http_request.url.path, profile) + b"\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
-    if initialize_services():
-        logger.info("All services initialized successfully")
+    results = {item["mode"]: item for item in await asyncio.gather(*tasks)}
+    errors = {mode: item["error"] for mode, item in results.items() if "error" in item}
+    if len(errors) == len(results):
+        raise HTTPException(status_code=500, detail=str(errors))
+
+    return json_response({
+        "normal": shape_response(results["normal"]["response"], profile, fields) if "response" in results["normal"] else None,
+        "advanced": shape_response(results["advanced"]["response"], profile, fields) if "response" in results["advanced"] else None,
+        "errors": errors or None,
+        "timings": {
+            "retrieval_ms": retrieval_ms,
+            "normal_ms": results["normal"]["elapsed_ms"],
+            "advanced_ms": results["advanced"]["elapsed_ms"],
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        },
+        "session_id": request.session_id,
+    }, http_request.url.path, profile)
+
+class BatchChatItem(BaseModel):
+    id: Optional[str] = None
+    query: str
+    chat_history: Optional[List[dict]] = []
+
+class BatchChatRequest(BaseModel):
+    queries: List[BatchChatItem]
+    max_parallel: Optional[int] = None
+    filters: Optional[DocumentFilters] = None
+    response_profile: Optional[Literal["full", "compact"]] = None
+    fields: Optional[List[str]] = None
+
+@app.post("/chat/batch") # base mode, many queries per call
+async def chat_batch(request: BatchChatRequest, http_request: Request):
+    profile, fields = response_options(request.response_profile, request.fields)
+    if not rag_service or not vector_store_service:
+        raise HTTPException(status_code=500, detail="RAG service not available. Please ensure all services are initialized.")
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries provided")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds the limit of {BATCH_MAX_QUERIES} queries")
+
+    try:
+        llm_scheduler.check_admission()
+        retrieved = await run_in_threadpool(vector_store_service.similarity_search_batch, [item.query for item in request.queries], RETRIEVER_K, filters_dict(request.filters))
+    except SchedulerOverloadedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Error in batch retrieval: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    start_batch_tracking()
+    parallel = max(1, min(request.max_parallel or BATCH_MAX_PARALLEL, BATCH_MAX_PARALLEL))
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def answer_item(index: int, item: BatchChatItem, docs: list) -> dict:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await run_in_threadpool(rag_service.generate_answer, item.query, docs, item.chat_history or [])
+                response = build_normal_response(result)
+                return {"index": index, "id": item.id, "status": 200, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1), **shape_response(response, profile, fields)}
+            except SchedulerOverloadedError as e:
+                return {"index": index, "id": item.id, "status": 429, "error": str(e), "retry_after": e.retry_after}
+            except Exception as e:
+                logger.error(f"Error answering batch item {index}: {e}")
+                return {"index": index, "id": item.id, "status": 500, "error": str(e)}
+
+    async def stream_results():
+        tasks = [asyncio.create_task(answer_item(i, item, docs)) for i, (item, docs) in enumerate(zip(request.queries, retrieved))]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield render_json(await finished, http_request.url.path, profile) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {**session_store.describe(session), "prompt_cache": prompt_prefix_cache.describe(session_id)}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    prompt_prefix_cache.forget(session_id)
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"deleted": session_id}
+
+@app.get("/cache/embeddings")
+async def embedding_cache_stats():
+    if not vector_store_service:
+        raise HTTPException(status_code=503, detail="Vector store service not available")
+    return vector_store_service.get_embedding_cache_stats()
+
+@app.get("/ready")
+async def ready():
+    services_ready = rag_service is not None and advanced_rag_service is not None
+    if model_warmer is None:
+        payload = {"ready": services_ready, "models": None}
     else:
-        logger.error("Failed to initialize some services")
-    
-    uvicorn.run(app, host="0.0.0.0", port=8000)
- 
\ No newline at end of file
+        payload = await run_in_threadpool(model_warmer.readiness)
+        payload["ready"] = payload["ready"] and services_ready
+    payload["services_initialized"] = services_ready
+    payload["document_loaded"] = document_loaded
+    if not payload["ready"]:
+        return JSONResponse(status_code=503, content=payload)
+    return payload
+
+@app.get("/dependencies")
+async def dependencies():
+    return {"breakers": dependency_guard.snapshot(), "hedged_services": sorted(dependency_guard.hedged_services), "rate_limits": {"polygon": polygon_limiter.snapshot()}}
+
+@app.post("/documents", status_code=202)
+async def upload_document(file: UploadFile = File(...), title: Optional[str] = Form(None), url: Optional[str] = Form(None), doc_type: Optional[str] = Form(None), published: Optional[date] = Form(None)):
+    if not ingestion_queue:
+        raise HTTPException(status_code=503, detail="Document ingestion not available")
+    data = await file.read(DOCUMENT_MAX_BYTES + 1)
+    if len(data) > DOCUMENT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Document larger than {DOCUMENT_MAX_BYTES} bytes")
+    if not data:
+        raise HTTPException(status_code=400, detail="Uploaded document is empty")
+    try:
+        job = await run_in_threadpool(ingestion_queue.submit, file.filename, data, title, url, doc_type, published.isoformat() if published else None)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except IngestionQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return job.to_dict()
+
+@app.get("/documents/jobs")
+async def list_ingestion_jobs():
+    if not ingestion_queue:
+        raise HTTPException(status_code=503, detail="Document ingestion not available")
+    return {"jobs": ingestion_queue.list_jobs(), "queue": ingestion_queue.stats()}
+
+@app.get("/documents/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    job = ingestion_queue.get_job(job_id) if ingestion_queue else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+@app.get("/debug/profiles")
+async def list_profiles():
+    if not request_profiler.enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return {"profiles": request_profiler.list_profiles(), "max_profiles": request_profiler.max_profiles}
+
+@app.get("/debug/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    summary = request_profiler.get_summary(profile_id) if request_profiler.enabled else None
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return summary
+
+@app.get("/debug/profiles/{profile_id}/flamegraph")
+async def get_profile_flamegraph(profile_id: str):
+    folded = request_profiler.read_file(profile_id, ".folded") if request_profiler.enabled else None
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
+
+@app.get("/debug/profiles/{profile_id}/allocations")
+async def get_profile_allocations(profile_id: str):
+    allocations = request_profiler.read_file(profile_id, ".alloc.txt") if request_profiler.enabled else None
+    if allocations is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(allocations)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+if __name__ == "__main__":
+    workers = LLM_SERVICE_WORKERS
+    if workers > 1 and not QDRANT_URL:
+        logger.warning("The embedded Qdrant store locks its directory, set QDRANT_URL to run more than one worker. Starting a single worker")
+        workers = 1
+    if workers > 1 and not SESSION_STORE_PATH:
+        logger.warning("SESSION_STORE_PATH is not set, server-side chat sessions will not be shared between workers")
+    if workers > LLM_MAX_CONCURRENCY:
+        logger.warning(f"{workers} workers each run at least one Ollama generation, more than LLM_MAX_CONCURRENCY={LLM_MAX_CONCURRENCY}")
+    if workers > 1 and POLYGON_REQUESTS_PER_MINUTE > 0 and 60.0 * workers / POLYGON_REQUESTS_PER_MINUTE > POLYGON_MAX_WAIT_SECONDS:
+        logger.warning(f"Each worker gets a Polygon token every {60.0 * workers / POLYGON_REQUESTS_PER_MINUTE:.0f}s, longer than POLYGON_MAX_WAIT_SECONDS, stock data will be partial once a worker's burst is spent")
+
+    # the app is imported again (in every worker process) and splits its limits by the effective worker count
+    os.environ["LLM_SERVICE_WORKERS"] = str(workers)
+    logger.info(f"Starting LLM Service with {workers} worker(s)...")
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
@@ -3,7 +3,7 @@ advanced_rag_service.py
 
 What is this file for: Orchestrates RAG, stock data, and web search services to provide comprehensive financial answers.
 
-What the flow of the functions are: check_stock_needed() detects stock tickers in queries, get_stock_data() fetches real-time data, get_rag_answer() retrieves document context, and combine_and_generate_final_answer() merges all sources into a final response.
+What the flow of the functions are: The stock branch (check_stock_needed() and get_stock_data()) runs alongside the document branch (retrieve_documents(), get_rag_answer() and an early start_web_search() when retrieval says the document cannot answer), then check_web_search_needed() and combine_and_generate_final_answer() merge all sources into a final response.
 
 How this service is used: Called by the main FastAPI server to process user queries and return answers with citations from multiple sources.
 """
@@ -11,6 +11,7 @@ How this service is used: Called by the main FastAPI server to process user quer
 from langchain_core.runnables import RunnableParallel, RunnableSequence, RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
 from langchain_ollama import OllamaLLM
 from typing import List, Dict, Any, Optional
 import logging
@@ -18,13 +19,20 @@ import re
 import json
 
 from .stock_service import StockService
-from .web_search_service import WebSearchService
+from .web_search_service import WebSearchService, web_source
+from .document_processor import public_metadata, source_citation
+from .deadline import run_enrichment
+from .session_store import NO_HISTORY, format_message
+from .metrics import RETRIEVER_LATENCY, request_mode, timed_stage
+from .prompt_cache import expect_prefix
+from .token_usage import check_prompt_size
 
 logger = logging.getLogger(__name__)
 
 class AdvancedRAGService:
-    def __init__(self, llm: OllamaLLM, retriever, stock_service: Optional[StockService], web_search_service: Optional[WebSearchService]):
+    def __init__(self, llm: OllamaLLM, retriever, stock_service: Optional[StockService], web_search_service: Optional[WebSearchService], prompt_limits: Optional[Dict[str, int]] = None):
         self.llm = llm
+        self.prompt_limits = prompt_limits
         self.retriever = retriever
         self.stock_service = stock_service
         self.web_search_service = web_search_service
@@ -35,15 +43,17 @@ class AdvancedRAGService:
     def _build_chain(self):
         
 
+        @timed_stage("check_stock_needed")
         def check_stock_needed(inputs):
             query = inputs["question"]
             
             if self.stock_service:
-                needs_stock, tickers = self.stock_service.should_use_stock_api(query)
-                return {"question": query, "chat_history": inputs.get("chat_history", []), "needs_stock": needs_stock, "stock_tickers": tickers}
+                needs_stock, tickers = run_enrichment("check_stock_needed", self.stock_service.should_use_stock_api, query, default=(False, []))
+                return {**inputs, "needs_stock": needs_stock, "stock_tickers": tickers}
             else:
-                return {"question": query, "chat_history": inputs.get("chat_history", []), "needs_stock": False, "stock_tickers": []}
+                return {**inputs, "needs_stock": False, "stock_tickers": []}
 
+        @timed_stage("get_stock_data")
         def get_stock_data(inputs):
             if not inputs["needs_stock"] or not self.stock_service:
                 return {"stock_data": None, "stock_tickers": []}
@@ -54,21 +64,55 @@ class AdvancedRAGService:
                 return {"stock_data": None, "stock_tickers": []}
             
             stock_data = {}
-            
-            for ticker in tickers[:3]:
-                data = self.stock_service.get_stock_data(ticker)
-                stock_data[ticker] = data
+
+            def fetch_tickers():
+                return self.stock_service.get_stocks_data(tickers[:3], stock_data)
+
+            # when the deadline cuts the fetch short, answer with the tickers that did arrive
+            if run_enrichment("get_stock_data", fetch_tickers) is None:
+                stock_data = dict(stock_data) or None
             
             return {"stock_data": stock_data, "stock_tickers": tickers}
         
 
+        @timed_stage("retrieve_documents")
+        def retrieve_documents(inputs):
+            question = inputs["question"]
+            retrieved_docs = inputs.get("retrieved_docs")
+            if retrieved_docs is None:
+                with RETRIEVER_LATENCY.time(mode=request_mode.get()):
+                    if inputs.get("filters"):
+                        retrieved_docs = self.retriever.invoke(question, filters=inputs["filters"])
+                    else:
+                        retrieved_docs = self.retriever.invoke(question)
+
+            retrieval_signals = None
+            if self.web_search_service and self.web_search_service.is_available():
+                retrieval_signals = self.web_search_service.assess_retrieval(question, retrieved_docs)
+                logger.info(f"Retrieval assessment: {retrieval_signals}")
+            return {**inputs, "retrieved_docs": retrieved_docs, "retrieval_signals": retrieval_signals}
+
+        @timed_stage("get_rag_answer")
         def get_rag_answer(inputs):
             question = inputs["question"]
             chat_history = inputs.get("chat_history", [])
+            retrieval_signals = inputs.get("retrieval_signals")
             
             try:
 
-                retrieved_docs = self.retriever.invoke(question)
+                retrieved_docs = inputs["retrieved_docs"]
+                chat_context = inputs.get("chat_context")
+                if chat_context is None:
+                    chat_context = "".join(format_message(msg) for msg in chat_history) if chat_history else NO_HISTORY
+
+                # the RAG answer is the only prompt carrying the conversation, so follow-ups always get one
+                if retrieval_signals and retrieval_signals["decision"] == "out_of_corpus" and chat_context == NO_HISTORY:
+                    return {
+                        "rag_answer": "The reference document does not cover this question.",
+                        "rag_sources": [],
+                        "rag_skipped": True,
+                        "question": question
+                    }
                 
 
                 docs_content_parts = []
@@ -88,55 +132,36 @@ class AdvancedRAGService:
                 docs_content = "\n\n".join(docs_content_parts)
                 
 
-                chat_context = ""
-                if chat_history:
-                    for i, msg in enumerate(chat_history):
- 
-                        if isinstance(msg, dict):
-                            role = msg.get('role', 'unknown')
-                            content = msg.get('content', '')
-
-                            role = str(role)
-                            content = str(content)
-                        else:
-
-                            role = 'unknown'
-                            content = str(msg)
-                        
-                        chat_context += f"{role.capitalize()}: {content}\n"
-                else:
-                    chat_context = "No previous conversation."
-                
+                check_prompt_size("chat_context", chat_context, self.prompt_limits)
 
                 rag_prompt = ChatPromptTemplate.from_messages([
                     ("system", "You are a professional assistant for The Basics for Investing in Stocks by the Editors of Kiplinger's Personal Finance. Always answer questions directly and factually using the provided document context and chat history. If the answer is not in the context, say \"I am not sure about that.\" When asked about previous questions, use the chat history and never say you don't have access to it. CRITICAL: Always provide citations using [Page X] format when referencing information from the document. For example: 'According to the document [Page 3], stocks are...' or 'The basics of investing [Page 5] suggest that...'"),
-                    ("human", "Document Context:\n{context}\n\nChat History:\n{chat_history}\n\nQuestion: {question}")
+                    ("human", "Chat History:\n{chat_history}\n\nDocument Context:\n{context}\n\nQuestion: {question}")
                 ])
                 
 
-                rag_chain = rag_prompt | self.llm | StrOutputParser()
+                rag_chain = self.llm.with_config(run_name="rag_answer") | StrOutputParser()
                 
 
-                rag_answer = rag_chain.invoke({
+                # history ahead of the documents keeps the session's prompt prefix stable across turns
+                rag_messages = rag_prompt.invoke({
                     "context": str(docs_content),
                     "chat_history": str(chat_context), 
                     "question": str(question)
                 })
+                expect_prefix("rag_answer", rag_messages.to_string(), str(chat_context))
+                rag_answer = rag_chain.invoke(rag_messages)
                 
 
                 sources = []
                 for i, doc in enumerate(retrieved_docs):
                     page_number = doc.metadata.get('page', 'Unknown page')
-                    source_title = doc.metadata.get('source', 'The Basics for Investing in Stocks')
-                    base_url = "https://www.rld.nm.gov/wp-content/uploads/2021/06/IPT_Stocks_2012.pdf"
-                    if page_number and page_number != 'Unknown page':
-                        url = f"{base_url}#page={page_number}"
-                    else:
-                        url = base_url
+                    source_title, url = source_citation(doc.metadata)
                     sources.append({
                         "id": i + 1,
                         "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                        "metadata": doc.metadata,
+                        "metadata": public_metadata(doc.metadata),
+                        "score": doc.metadata.get("_score"),
                         "page": page_number,
                         "title": source_title,
                         "citation_text": f"[{i + 1}] {source_title}, Page {page_number}",
@@ -146,6 +171,7 @@ class AdvancedRAGService:
                 return {
                     "rag_answer": rag_answer,
                     "rag_sources": sources,
+                    "rag_skipped": False,
                     "docs_content": docs_content,
                     "chat_context": chat_context,
                     "question": question
@@ -154,18 +180,42 @@ class AdvancedRAGService:
             except Exception as e:
                 logger.error(f"Error in get_rag_answer: {e}")
                 raise
+
+        @timed_stage("start_web_search")
+        def start_web_search(inputs):
+            retrieval_signals = inputs.get("retrieval_signals")
+            if not retrieval_signals:
+                return None
+            if retrieval_signals["decision"] == "in_corpus" and not retrieval_signals["asks_for_current_info"]:
+                return None
+            return {"results": self._usable_web_results(run_enrichment("start_web_search", self.web_search_service.search, inputs["question"]))}
+
+        def merge_rag_branch(inputs):
+            early_search = inputs["web"]
+            return {
+                **inputs["rag"],
+                "early_web_search": early_search is not None,
+                "web_search_results": early_search["results"] if early_search else None
+            }
         
 
+        @timed_stage("check_web_search_needed")
         def check_web_search_needed(inputs):
             rag_answer = inputs["rag_answer"]
             question = inputs["question"]
 
-            needs_web_search = self.web_search_service.should_use_web_search(question, rag_answer) if self.web_search_service else False
+            if inputs.get("early_web_search"):
+                needs_web_search = False
+            else:
+                needs_web_search = self.web_search_service.should_use_web_search(question, rag_answer) if self.web_search_service else False
             return {
                 "needs_web_search": needs_web_search,
+                "early_web_search": inputs.get("early_web_search", False),
+                "web_search_results": inputs.get("web_search_results"),
                 "question": question,
                 "rag_answer": rag_answer,
                 "rag_sources": inputs["rag_sources"],
+                "rag_skipped": inputs.get("rag_skipped", False),
                 "stock_data": inputs.get("stock_data"),
                 "chat_history": inputs.get("chat_history", []),
                 "stock_tickers": inputs.get("stock_tickers", [])
@@ -173,6 +223,7 @@ class AdvancedRAGService:
             }
         
 
+        @timed_stage("combine_and_generate_final_answer")
         def combine_and_generate_final_answer(inputs):
             question = inputs["question"]
             rag_answer = inputs["rag_answer"]
@@ -206,7 +257,7 @@ class AdvancedRAGService:
 
             final_context = f"RAG_ANSWER: {rag_answer}\n\n"
             final_context += f"Services Used:\n"
-            final_context += f"- Document RAG: True\n"
+            final_context += f"- Document RAG: {not inputs.get('rag_skipped', False)}\n"
             final_context += f"- Stock API: {stock_api_actually_used}\n"
             final_context += f"- Web Search: {web_search_actually_used}\n\n"
             
@@ -214,41 +265,25 @@ class AdvancedRAGService:
             if stock_data:
                 final_context += "STOCK_API:\n"
                 for ticker, data in stock_data.items():
-                    if data:
-                        final_context += f"ticker: {ticker}\n"
-                        if data.get("news"):
-                            final_context += f"Recent News: {data['news'][:500]}...\n"
-                        if data.get("financials"):
-                            final_context += f"Financial Data: {str(data['financials'])[:500]}...\n"
-                        if data.get("data") and isinstance(data["data"], dict) and "error" not in data["data"]:
-                            price_data = data["data"]
-                            final_context += f"Current Price: ${price_data.get('current_price', 'N/A')}\n"
-                            final_context += f"Date: {price_data.get('date', 'N/A')}\n"
-                            final_context += f"Open: ${price_data.get('open_price', 'N/A')}\n"
-                            final_context += f"High: ${price_data.get('high_price', 'N/A')}\n"
-                            final_context += f"Low: ${price_data.get('low_price', 'N/A')}\n"
-                            final_context += f"Volume: {price_data.get('volume', 'N/A'):,}\n"
-                            final_context += f"Price Change: ${price_data.get('price_change', 'N/A')} ({price_data.get('price_change_percent', 'N/A')}%)\n"
-                        final_context += "\n"
+                    if data and data.get("prompt_block"):
+                        final_context += f"{data['prompt_block']}\n\n"
             
+            web_sources = []
             if web_search_actually_used:
                 web_results_content = web_search_results.get('results', '')
-                if isinstance(web_results_content, str):
-                    final_context += f"WEB_SEARCH_RESULTS: {web_results_content}\n\n"
-                elif isinstance(web_results_content, list):
-
-                    string_results = []
-                    for item in web_results_content:
-                        if isinstance(item, dict):
-
-                            string_results.append(str(item))
-                        else:
-                            string_results.append(str(item))
-                    final_context += f"WEB_SEARCH_RESULTS: {' '.join(string_results)}\n\n"
+                if isinstance(web_results_content, list):
+                    final_context += "WEB_SEARCH_RESULTS:\n"
+                    for i, item in enumerate(web_results_content):
+                        dated = f" ({item['date']})" if item.get("date") else ""
+                        final_context += f"[W{i + 1}] {item['title']}{dated}: {item['snippet']}\n"
+                        web_sources.append(web_source(len(rag_sources) + len(web_sources) + 1, item))
+                    final_context += "\n"
                 else:
                     final_context += f"WEB_SEARCH_RESULTS: {str(web_results_content)}\n\n"
 
 
+            check_prompt_size("final_context", final_context, self.prompt_limits)
+
             final_prompt = ChatPromptTemplate.from_messages([
                 ("system", """You are a comprehensive financial assistant. Provide clear, informative answers by combining information from multiple sources.
 
@@ -261,7 +296,7 @@ Guidelines:
 1. PRIORITY: If the question is about stock prices, market data, or specific companies, prioritize STOCK_API data over other sources
 2. Use RAG_ANSWER's data as your base and enhance it with additional information
 3. If STOCK_API's data is used incorporate the financial data naturally using [TICKER] format (for example [AAPL])
-4. If WEB_SEARCH_RESULTS's is used include current/recent information
+4. If WEB_SEARCH_RESULTS's is used include current/recent information; the [W1], [W2] labels only number the results, do not copy them into the answer
 5. CRITICAL: For document citations, use ONLY [Page X] format (for example [Page 1], [Page 5]) - do NOT use [1], [2], or any other format
 6. Write in a natural, conversational tone
 7. CRITICAL:Do NOT mention "RAG_ANSWER", "WEB_SEARCH_RESULTS", "STOCK_API", or "Services Used" in your response
@@ -275,7 +310,7 @@ Format your response as a natural, informative answer while preserving document
             ])
             
 
-            final_chain = final_prompt | self.llm | StrOutputParser()
+            final_chain = final_prompt | self.llm.with_config(run_name="final_answer") | StrOutputParser()
             
 
             final_answer = final_chain.invoke({
@@ -284,14 +319,14 @@ Format your response as a natural, informative answer while preserving document
             })
             
             services_used = {
-                "rag_used": True,
+                "rag_used": not inputs.get("rag_skipped", False),
                 "stock_api_used": stock_api_actually_used,
                 "web_search_used": web_search_actually_used
             }
             
             return {
                 "answer": final_answer,
-                "sources": rag_sources,
+                "sources": rag_sources + web_sources,
                 "services_used": services_used,
                 "stock_data": stock_data,
                 "web_search_results": web_search_results,
@@ -304,6 +339,9 @@ Format your response as a natural, informative answer while preserving document
                 "question": inputs["rag_info"].get("question", ""),
                 "rag_answer": inputs["rag_info"]["rag_answer"],
                 "rag_sources": inputs["rag_info"]["rag_sources"],
+                "rag_skipped": inputs["rag_info"].get("rag_skipped", False),
+                "early_web_search": inputs["rag_info"].get("early_web_search", False),
+                "web_search_results": inputs["rag_info"].get("web_search_results"),
                 "stock_data": inputs["stock_info"]["stock_data"],
                 "stock_tickers": inputs["stock_info"].get("stock_tickers", []),
                 "chat_history": inputs.get("chat_history", [])
@@ -311,35 +349,33 @@ Format your response as a natural, informative answer while preserving document
             
             return merged
         
+        @timed_stage("add_web_search_results")
         def add_web_search_results(inputs):
+            if inputs.get("early_web_search"):
+                return inputs
             if inputs.get("needs_web_search", False) and self.web_search_service:
-                web_results = self.web_search_service.search(inputs["question"])
-                
-                if web_results and "error" not in web_results:
-
-                    has_results = False
-                    if web_results.get("results"):
-                        results_content = web_results.get("results")
-                        if isinstance(results_content, str) and len(results_content.strip()) > 0:
-                            has_results = True
-                        elif isinstance(results_content, list) and len(results_content) > 0:
-                            has_results = True
-                    
-                    if has_results:
-                        inputs["web_search_results"] = web_results
-                    else:
-                        inputs["web_search_results"] = None
-                else:
-                    inputs["web_search_results"] = None
+                inputs["web_search_results"] = self._usable_web_results(run_enrichment("add_web_search_results", self.web_search_service.search, inputs["question"]))
             else:
                 inputs["web_search_results"] = None
             return inputs
+
+        rag_branch = (
+            RunnableLambda(retrieve_documents)
+            | RunnableParallel({
+                "rag": RunnableLambda(get_rag_answer),
+                "web": RunnableLambda(start_web_search),
+            })
+            | RunnableLambda(merge_rag_branch)
+        )
         
+        # ticker detection is an LLM call of its own, so it runs next to retrieval and the RAG answer
+        # instead of in front of them, and the stock fetch starts as soon as the tickers are known
+        stock_branch = RunnableLambda(check_stock_needed) | RunnableLambda(get_stock_data)
+
         chain = (
-            RunnableLambda(check_stock_needed)
-            | RunnableParallel({
-                "stock_info": RunnableLambda(get_stock_data),
-                "rag_info": RunnableLambda(get_rag_answer),
+            RunnableParallel({
+                "stock_info": stock_branch,
+                "rag_info": rag_branch,
             })
             | RunnableLambda(merge_parallel_outputs)
             | RunnableLambda(check_web_search_needed)
@@ -349,12 +385,25 @@ Format your response as a natural, informative answer while preserving document
         
         return chain
     
-    def get_answer(self, question: str, chat_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    def _usable_web_results(self, web_results: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not web_results or "error" in web_results:
+            return None
+        results_content = web_results.get("results")
+        if isinstance(results_content, str) and len(results_content.strip()) > 0:
+            return web_results
+        if isinstance(results_content, list) and len(results_content) > 0:
+            return web_results
+        return None
+
+    def get_answer(self, question: str, chat_history: Optional[List[Dict[str, str]]] = None, retrieved_docs: Optional[List[Document]] = None, chat_context: Optional[str] = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         try:
 
             inputs = {
                 "question": question,
-                "chat_history": chat_history or []
+                "chat_history": chat_history or [],
+                "retrieved_docs": retrieved_docs,
+                "chat_context": chat_context,
+                "filters": filters
             }
             
 
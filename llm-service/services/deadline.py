@@ -0,0 +1,171 @@
+"""
+deadline.py
+
+What is this file for: Gives every chat request a wall-clock deadline shared by all pipeline stages, so slow dependencies degrade the answer instead of stretching the request.
+
+What the flow of the functions are: deadline_scope() publishes the request's Deadline through a context variable, run_enrichment() runs an optional stage only while its share of the remaining time lasts, and generation_cap() and generation_budget() bound LLM output length and time; degrade() records every skipped or cut-short stage.
+
+How this service is used: main.py opens a deadline_scope() around each chat pipeline call, the advanced RAG service wraps its stock and web search stages in run_enrichment(), and ScheduledLLM caps generations to the remaining budget.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+import contextvars
+import logging
+import threading
+import time
+
+from .metrics import DEADLINE_DEGRADED_TOTAL
+from .profiler import profiled_thread
+
+logger = logging.getLogger(__name__)
+
+# share of the remaining time each stage may use
+STAGE_SHARES = {
+    "check_stock_needed": 0.15,
+    "get_stock_data": 0.3,
+    "start_web_search": 0.3,
+    "add_web_search_results": 0.25,
+}
+
+# answer generations by run_name; the advanced RAG answer leaves room for the final answer after it
+GENERATION_SHARES = {
+    "rag_answer": 0.45,
+    "answer": 0.9,
+    "final_answer": 0.9,
+}
+
+# RunnableParallel branches and copy_context() workers inherit the request's deadline
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+# abandoned enrichments keep running until their client returns, the request just stops waiting for them; each
+# stage has its own pool and stops taking calls while it is full, so a slow dependency cannot starve the others
+STAGE_MAX_IN_FLIGHT = 8
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_in_flight: Dict[str, int] = {}
+_executors_lock = threading.Lock()
+
+
+class DeadlineExceededError(Exception):
+    def __init__(self, stage: str, degraded_stages: List[Dict[str, Any]]):
+        super().__init__(f"Request deadline exceeded while waiting for {stage}")
+        self.stage = stage
+        self.degraded_stages = degraded_stages
+
+
+class Deadline:
+    def __init__(self, budget_seconds: float, min_stage_seconds: float = 0.5, tokens_per_second: float = 20.0, min_tokens: int = 64, answer_tokens: int = 512):
+        self.budget_seconds = budget_seconds
+        self.min_stage_seconds = min_stage_seconds
+        self.tokens_per_second = tokens_per_second
+        self.min_tokens = min_tokens
+        self.answer_tokens = answer_tokens
+        self.started = time.perf_counter()
+        self.expires_at = self.started + budget_seconds
+        self._degraded: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.perf_counter())
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def stage_budget(self, stage: str) -> float:
+        return self.remaining() * STAGE_SHARES.get(stage, 1.0)
+
+    def degrade(self, stage: str, reason: str, **details):
+        entry = {"stage": stage, "reason": reason, "at_seconds": round(self.elapsed(), 3), **details}
+        with self._lock:
+            self._degraded.append(entry)
+        DEADLINE_DEGRADED_TOTAL.inc(stage=stage, reason=reason)
+        logger.warning(f"Deadline degraded {stage}: {reason} ({self.remaining():.2f}s of {self.budget_seconds}s left)")
+
+    def degraded_stages(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._degraded)
+
+
+@contextmanager
+def deadline_scope(budget_seconds: Optional[float], **options):
+    if not budget_seconds or budget_seconds <= 0:
+        yield None
+        return
+    deadline = Deadline(budget_seconds, **options)
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def _run_profiled(func: Callable, *args):
+    with profiled_thread():
+        return func(*args)
+
+
+def _release(stage: str, _future):
+    with _executors_lock:
+        _in_flight[stage] -= 1
+
+
+def _submit(stage: str, func: Callable, *args) -> Optional[Future]:
+    with _executors_lock:
+        if _in_flight.get(stage, 0) >= STAGE_MAX_IN_FLIGHT:
+            return None
+        executor = _executors.get(stage)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=STAGE_MAX_IN_FLIGHT, thread_name_prefix=f"deadline-{stage}")
+            _executors[stage] = executor
+        _in_flight[stage] = _in_flight.get(stage, 0) + 1
+    future = executor.submit(contextvars.copy_context().run, _run_profiled, func, *args)
+    future.add_done_callback(lambda done: _release(stage, done))
+    return future
+
+
+def run_enrichment(stage: str, func: Callable, *args, default: Any = None):
+    deadline = current_deadline.get()
+    if deadline is None:
+        return func(*args)
+
+    budget = deadline.stage_budget(stage)
+    if budget < deadline.min_stage_seconds:
+        deadline.degrade(stage, "skipped", budget_seconds=round(budget, 3))
+        return default
+
+    future = _submit(stage, func, *args)
+    if future is None:
+        deadline.degrade(stage, "saturated", max_in_flight=STAGE_MAX_IN_FLIGHT)
+        return default
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeoutError:
+        deadline.degrade(stage, "timed_out", budget_seconds=round(budget, 3))
+        return default
+    except DeadlineExceededError:
+        return default
+
+
+def generation_cap(call_name: str, default_tokens: Optional[int] = None) -> Optional[int]:
+    deadline = current_deadline.get()
+    if deadline is None or call_name not in GENERATION_SHARES:
+        return None
+
+    normal_tokens = default_tokens if default_tokens is not None and default_tokens > 0 else deadline.answer_tokens
+    # only cap when the time left could not fit an answer of normal length, generation_budget() bounds the rest
+    if deadline.remaining() * deadline.tokens_per_second >= normal_tokens:
+        return None
+    budget = deadline.remaining() * GENERATION_SHARES[call_name]
+    tokens = max(deadline.min_tokens, int(budget * deadline.tokens_per_second))
+    if tokens >= normal_tokens:
+        return None
+    deadline.degrade(call_name, "generation_capped", max_tokens=tokens, budget_seconds=round(budget, 3))
+    return tokens
+
+
+def generation_budget(call_name: str) -> Optional[float]:
+    deadline = current_deadline.get()
+    if deadline is None or call_name not in GENERATION_SHARES:
+        return None
+    return deadline.remaining() * GENERATION_SHARES[call_name]
@@ -1,11 +1,11 @@
 """
 document_processor.py
 
-What is this file for: Processes PDF documents into chunks for vector storage and manages document loading from text files.
+What is this file for: Processes PDF and text documents into chunks for vector storage and manages document loading from text files.
 
-What the flow of the functions are: process_pdf() loads PDF pages, splits them into chunks with metadata, and saves to text file, while load_from_txt() reads pre-processed chunks from text files for faster loading.
+What the flow of the functions are: process_pdf() and split_text() split documents into chunks carrying the document's metadata, load_from_txt() reads pre-processed chunks from text files for faster loading, and source_citation() builds the title and URL a source points to.
 
-How this service is used: Called during LLM service initialization to prepare the reference document for RAG operations and vector storage.
+How this service is used: Called during LLM service initialization to prepare the reference document and by the ingestion queue for uploaded documents.
 """
 
 import logging
@@ -17,6 +17,28 @@ import os
 
 logger = logging.getLogger(__name__)
 
+REFERENCE_DOCUMENT_METADATA = {
+    'title': 'The Basics for Investing in Stocks',
+    'url': 'https://www.rld.nm.gov/wp-content/uploads/2021/06/IPT_Stocks_2012.pdf',
+    'doc_type': 'guide',
+    'date': '2012-01-01',
+}
+
+
+def source_citation(metadata: dict) -> tuple:
+    title = metadata.get('title') or metadata.get('source') or REFERENCE_DOCUMENT_METADATA['title']
+    # chunks indexed before documents carried their own url belong to the reference document
+    base_url = metadata.get('url') if 'url' in metadata else REFERENCE_DOCUMENT_METADATA['url']
+    page_number = metadata.get('page', 'Unknown page')
+    if base_url and page_number and page_number not in ('Unknown', 'Unknown page'):
+        return title, f"{base_url}#page={page_number}"
+    return title, base_url
+
+
+def public_metadata(metadata: dict) -> dict:
+    # retrieval adds _score, _id and _collection_name for the service's own use
+    return {key: value for key, value in metadata.items() if not key.startswith('_')}
+
 # Storing the chunks into a text file and also loading it from there
 # to keep track of page number easier from pdf
 
@@ -31,7 +53,7 @@ class DocumentProcessor:
             separators=["\n\n", "\n", " ", ""]
         )
     
-    def process_pdf(self, pdf_path: str) -> list[Document]:
+    def process_pdf(self, pdf_path: str, txt_path: str = "reference_doc_chunks.txt", source_name: Optional[str] = None, document_metadata: Optional[dict] = None) -> list[Document]:
         try:
             logger.info(f"Loading PDF: {pdf_path}")
             
@@ -45,7 +67,8 @@ class DocumentProcessor:
             logger.info(f"Loaded {len(pages)} pages from PDF")
             
 
-            txt_path = "reference_doc_chunks.txt"
+            if source_name is None:
+                source_name = os.path.basename(pdf_path)
 
             all_chunks = []
             chunk_id = 0
@@ -70,8 +93,9 @@ class DocumentProcessor:
                                 page_content=chunk,
                                 metadata={
                                     'page': str(page_num),
-                                    'source': os.path.basename(pdf_path),
-                                    'chunk_id': chunk_id
+                                    'source': source_name,
+                                    'chunk_id': chunk_id,
+                                    **(document_metadata or {})
                                 }
                             )
                             all_chunks.append(doc)
@@ -86,7 +110,29 @@ class DocumentProcessor:
             logger.error(f"Error processing PDF: {e}")
             raise
     
-    def load_from_txt(self, txt_path: str, source_name: Optional[str] = None) -> list[Document]:
+    def split_text(self, text: str, source_name: str, document_metadata: Optional[dict] = None) -> list[Document]:
+        # form feeds mark page breaks in text exported from PDFs, otherwise the whole text is page 1
+        pages = text.split('\f') if '\f' in text else [text]
+        all_chunks = []
+        chunk_id = 0
+        for page_num, content in enumerate(pages, start=1):
+            if not content.strip():
+                continue
+            for chunk in self.text_splitter.split_text(content):
+                chunk_id += 1
+                all_chunks.append(Document(
+                    page_content=chunk,
+                    metadata={
+                        'page': str(page_num),
+                        'source': source_name,
+                        'chunk_id': chunk_id,
+                        **(document_metadata or {})
+                    }
+                ))
+        logger.info(f"Split {source_name} into {len(all_chunks)} chunks")
+        return all_chunks
+
+    def load_from_txt(self, txt_path: str, source_name: Optional[str] = None, document_metadata: Optional[dict] = None) -> list[Document]:
         try:
             logger.info(f"Loading chunks from text file: {txt_path}")
             
@@ -124,7 +170,8 @@ class DocumentProcessor:
                         metadata={
                             'page': page_num,
                             'source': source_name,
-                            'chunk_id': chunk_id
+                            'chunk_id': chunk_id,
+                            **(document_metadata or {})
                         }
                     )
                     all_chunks.append(doc)
@@ -0,0 +1,123 @@
+"""
+embedding_cache.py
+
+What is this file for: Bounded, thread-safe LRU cache for query embeddings so repeated questions do not pay for another Ollama embedding call.
+
+What the flow of the functions are: CachedEmbeddings.embed_query() and embed_queries() look up vectors keyed on the embedding model and the normalized query text, only embed the misses, and store them with a TTL while evicting the least recently used entries; embed_documents() is passed straight through so indexing is never cached; stats() reports hit rate and size.
+
+How this service is used: VectorStoreService wraps its embeddings with CachedEmbeddings, so the retriever shared by RAGService and AdvancedRAGService and the batch endpoint all hit the same cache.
+"""
+
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from typing import List, Optional, Tuple
+import threading
+import time
+
+from .metrics import EMBEDDING_CACHE_ENTRIES, EMBEDDING_CACHE_REQUESTS, EMBEDDING_LATENCY, request_mode
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 2048, ttl_seconds: Optional[float] = 3600.0):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _key(self, text: str) -> Tuple[str, str]:
+        return (self.model_name, normalize_query(text))
+
+    def _get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            vector, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self._misses += 1
+                EMBEDDING_CACHE_ENTRIES.set(len(self._entries))
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return vector
+
+    def _put(self, key: Tuple[str, str], vector: List[float]):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._entries[key] = (list(vector), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            EMBEDDING_CACHE_ENTRIES.set(len(self._entries))
+
+    def embed_query(self, text: str) -> List[float]:
+        started = time.perf_counter()
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is not None:
+            EMBEDDING_CACHE_REQUESTS.inc(result="hit")
+            EMBEDDING_LATENCY.observe(time.perf_counter() - started, operation="query", mode=request_mode.get(), cache="hit")
+            return list(vector)
+
+        EMBEDDING_CACHE_REQUESTS.inc(result="miss")
+        vector = self.embeddings.embed_query(text)
+        self._put(key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        keys = [self._key(text) for text in texts]
+        vectors = [self._get(key) for key in keys]
+
+        missing = {}
+        for text, key, vector in zip(texts, keys, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+        hits = len(texts) - sum(1 for vector in vectors if vector is None)
+        if hits:
+            EMBEDDING_CACHE_REQUESTS.inc(hits, result="hit")
+            EMBEDDING_LATENCY.observe(time.perf_counter() - started, operation="query_batch", mode=request_mode.get(), cache="hit")
+
+        if missing:
+            EMBEDDING_CACHE_REQUESTS.inc(len(texts) - hits, result="miss")
+            if hasattr(self.embeddings, "embed_queries"):
+                embedded = self.embeddings.embed_queries(list(missing.values()))
+            else:
+                embedded = self.embeddings.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), embedded))
+            for key, vector in fresh.items():
+                self._put(key, vector)
+            vectors = [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+
+        return [list(vector) for vector in vectors]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            EMBEDDING_CACHE_ENTRIES.set(0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,247 @@
+"""
+financial_records.py
+
+What is this file for: Turns raw Polygon financials and ticker news into compact typed records and token-budgeted prompt blocks.
+
+What the flow of the functions are: parse_financials() reads the latest period's key metrics and growth into a FinancialSnapshot, parse_news() builds a deduplicated NewsDigest, and PromptBlockCache.render() formats a ticker's data into a prompt block, reusing it while the data is unchanged.
+
+How this service is used: StockService parses financials and news through this module, and the advanced RAG service puts the rendered block into the final answer prompt.
+"""
+
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from .session_store import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# (statement, Polygon field, label) in the order they are worth spending tokens on
+KEY_METRICS = [
+    ("income_statement", "revenues", "Revenue"),
+    ("income_statement", "net_income_loss", "Net income"),
+    ("income_statement", "diluted_earnings_per_share", "Diluted EPS"),
+    ("income_statement", "gross_profit", "Gross profit"),
+    ("income_statement", "operating_income_loss", "Operating income"),
+    ("cash_flow_statement", "net_cash_flow_from_operating_activities", "Operating cash flow"),
+    ("balance_sheet", "assets", "Total assets"),
+    ("balance_sheet", "liabilities", "Total liabilities"),
+    ("balance_sheet", "equity", "Equity"),
+]
+
+
+@dataclass
+class FinancialSnapshot:
+    ticker: str
+    fiscal_period: str
+    fiscal_year: str
+    end_date: Optional[str] = None
+    company_name: Optional[str] = None
+    metrics: Dict[str, float] = field(default_factory=dict)
+    revenue_growth_percent: Optional[float] = None
+    net_income_growth_percent: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class Headline:
+    title: str
+    published: str
+    publisher: Optional[str] = None
+    sentiment: Optional[str] = None
+
+
+@dataclass
+class NewsDigest:
+    ticker: str
+    headlines: List[Headline] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _load_results(raw: Any) -> List[dict]:
+    if hasattr(raw, "content"):
+        raw = raw.content
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return []
+    if isinstance(raw, dict):
+        raw = raw.get("results", [])
+    return [item for item in raw or [] if isinstance(item, dict)]
+
+
+def _metric_values(result: dict) -> Dict[str, float]:
+    statements = result.get("financials") or {}
+    values = {}
+    for statement, key, label in KEY_METRICS:
+        value = (statements.get(statement) or {}).get(key, {}).get("value")
+        if isinstance(value, (int, float)):
+            values[label] = float(value)
+    return values
+
+
+def _growth(current: Optional[float], previous: Optional[float]) -> Optional[float]:
+    if current is None or not previous:
+        return None
+    return round((current - previous) / abs(previous) * 100, 2)
+
+
+def parse_financials(ticker: str, raw: Any) -> Optional[FinancialSnapshot]:
+    results = sorted(_load_results(raw), key=lambda item: item.get("end_date") or "", reverse=True)
+    if not results:
+        return None
+
+    latest = results[0]
+    metrics = _metric_values(latest)
+    # the same fiscal period a year earlier gives a like-for-like growth figure
+    previous = next(
+        (item for item in results[1:] if item.get("fiscal_period") == latest.get("fiscal_period")),
+        None,
+    )
+    previous_metrics = _metric_values(previous) if previous else {}
+
+    return FinancialSnapshot(
+        ticker=ticker,
+        fiscal_period=str(latest.get("fiscal_period", "")),
+        fiscal_year=str(latest.get("fiscal_year", "")),
+        end_date=latest.get("end_date"),
+        company_name=latest.get("company_name"),
+        metrics=metrics,
+        revenue_growth_percent=_growth(metrics.get("Revenue"), previous_metrics.get("Revenue")),
+        net_income_growth_percent=_growth(metrics.get("Net income"), previous_metrics.get("Net income")),
+    )
+
+
+def _normalize_title(title: str) -> str:
+    return re.sub(r"[^a-z0-9 ]", "", " ".join(title.lower().split()))
+
+
+def parse_news(ticker: str, raw: Any, max_headlines: int = 8) -> NewsDigest:
+    items = sorted(_load_results(raw), key=lambda item: item.get("published_utc") or "", reverse=True)
+    headlines = []
+    seen = set()
+    for item in items:
+        title = " ".join(str(item.get("title", "")).split())
+        key = _normalize_title(title)
+        if not title or key in seen:
+            continue
+        seen.add(key)
+        sentiment = next(
+            (insight.get("sentiment") for insight in item.get("insights") or [] if insight.get("ticker") == ticker),
+            None,
+        )
+        headlines.append(Headline(
+            title=title,
+            published=str(item.get("published_utc", ""))[:10],
+            publisher=(item.get("publisher") or {}).get("name"),
+            sentiment=sentiment,
+        ))
+        if len(headlines) >= max_headlines:
+            break
+    return NewsDigest(ticker=ticker, headlines=headlines)
+
+
+def _format_amount(value: float) -> str:
+    magnitude = abs(value)
+    if magnitude >= 1e9:
+        return f"${value / 1e9:.2f}B"
+    if magnitude >= 1e6:
+        return f"${value / 1e6:.1f}M"
+    if magnitude < 100:
+        return f"{value:.2f}"
+    return f"${value:,.0f}"
+
+
+def _price_lines(price_data: dict, analytics: dict) -> List[str]:
+    lines = []
+    if price_data:
+        volume = price_data.get('volume')
+        volume_text = f"{volume:,}" if isinstance(volume, (int, float)) else "N/A"
+        lines.append(
+            f"Price {price_data.get('date', 'N/A')}: close ${price_data.get('current_price', 'N/A')}, "
+            f"open ${price_data.get('open_price', 'N/A')}, high ${price_data.get('high_price', 'N/A')}, "
+            f"low ${price_data.get('low_price', 'N/A')}, change {price_data.get('price_change_percent', 'N/A')}%, volume {volume_text}"
+        )
+    if analytics:
+        returns = ", ".join(f"{horizon} {value}%" for horizon, value in analytics.get("returns_percent", {}).items())
+        if returns:
+            lines.append(f"Returns: {returns}")
+        averages = ", ".join(f"{name.upper()} ${value}" for name, value in analytics.get("moving_averages", {}).items())
+        if averages:
+            lines.append(f"Moving averages: {averages}")
+        volatility = analytics.get("volatility_percent", {})
+        lines.append(f"Annualized volatility: 20d {volatility.get('20d')}%, 1y {volatility.get('1y')}%")
+        lines.append(f"52-week range: ${analytics.get('low_52w')} - ${analytics.get('high_52w')}; drawdown {analytics.get('current_drawdown_percent')}% (max {analytics.get('max_drawdown_percent')}% since {analytics.get('first_date')})")
+    return lines
+
+
+def _financial_lines(snapshot: Optional[FinancialSnapshot]) -> List[str]:
+    if not snapshot or not snapshot.metrics:
+        return []
+    period = f"{snapshot.fiscal_period} {snapshot.fiscal_year}".strip()
+    lines = [f"Financials ({period}, ended {snapshot.end_date or 'N/A'}): " + ", ".join(
+        f"{label} {_format_amount(value)}" for label, value in snapshot.metrics.items()
+    )]
+    growth = []
+    if snapshot.revenue_growth_percent is not None:
+        growth.append(f"revenue {snapshot.revenue_growth_percent:+}%")
+    if snapshot.net_income_growth_percent is not None:
+        growth.append(f"net income {snapshot.net_income_growth_percent:+}%")
+    if growth:
+        lines.append("Year-over-year: " + ", ".join(growth))
+    return lines
+
+
+def _news_lines(digest: Optional[NewsDigest]) -> List[str]:
+    if not digest or not digest.headlines:
+        return []
+    lines = ["Recent news:"]
+    for headline in digest.headlines:
+        details = ", ".join(part for part in (headline.published, headline.publisher, headline.sentiment) if part)
+        lines.append(f"- {headline.title} ({details})")
+    return lines
+
+
+class PromptBlockCache:
+    def __init__(self, max_tokens: int = 300):
+        self.max_tokens = max_tokens
+        self._blocks: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def render(self, ticker: str, price_data: Optional[dict] = None, analytics: Optional[dict] = None, financials: Optional[FinancialSnapshot] = None, news: Optional[NewsDigest] = None) -> str:
+        fingerprint = hashlib.sha1(json.dumps([
+            price_data or {}, analytics or {},
+            financials.to_dict() if financials else None,
+            news.to_dict() if news else None,
+        ], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+        with self._lock:
+            cached = self._blocks.get(ticker)
+            if cached and cached[0] == fingerprint:
+                return cached[1]
+
+        lines = [f"ticker: {ticker}"]
+        budget = self.max_tokens - estimate_tokens(lines[0])
+        # price and performance first, then fundamentals, then headlines until the budget runs out
+        for line in _price_lines(price_data or {}, analytics or {}) + _financial_lines(financials) + _news_lines(news):
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        if lines[-1] == "Recent news:":
+            lines.pop()
+        block = "\n".join(lines)
+
+        with self._lock:
+            self._blocks[ticker] = (fingerprint, block)
+        return block
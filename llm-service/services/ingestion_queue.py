@@ -0,0 +1,236 @@
+"""
+ingestion_queue.py
+
+What is this file for: Runs document ingestion for uploaded PDFs and text files on background workers so uploads never run on the chat request path.
+
+What the flow of the functions are: IngestionQueue.submit() stores the uploaded file and queues an IngestionJob, and the worker threads parse it with DocumentProcessor in a separate process, index the chunks in small batches and delete the file; get_job() and list_jobs() report each job's status and timings.
+
+How this service is used: main.py creates the queue after the vector store is ready and exposes it through the /documents endpoints.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Callable, List, Optional
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+from .document_processor import DocumentProcessor
+from .metrics import INGESTION_JOBS_TOTAL, INGESTION_STAGE_LATENCY, INGESTION_YIELD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {".pdf": "pdf", ".txt": "text", ".md": "text"}
+
+
+class IngestionQueueFullError(Exception):
+    pass
+
+
+class IngestionJob:
+    def __init__(self, filename: str, path: str, file_type: str, metadata: Optional[dict] = None):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.path = path
+        self.file_type = file_type
+        self.metadata = metadata or {}
+        self.status = "queued"
+        self.stage = None
+        self.chunks_total = 0
+        self.chunks_indexed = 0
+        self.stage_timings = {}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "file_type": self.file_type,
+            "metadata": self.metadata,
+            "status": self.status,
+            "stage": self.stage,
+            "chunks_total": self.chunks_total,
+            "chunks_indexed": self.chunks_indexed,
+            "progress": round(self.chunks_indexed / self.chunks_total, 4) if self.chunks_total else 0.0,
+            "stage_timings": self.stage_timings,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _parse_document(path: str, file_type: str, filename: str, metadata: dict, chunk_size: int, chunk_overlap: int) -> list:
+    processor = DocumentProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if file_type == "pdf":
+        return processor.process_pdf(path, txt_path=f"{path}.chunks.txt", source_name=filename, document_metadata=metadata)
+    with open(path, "r", encoding="utf-8", errors="replace") as text_file:
+        return processor.split_text(text_file.read(), filename, metadata)
+
+
+def _safe_filename(filename: str) -> str:
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(filename or "upload"))
+    return name[:120] or "upload"
+
+
+class IngestionQueue:
+    def __init__(self, vector_store_service, upload_dir: str = "../uploads", max_workers: int = 1, max_queued: int = 50, batch_size: int = 32, busy: Optional[Callable[[], bool]] = None, max_yield_seconds: float = 5.0, max_jobs_kept: int = 200):
+        self.vector_store_service = vector_store_service
+        self.upload_dir = upload_dir
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.busy = busy or (lambda: False)
+        self.max_yield_seconds = max_yield_seconds
+        self.max_jobs_kept = max_jobs_kept
+        self.chunk_size = 800
+        self.chunk_overlap = 150
+        # parsing holds the GIL for the whole document, so it runs in separate processes instead of next to the request handlers
+        self._parsers: Optional[ProcessPoolExecutor] = None
+        self._queue: "queue.Queue[IngestionJob]" = queue.Queue()
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers: List[threading.Thread] = []
+
+        os.makedirs(upload_dir, exist_ok=True)
+
+    def start(self):
+        if self._parsers is None:
+            # spawn, not fork: the service process runs many threads whose locks a forked child could inherit held
+            self._parsers = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._run, name=f"ingestion-worker-{len(self._workers) + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Ingestion queue started with {self.max_workers} worker(s)")
+
+    def stop(self):
+        if self._parsers is not None:
+            self._parsers.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, filename: str, data: bytes, title: Optional[str] = None, url: Optional[str] = None, doc_type: Optional[str] = None, published: Optional[str] = None) -> IngestionJob:
+        extension = os.path.splitext(filename or "")[1].lower()
+        file_type = SUPPORTED_EXTENSIONS.get(extension)
+        if file_type is None:
+            raise ValueError(f"Unsupported file type '{extension or filename}', expected one of {sorted(SUPPORTED_EXTENSIONS)}")
+        if self._queue.qsize() >= self.max_queued:
+            raise IngestionQueueFullError(f"Ingestion queue is full ({self.max_queued} jobs waiting)")
+
+        metadata = {
+            "title": title or filename,
+            "url": url,
+            "doc_type": doc_type or "upload",
+            "date": published or date.today().isoformat(),
+        }
+        job = IngestionJob(filename, "", file_type, metadata)
+        job.path = os.path.join(self.upload_dir, f"{job.job_id}_{_safe_filename(filename)}")
+        with open(job.path, "wb") as upload:
+            upload.write(data)
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs_kept:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.status in ("queued", "processing"):
+                    break
+                self._jobs.pop(oldest_id)
+        self._queue.put(job)
+        logger.info(f"Queued ingestion job {job.job_id} for {filename} ({len(data)} bytes)")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list_jobs(self) -> List[dict]:
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.max_workers,
+            "queued": self._queue.qsize(),
+            "processing": statuses.count("processing"),
+            "completed": statuses.count("completed"),
+            "failed": statuses.count("failed"),
+        }
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _timed(self, job: IngestionJob, stage: str, func, *args):
+        job.stage = stage
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            job.stage_timings[stage] = round(job.stage_timings.get(stage, 0.0) + elapsed, 4)
+            INGESTION_STAGE_LATENCY.observe(elapsed, stage=stage)
+
+    def _yield_to_chat(self):
+        started = time.perf_counter()
+        while self.busy() and time.perf_counter() - started < self.max_yield_seconds:
+            time.sleep(0.05)
+        waited = time.perf_counter() - started
+        if waited > 0.01:
+            INGESTION_YIELD_SECONDS.inc(waited)
+
+    def _parse(self, job: IngestionJob):
+        return self._parsers.submit(_parse_document, job.path, job.file_type, job.filename, job.metadata, self.chunk_size, self.chunk_overlap).result()
+
+    def _remove_files(self, job: IngestionJob):
+        # the chunks are in the vector store once a job finishes, and a failed job is resubmitted as a new upload
+        for path in (job.path, f"{job.path}.chunks.txt"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove {path} for ingestion job {job.job_id}: {e}")
+
+    def _process(self, job: IngestionJob):
+        job.status = "processing"
+        job.started_at = time.time()
+        try:
+            chunks = self._timed(job, "parse", self._parse, job)
+            for chunk in chunks:
+                chunk.metadata["job_id"] = job.job_id
+            job.chunks_total = len(chunks)
+
+            # embedding competes with chat requests for Ollama, so each batch waits while they are in flight
+            for i in range(0, len(chunks), self.batch_size):
+                self._timed(job, "yield", self._yield_to_chat)
+                batch = chunks[i:i + self.batch_size]
+                if not self._timed(job, "index", self.vector_store_service.add_documents, batch):
+                    raise RuntimeError("Vector store rejected the documents, see the service log for details")
+                job.chunks_indexed += len(batch)
+
+            job.status = "completed"
+            logger.info(f"Ingestion job {job.job_id} indexed {job.chunks_total} chunks from {job.filename}")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Ingestion job {job.job_id} failed: {e}")
+        finally:
+            self._remove_files(job)
+            job.stage = None
+            job.finished_at = time.time()
+            INGESTION_JOBS_TOTAL.inc(status=job.status)
@@ -0,0 +1,203 @@
+"""
+llm_scheduler.py
+
+What is this file for: Bounds how many Ollama generations run at once, orders waiting calls by priority, and sheds new work when the queue is too deep.
+
+What the flow of the functions are: LLMScheduler.acquire() admits a call when a slot is free and it is at the head of the priority queue, check_admission() rejects new requests when the queue is full, and ScheduledLLM routes every invoke() through the scheduler and records its token usage.
+
+How this service is used: main.py wraps the single OllamaLLM in ScheduledLLM before handing it to the RAG, advanced RAG and stock services, and converts SchedulerOverloadedError into 429 responses with Retry-After.
+"""
+
+from contextlib import contextmanager
+from langchain_core.runnables import Runnable
+from typing import Any, Optional
+import contextvars
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+
+from .deadline import DeadlineExceededError, current_deadline, generation_budget, generation_cap
+from .metrics import LLM_ACTIVE_CALLS, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_SHED_TOTAL, track_external_call
+from .prompt_cache import record_prefix
+from .token_usage import GenerationInfoCapture, record_generation, with_capture
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSIFY = 0
+PRIORITY_IN_PROGRESS = 1
+PRIORITY_NEW = 2
+PRIORITY_BATCH = 3
+
+CLASSIFICATION_CALLS = {"ticker_classification"}
+
+# number of LLM calls already completed by the current request, shared with RunnableParallel threads
+_request_llm_calls = contextvars.ContextVar("request_llm_calls", default=None)
+
+
+# bulk requests like /chat/batch queue behind interactive ones, whatever their progress
+_batch_request = contextvars.ContextVar("batch_request", default=False)
+
+
+def start_request_tracking():
+    _request_llm_calls.set([0])
+
+
+def start_batch_tracking():
+    _batch_request.set(True)
+
+
+class SchedulerOverloadedError(Exception):
+    def __init__(self, retry_after: int, queue_depth: int):
+        super().__init__(f"LLM scheduler overloaded ({queue_depth} calls queued), retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = 2, max_queue_depth: int = 16, max_wait_seconds: Optional[float] = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue_depth = max_queue_depth
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._avg_service_seconds = 2.0
+
+    def priority_for(self, call_name: str) -> int:
+        if _batch_request.get():
+            return PRIORITY_BATCH
+        if call_name in CLASSIFICATION_CALLS:
+            return PRIORITY_CLASSIFY
+        calls = _request_llm_calls.get()
+        if calls is not None and calls[0] > 0:
+            return PRIORITY_IN_PROGRESS
+        return PRIORITY_NEW
+
+    def retry_after(self) -> int:
+        with self._cond:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self) -> int:
+        waiting = len(self._queue) + 1
+        return max(1, math.ceil(waiting * self._avg_service_seconds / self.max_concurrency))
+
+    def check_admission(self):
+        with self._cond:
+            if len(self._queue) >= self.max_queue_depth:
+                LLM_SHED_TOTAL.inc(reason="admission")
+                raise SchedulerOverloadedError(self._retry_after_locked(), len(self._queue))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": len(self._queue),
+                "max_concurrency": self.max_concurrency,
+                "max_queue_depth": self.max_queue_depth,
+                "avg_service_seconds": round(self._avg_service_seconds, 3),
+            }
+
+    def _shed(self, reason: str):
+        LLM_SHED_TOTAL.inc(reason=reason)
+        raise SchedulerOverloadedError(self._retry_after_locked(), len(self._queue))
+
+    @contextmanager
+    def acquire(self, priority: int, call_name: str = "llm", deadline=None):
+        enqueued = time.perf_counter()
+        with self._cond:
+            if priority >= PRIORITY_NEW and len(self._queue) >= self.max_queue_depth:
+                self._shed("queue_full")
+
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            LLM_QUEUE_DEPTH.set(len(self._queue))
+            try:
+                while not (self._active < self.max_concurrency and self._queue[0] == ticket):
+                    timeout = None
+                    if priority >= PRIORITY_NEW and self.max_wait_seconds is not None:
+                        timeout = self.max_wait_seconds - (time.perf_counter() - enqueued)
+                        if timeout <= 0:
+                            self._shed("wait_timeout")
+                    if deadline is not None:
+                        if deadline.remaining() <= 0:
+                            deadline.degrade(call_name, "deadline_exceeded")
+                            raise DeadlineExceededError(call_name, deadline.degraded_stages())
+                        timeout = deadline.remaining() if timeout is None else min(timeout, deadline.remaining())
+                    self._cond.wait(timeout=timeout)
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                LLM_QUEUE_DEPTH.set(len(self._queue))
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            self._active += 1
+            LLM_QUEUE_DEPTH.set(len(self._queue))
+            LLM_ACTIVE_CALLS.set(self._active)
+            self._cond.notify_all()
+
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - enqueued, call=call_name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._cond:
+                self._active -= 1
+                self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * elapsed
+                LLM_ACTIVE_CALLS.set(self._active)
+                self._cond.notify_all()
+
+
+def _stream_within(llm, input, config, call_name: str, time_limit: float, **kwargs) -> str:
+    # closing the stream drops the connection, which makes Ollama stop generating
+    expires_at = time.perf_counter() + time_limit
+    parts = []
+    stream = llm.stream(input, config, **kwargs)
+    try:
+        for chunk in stream:
+            parts.append(chunk)
+            if time.perf_counter() >= expires_at:
+                current_deadline.get().degrade(call_name, "generation_cut", budget_seconds=round(time_limit, 3))
+                break
+    finally:
+        stream.close()
+    return "".join(parts)
+
+
+class ScheduledLLM(Runnable):
+    def __init__(self, llm, scheduler: LLMScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, input, config=None, **kwargs):
+        call_name = (config or {}).get("run_name") or "llm"
+        priority = self.scheduler.priority_for(call_name)
+        with self.scheduler.acquire(priority, call_name, current_deadline.get()):
+            llm = self.llm
+            max_tokens = generation_cap(call_name, getattr(llm, "num_predict", None))
+            if max_tokens is not None and "num_predict" in getattr(type(llm), "model_fields", {}):
+                llm = llm.model_copy(update={"num_predict": max_tokens})
+            capture = GenerationInfoCapture()
+            time_limit = generation_budget(call_name)
+            with track_external_call("ollama", call_name):
+                if time_limit is None:
+                    result = llm.invoke(input, with_capture(config, capture), **kwargs)
+                else:
+                    result = _stream_within(llm, input, with_capture(config, capture), call_name, time_limit, **kwargs)
+        record_generation(call_name, capture.generation_info, record_prefix(call_name, capture.generation_info))
+
+        calls = _request_llm_calls.get()
+        if calls is not None:
+            calls[0] += 1
+        return result
@@ -0,0 +1,404 @@
+"""
+metrics.py
+
+What is this file for: Keeps in-process Prometheus metrics (histograms, counters and gauges) for the LLM service pipeline stages, retrieval, embeddings and external API calls.
+
+What the flow of the functions are: Histogram, Counter and Gauge keep thread-safe values per label set, timed_stage() wraps chain stage functions to record their latency (and registers their thread with an active request profile), track_external_call() times calls to Ollama, Polygon and SerpAPI, and render_metrics() serializes every registered metric to the Prometheus text format.
+
+How this service is used: Imported by main.py and the RAG, stock, web search and vector store services to record timings, and served by the /metrics endpoint so the hot stage can be found under real load.
+"""
+
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+from .profiler import profiled_thread
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# set by the chat endpoints so stages running in RunnableParallel threads can label by mode
+request_mode = contextvars.ContextVar("request_mode", default="none")
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: MetricsRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"Unknown labels for {self.name}: {sorted(unknown)}")
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header()
+        for key, value in values:
+            lines.append(f"{self.name}{self._format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header()
+        for key, value in values:
+            lines.append(f"{self.name}{self._format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS, registry: MetricsRegistry = REGISTRY):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> Dict[str, float]:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if state is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": state["count"], "sum": state["sum"]}
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, {"buckets": list(state["buckets"]), "sum": state["sum"], "count": state["count"]}) for key, state in self._values.items())
+        lines = self._header()
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state["buckets"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {state['count']}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "llm_service_request_duration_seconds",
+    "End-to-end latency of chat requests.",
+    ["endpoint", "mode", "status"],
+)
+REQUESTS_TOTAL = Counter(
+    "llm_service_requests_total",
+    "Chat requests handled, by outcome.",
+    ["endpoint", "mode", "status"],
+)
+IN_FLIGHT_REQUESTS = Gauge(
+    "llm_service_in_flight_requests",
+    "Chat requests currently being processed.",
+    ["endpoint", "mode"],
+)
+STAGE_LATENCY = Histogram(
+    "llm_service_stage_duration_seconds",
+    "Latency of each RAG pipeline stage.",
+    ["stage", "mode"],
+)
+RETRIEVER_LATENCY = Histogram(
+    "llm_service_retriever_duration_seconds",
+    "Latency of vector store retrieval, including query embedding.",
+    ["mode"],
+)
+EMBEDDING_LATENCY = Histogram(
+    "llm_service_embedding_duration_seconds",
+    "Latency of embedding calls.",
+    ["operation", "mode", "cache"],
+)
+EXTERNAL_CALL_LATENCY = Histogram(
+    "llm_service_external_call_duration_seconds",
+    "Latency of calls to Ollama, Polygon and SerpAPI.",
+    ["service", "endpoint", "outcome"],
+)
+EMBEDDING_CACHE_REQUESTS = Counter(
+    "llm_service_embedding_cache_requests_total",
+    "Query embedding cache lookups, by result.",
+    ["result"],
+)
+EMBEDDING_CACHE_ENTRIES = Gauge(
+    "llm_service_embedding_cache_entries",
+    "Query embeddings currently held in the cache.",
+)
+LLM_QUEUE_WAIT = Histogram(
+    "llm_service_llm_queue_wait_seconds",
+    "Time LLM calls spend waiting for a scheduler slot.",
+    ["call"],
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_service_llm_queue_depth",
+    "LLM calls waiting for a scheduler slot.",
+)
+LLM_ACTIVE_CALLS = Gauge(
+    "llm_service_llm_active_calls",
+    "LLM calls currently running against Ollama.",
+)
+LLM_SHED_TOTAL = Counter(
+    "llm_service_llm_shed_total",
+    "Requests or LLM calls rejected by the scheduler.",
+    ["reason"],
+)
+LLM_TOKENS_TOTAL = Counter(
+    "llm_service_llm_tokens_total",
+    "Prompt and completion tokens reported by Ollama, by call.",
+    ["call", "kind"],
+)
+LLM_PHASE_DURATION = Histogram(
+    "llm_service_llm_phase_duration_seconds",
+    "Ollama model load, prompt evaluation and generation time per call.",
+    ["call", "phase"],
+)
+LLM_PROMPT_OVERSIZE_TOTAL = Counter(
+    "llm_service_llm_prompt_oversize_total",
+    "Prompt parts (chat_context, final_context) that exceeded their configured token limit.",
+    ["prompt"],
+)
+PROMPT_PREFIX_CACHE_TOTAL = Counter(
+    "llm_service_prompt_prefix_cache_total",
+    "Session prompts whose stable prefix was reused from Ollama's cache, evicted from it, or new (first turn or a rewritten history).",
+    ["call", "outcome"],
+)
+PROMPT_PREFIX_REUSED_TOKENS = Counter(
+    "llm_service_prompt_prefix_reused_tokens_total",
+    "Estimated prompt tokens Ollama did not have to evaluate because the session's prefix was still cached.",
+    ["call"],
+)
+
+
+BREAKER_STATE = Gauge(
+    "llm_service_circuit_breaker_state",
+    "Circuit breaker state per external endpoint (0 closed, 1 half-open, 2 open).",
+    ["service", "endpoint"],
+)
+BREAKER_REJECTED_TOTAL = Counter(
+    "llm_service_circuit_breaker_rejected_total",
+    "External calls failed fast because their circuit breaker was open.",
+    ["service", "endpoint"],
+)
+HEDGED_CALLS_TOTAL = Counter(
+    "llm_service_hedged_calls_total",
+    "External reads that sent a hedged second request, by which request answered first.",
+    ["service", "endpoint", "winner"],
+)
+
+RATE_LIMIT_WAIT = Histogram(
+    "llm_service_rate_limit_wait_seconds",
+    "Time external calls waited for a client-side rate limit token.",
+    ["service", "endpoint"],
+)
+RATE_LIMIT_QUEUE_DEPTH = Gauge(
+    "llm_service_rate_limit_queue_depth",
+    "External calls waiting for a client-side rate limit token.",
+    ["service"],
+)
+RATE_LIMIT_OUTCOMES_TOTAL = Counter(
+    "llm_service_rate_limit_outcomes_total",
+    "External calls merged with an identical call in flight, answered from cache or rejected by the client-side rate limit.",
+    ["service", "endpoint", "outcome"],
+)
+
+WEB_SEARCH_SNIPPETS_TOTAL = Counter(
+    "llm_service_web_search_snippets_total",
+    "Web search snippets kept for the prompt or dropped as duplicates, irrelevant to the query or over the token budget.",
+    ["outcome"],
+)
+
+RESPONSE_BYTES = Histogram(
+    "llm_service_response_bytes",
+    "Size of serialized chat responses, by response profile.",
+    ["endpoint", "profile"],
+    buckets=(256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 1048576),
+)
+RESPONSE_SERIALIZATION_SECONDS = Histogram(
+    "llm_service_response_serialization_seconds",
+    "Time spent shaping and serializing chat responses, by response profile.",
+    ["endpoint", "profile"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+
+DEADLINE_DEGRADED_TOTAL = Counter(
+    "llm_service_deadline_degraded_total",
+    "Pipeline stages skipped, cut short or capped to keep a request within its deadline.",
+    ["stage", "reason"],
+)
+
+
+INGESTION_STAGE_LATENCY = Histogram(
+    "llm_service_ingestion_stage_duration_seconds",
+    "Time spent in each stage of a document ingestion job.",
+    ["stage"],
+)
+
+INGESTION_JOBS_TOTAL = Counter(
+    "llm_service_ingestion_jobs_total",
+    "Document ingestion jobs by final status.",
+    ["status"],
+)
+
+INGESTION_YIELD_SECONDS = Counter(
+    "llm_service_ingestion_yield_seconds_total",
+    "Time ingestion workers spent paused so in-flight chat requests could run.",
+)
+
+
+def timed_stage(stage: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # stages run on RunnableParallel worker threads, so each one joins the request's profile if there is one
+            with profiled_thread(), STAGE_LATENCY.time(stage=stage, mode=request_mode.get()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track_external_call(service: str, endpoint: str):
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        EXTERNAL_CALL_LATENCY.observe(time.perf_counter() - start, service=service, endpoint=endpoint, outcome=outcome)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
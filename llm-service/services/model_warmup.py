@@ -0,0 +1,154 @@
+"""
+model_warmup.py
+
+What is this file for: Loads the Ollama chat and embedding models before the first user request, keeps them resident with a configurable keep-alive, and reports whether they are actually loaded.
+
+What the flow of the functions are: ModelWarmer.warm_up() loads each model and times a probe call, start() runs a keep-alive thread, and readiness() reports which models Ollama has loaded for the /ready endpoint.
+
+How this service is used: main.py runs warm_up() during service initialization, starts the keep-warm thread, and serves readiness() on /ready.
+"""
+
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import logging
+import threading
+import time
+
+from ollama import Client
+
+from .metrics import track_external_call
+
+logger = logging.getLogger(__name__)
+
+
+def _model_key(name: str) -> str:
+    return name if ":" in name else f"{name}:latest"
+
+
+class ModelWarmer:
+    def __init__(self, llm_model: str, embedding_model: Optional[str], base_url: Optional[str] = None, keep_alive_seconds: int = 1800, interval_seconds: Optional[float] = None):
+        self.llm_model = llm_model
+        self.embedding_model = embedding_model
+        self.keep_alive_seconds = keep_alive_seconds
+        # refresh well before the keep-alive window can lapse
+        self.interval_seconds = interval_seconds or max(30.0, keep_alive_seconds / 3)
+        self.client = Client(host=base_url) if base_url else Client()
+        # embedding_model is None when embeddings run in-process instead of on Ollama
+        self.models = [model for model in (embedding_model, llm_model) if model]
+        self._status: Dict[str, dict] = {llm_model: {"kind": "llm", "warmed": False}}
+        if embedding_model:
+            self._status[embedding_model] = {"kind": "embedding", "warmed": False}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load(self, model: str) -> float:
+        with track_external_call("ollama", "keep_warm"):
+            if self._status[model]["kind"] == "llm":
+                response = self.client.generate(model=model, prompt="", keep_alive=self.keep_alive_seconds)
+            else:
+                response = self.client.embed(model=model, input="warm up", keep_alive=self.keep_alive_seconds)
+        return (getattr(response, "load_duration", None) or 0) / 1e9
+
+    def _probe(self, model: str) -> float:
+        started = time.perf_counter()
+        with track_external_call("ollama", "warmup_probe"):
+            if self._status[model]["kind"] == "llm":
+                self.client.generate(model=model, prompt="Hi", options={"num_predict": 1}, keep_alive=self.keep_alive_seconds)
+            else:
+                self.client.embed(model=model, input="What is a stock?", keep_alive=self.keep_alive_seconds)
+        return time.perf_counter() - started
+
+    def warm_up(self) -> bool:
+        all_warm = True
+        for model in self.models:
+            started = time.perf_counter()
+            try:
+                load_seconds = self._load(model)
+                cold_seconds = time.perf_counter() - started
+                probe_seconds = self._probe(model)
+                with self._lock:
+                    self._status[model].update({
+                        "warmed": True,
+                        "load_seconds": round(load_seconds, 3),
+                        "warmup_seconds": round(cold_seconds, 3),
+                        "probe_latency_seconds": round(probe_seconds, 3),
+                        "last_refresh": time.time(),
+                        "error": None,
+                    })
+                logger.info(f"Warmed {model} in {cold_seconds:.2f}s (load {load_seconds:.2f}s, probe {probe_seconds:.3f}s)")
+            except Exception as e:
+                all_warm = False
+                with self._lock:
+                    self._status[model].update({"warmed": False, "error": str(e)})
+                logger.error(f"Failed to warm up {model}: {e}")
+        return all_warm
+
+    def keep_warm(self):
+        for model in self.models:
+            try:
+                load_seconds = self._load(model)
+                with self._lock:
+                    self._status[model].update({"warmed": True, "last_refresh": time.time(), "error": None})
+                if load_seconds > 1:
+                    logger.warning(f"{model} had been unloaded, reloading took {load_seconds:.2f}s")
+            except Exception as e:
+                with self._lock:
+                    self._status[model].update({"error": str(e)})
+                logger.error(f"Keep-warm failed for {model}: {e}")
+
+    def _run(self, load_now: bool = False):
+        if load_now:
+            self.keep_warm()
+        while not self._stop.wait(self.interval_seconds):
+            self.keep_warm()
+
+    def start(self, load_now: bool = False):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(load_now,), name="ollama-keep-warm", daemon=True)
+        self._thread.start()
+        logger.info(f"Keep-warm thread started (every {self.interval_seconds:.0f}s, keep_alive={self.keep_alive_seconds}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def residency(self) -> Dict[str, dict]:
+        loaded = {}
+        with track_external_call("ollama", "ps"):
+            for entry in self.client.ps().models:
+                loaded[_model_key(entry.model or entry.name)] = entry
+
+        resident = {}
+        now = datetime.now(timezone.utc)
+        for model in self.models:
+            entry = loaded.get(_model_key(model))
+            if entry is None:
+                resident[model] = {"resident": False}
+                continue
+            expires_at = entry.expires_at
+            resident[model] = {
+                "resident": True,
+                "expires_in_seconds": round((expires_at - now).total_seconds()) if expires_at else None,
+                "size_vram": entry.size_vram,
+            }
+        return resident
+
+    def readiness(self) -> dict:
+        with self._lock:
+            status = {model: dict(info) for model, info in self._status.items()}
+        try:
+            resident = self.residency()
+            for model, info in resident.items():
+                status[model].update(info)
+        except Exception as e:
+            logger.error(f"Failed to query Ollama model residency: {e}")
+            for info in status.values():
+                info.update({"resident": False, "error": str(e)})
+
+        return {
+            "ready": all(info.get("warmed") and info.get("resident") for info in status.values()),
+            "keep_alive_seconds": self.keep_alive_seconds,
+            "models": status,
+        }
@@ -0,0 +1,132 @@
+"""
+onnx_embeddings.py
+
+What is this file for: Runs a quantized ONNX export of nomic-embed-text inside the service process on CPU, so query embeddings skip the HTTP round trip to Ollama.
+
+What the flow of the functions are: OnnxEmbeddings loads the tokenizer and ONNX model, embed_query() micro-batches concurrent queries into one model call, and embed_documents() encodes documents in length-sorted batches, producing vectors like Ollama's.
+
+How this service is used: main.py builds it instead of OllamaEmbeddings when EMBEDDINGS_BACKEND=onnx, which needs the optional onnxruntime, tokenizers and huggingface_hub packages.
+"""
+
+from concurrent.futures import Future
+from langchain_core.embeddings import Embeddings
+from typing import List, Optional
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:
+    onnxruntime = None
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPO_ID = "nomic-ai/nomic-embed-text-v1.5"
+DEFAULT_MODEL_FILE = "onnx/model_quantized.onnx"
+
+
+class MicroBatcher:
+    def __init__(self, encode, max_batch_size: int = 32, max_wait_seconds: float = 0.002):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # a short wait lets queries arriving together share one model call
+            deadline = time.perf_counter() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.encode([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class OnnxEmbeddings(Embeddings):
+    service_name = "onnx"
+
+    def __init__(self, model_dir: Optional[str] = None, repo_id: str = DEFAULT_REPO_ID, model_file: str = DEFAULT_MODEL_FILE, max_length: int = 512, threads: Optional[int] = None, max_batch_size: int = 32, batch_wait_ms: float = 2.0):
+        if onnxruntime is None or Tokenizer is None:
+            raise ImportError("The ONNX embeddings backend needs onnxruntime and tokenizers (pip install onnxruntime tokenizers huggingface_hub)")
+
+        tokenizer_path, model_path = self._resolve_files(model_dir, repo_id, model_file)
+        self.model = f"onnx:{os.path.basename(model_dir.rstrip('/')) if model_dir else repo_id.split('/')[-1]}"
+        self.max_length = max_length
+        self.max_batch_size = max_batch_size
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.batcher = MicroBatcher(self._encode, max_batch_size, batch_wait_ms / 1000)
+        logger.info(f"Loaded ONNX embedding model {model_path} (max_length={max_length}, inputs={sorted(self.input_names)})")
+
+    @staticmethod
+    def _resolve_files(model_dir: Optional[str], repo_id: str, model_file: str) -> tuple:
+        if model_dir:
+            model_path = os.path.join(model_dir, model_file)
+            if not os.path.exists(model_path):
+                model_path = os.path.join(model_dir, os.path.basename(model_file))
+            return os.path.join(model_dir, "tokenizer.json"), model_path
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(repo_id, "tokenizer.json"), hf_hub_download(repo_id, model_file)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_states = self.session.run(None, feeds)[0]
+        # mean pooling over real tokens, then unit length, which is what Ollama returns for nomic-embed-text
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.max_batch_size):
+            batch = order[start:start + self.max_batch_size]
+            for index, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[index] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.submit(text).result()
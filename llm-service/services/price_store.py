@@ -0,0 +1,192 @@
+"""
+price_store.py
+
+What is this file for: Keeps daily price history per ticker in a local NumPy-backed store so stock answers do not refetch the same window from Polygon on every request.
+
+What the flow of the functions are: PriceStore.missing_range() works out which days a ticker still needs, merge() folds newly fetched bars into the ticker's arrays and persists them, and latest_bars() and analytics() serve the stored history.
+
+How this service is used: StockService asks the store for the missing range before calling the Polygon aggregates endpoint and attaches the analytics to the stock data.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("t", "o", "h", "l", "c", "v")
+TRADING_DAYS_PER_YEAR = 252
+RETURN_HORIZONS = {"1d": 1, "5d": 5, "1m": 21, "3m": 63, "6m": 126, "1y": 252}
+MOVING_AVERAGE_WINDOWS = (20, 50, 200)
+
+
+class PriceSeries:
+    def __init__(self, ticker: str, columns: Optional[Dict[str, np.ndarray]] = None, fetched_at: float = 0.0):
+        self.ticker = ticker
+        columns = columns or {}
+        self.t = np.asarray(columns.get("t", []), dtype=np.int64)
+        self.o = np.asarray(columns.get("o", []), dtype=np.float64)
+        self.h = np.asarray(columns.get("h", []), dtype=np.float64)
+        self.l = np.asarray(columns.get("l", []), dtype=np.float64)
+        self.c = np.asarray(columns.get("c", []), dtype=np.float64)
+        self.v = np.asarray(columns.get("v", []), dtype=np.float64)
+        self.fetched_at = fetched_at
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in COLUMNS}
+
+    def last_date(self) -> Optional[datetime]:
+        if not len(self):
+            return None
+        return datetime.fromtimestamp(int(self.t[-1]) / 1000)
+
+
+def _simple_moving_average(closes: np.ndarray, window: int) -> Optional[float]:
+    if len(closes) < window:
+        return None
+    cumulative = np.cumsum(np.insert(closes, 0, 0.0))
+    return float((cumulative[-1] - cumulative[-1 - window]) / window)
+
+
+class PriceStore:
+    def __init__(self, root_dir: str = "../price-data", lookback_days: int = 730, refresh_seconds: float = 900.0):
+        self.root_dir = root_dir
+        self.lookback_days = lookback_days
+        self.refresh_seconds = refresh_seconds
+        self._series: Dict[str, PriceSeries] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, ticker: str) -> str:
+        return os.path.join(self.root_dir, f"{ticker.upper()}.npz")
+
+    def _load(self, ticker: str) -> PriceSeries:
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return PriceSeries(ticker)
+        try:
+            with np.load(path) as data:
+                columns = {name: data[name] for name in COLUMNS}
+                fetched_at = float(data["fetched_at"]) if "fetched_at" in data.files else 0.0
+            return PriceSeries(ticker, columns, fetched_at)
+        except Exception as e:
+            logger.error(f"Failed to load price history for {ticker}, starting fresh: {e}")
+            return PriceSeries(ticker)
+
+    def _save(self, series: PriceSeries):
+        path = self._path(series.ticker)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        try:
+            np.savez(tmp_path, fetched_at=np.float64(series.fetched_at), **series.columns())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Failed to persist price history for {series.ticker}: {e}")
+
+    def get_series(self, ticker: str) -> PriceSeries:
+        ticker = ticker.upper()
+        with self._lock:
+            series = self._series.get(ticker)
+            if series is None:
+                series = self._load(ticker)
+                self._series[ticker] = series
+            return series
+
+    def missing_range(self, ticker: str, now: Optional[datetime] = None) -> Optional[Tuple[str, str]]:
+        now = now or datetime.now()
+        series = self.get_series(ticker)
+        if len(series) and time.time() - series.fetched_at < self.refresh_seconds:
+            return None
+
+        last_date = series.last_date()
+        if last_date is None:
+            start = now - timedelta(days=self.lookback_days)
+        else:
+            # refetch the last stored day so an intraday bar gets replaced by its final close
+            start = last_date
+        return start.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
+
+    def merge(self, ticker: str, bars: List[dict]) -> PriceSeries:
+        ticker = ticker.upper()
+        rows = [bar for bar in bars if isinstance(bar, dict) and "t" in bar and "c" in bar]
+        with self._lock:
+            series = self._series.get(ticker) or self._load(ticker)
+            # the refetch always includes the last stored day, so no rows means the fetch failed and the next request retries
+            if not rows:
+                self._series[ticker] = series
+                return series
+            fresh = {name: np.array([bar.get(name, 0) for bar in rows], dtype=np.int64 if name == "t" else np.float64) for name in COLUMNS}
+            combined = {name: np.concatenate([getattr(series, name), fresh[name]]) for name in COLUMNS}
+            # keep the newest copy of each timestamp, ordered by time
+            reversed_t = combined["t"][::-1]
+            _, first_in_reversed = np.unique(reversed_t, return_index=True)
+            keep = len(reversed_t) - 1 - first_in_reversed
+            series = PriceSeries(ticker, {name: values[keep] for name, values in combined.items()})
+            series.fetched_at = time.time()
+            self._series[ticker] = series
+            self._save(series)
+            return series
+
+    def latest_bars(self, ticker: str, count: int = 5) -> dict:
+        series = self.get_series(ticker)
+        if not len(series):
+            return {"status": "EMPTY", "resultsCount": 0, "results": []}
+        bars = [
+            {name: (int(getattr(series, name)[i]) if name in ("t", "v") else float(getattr(series, name)[i])) for name in COLUMNS}
+            for i in range(max(0, len(series) - count), len(series))
+        ]
+        return {"status": "OK", "resultsCount": len(bars), "results": bars}
+
+    def analytics(self, ticker: str) -> dict:
+        series = self.get_series(ticker)
+        closes = series.c
+        if len(closes) < 2:
+            return {}
+
+        horizons = np.array(list(RETURN_HORIZONS.values()))
+        available = horizons < len(closes)
+        past_closes = closes[-1 - horizons[available]]
+        returns = (closes[-1] / past_closes - 1) * 100
+        log_returns = np.diff(np.log(closes))
+
+        running_peak = np.maximum.accumulate(closes)
+        drawdowns = closes / running_peak - 1
+        last_year = closes[-TRADING_DAYS_PER_YEAR:]
+
+        return {
+            "history_days": int(len(closes)),
+            "first_date": datetime.fromtimestamp(int(series.t[0]) / 1000).strftime('%Y-%m-%d'),
+            "returns_percent": {
+                name: round(float(value), 2)
+                for name, value in zip(np.array(list(RETURN_HORIZONS))[available], returns)
+            },
+            "moving_averages": {
+                f"sma_{window}": round(value, 2)
+                for window in MOVING_AVERAGE_WINDOWS
+                if (value := _simple_moving_average(closes, window)) is not None
+            },
+            "volatility_percent": {
+                "20d": round(float(np.std(log_returns[-20:], ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) * 100), 2) if len(log_returns) >= 20 else None,
+                "1y": round(float(np.std(log_returns[-TRADING_DAYS_PER_YEAR:], ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) * 100), 2) if len(log_returns) >= 2 else None,
+            },
+            "max_drawdown_percent": round(float(drawdowns.min() * 100), 2),
+            "current_drawdown_percent": round(float(drawdowns[-1] * 100), 2),
+            "high_52w": round(float(last_year.max()), 2),
+            "low_52w": round(float(last_year.min()), 2),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "root_dir": self.root_dir,
+                "tickers_loaded": len(self._series),
+                "bars_loaded": int(sum(len(series) for series in self._series.values())),
+            }
@@ -0,0 +1,273 @@
+"""
+profiler.py
+
+What is this file for: Opt-in profiling of single chat requests with a sampling profiler and tracemalloc snapshots, written out as flamegraph-compatible folded stacks.
+
+What the flow of the functions are: RequestProfiler.should_profile() decides whether a request is profiled, begin() and run() sample the stacks of every thread working for the request, and finish() writes the folded stacks and allocation report to the profile directory.
+
+How this service is used: main.py profiles the get_answer call of /chat and /chat/normal when enabled, returns the id in the X-Profile-Id header, and serves the results from /debug/profiles.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+active_profile = contextvars.ContextVar("active_profile", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def fold_stack(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RequestProfile:
+    def __init__(self, endpoint: str, mode: str, query: str, trace_memory: bool):
+        self.profile_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.mode = mode
+        self.query = query[:200]
+        self.trace_memory = trace_memory
+        self.started_at = time.time()
+        self.duration_seconds = None
+        self.samples = 0
+        self.stacks = Counter()
+        self.error = None
+        self._threads: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._memory_before = None
+        self._started = None
+        self.allocations: List[str] = []
+
+    def enter_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = self._threads.get(thread_id, 0) + 1
+
+    def exit_thread(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            depth = self._threads.get(thread_id, 0) - 1
+            if depth > 0:
+                self._threads[thread_id] = depth
+            else:
+                self._threads.pop(thread_id, None)
+
+    def sample(self, frames: dict):
+        with self._lock:
+            thread_ids = list(self._threads)
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+                self.samples += 1
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "endpoint": self.endpoint,
+            "mode": self.mode,
+            "query": self.query,
+            "started_at": self.started_at,
+            "duration_seconds": self.duration_seconds,
+            "samples": self.samples,
+            "unique_stacks": len(self.stacks),
+            "allocations_traced": self.trace_memory,
+            "error": self.error,
+        }
+
+
+@contextmanager
+def profiled_thread():
+    profile = active_profile.get()
+    if profile is None:
+        yield
+        return
+    profile.enter_thread()
+    try:
+        yield
+    finally:
+        profile.exit_thread()
+
+
+class RequestProfiler:
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, interval_seconds: float = 0.005, directory: str = "../profiles", max_profiles: int = 20, trace_memory: bool = True):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval_seconds = interval_seconds
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.trace_memory = trace_memory
+        self._active: List[RequestProfile] = []
+        self._tracing_profiles = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def should_profile(self, header_value: Optional[str]) -> bool:
+        if not self.enabled:
+            return False
+        if header_value is not None and header_value.lower() in ("1", "true", "yes"):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _ensure_sampler(self):
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                profiles = list(self._active)
+            if not profiles:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                profile.sample(frames)
+            del frames
+            time.sleep(self.interval_seconds)
+
+    def _start_memory_trace(self, profile: RequestProfile):
+        with self._lock:
+            if self._tracing_profiles == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(16)
+            self._tracing_profiles += 1
+        profile._memory_before = tracemalloc.take_snapshot()
+
+    def _stop_memory_trace(self, profile: RequestProfile):
+        try:
+            own_frames = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+            after = tracemalloc.take_snapshot().filter_traces(own_frames)
+            # concurrent requests share the tracer, so the diff can include their allocations too
+            differences = after.compare_to(profile._memory_before.filter_traces(own_frames), "lineno")
+            profile.allocations = [str(stat) for stat in differences[:30]]
+        except Exception as e:
+            logger.error(f"Failed to diff allocation snapshots for profile {profile.profile_id}: {e}")
+        finally:
+            profile._memory_before = None
+            with self._lock:
+                self._tracing_profiles -= 1
+                if self._tracing_profiles == 0:
+                    tracemalloc.stop()
+
+    # begin() and finish() take and diff the allocation snapshots and write the files, so callers on the
+    # event loop run them in the threadpool
+    def begin(self, endpoint: str, mode: str, query: str) -> RequestProfile:
+        profile = RequestProfile(endpoint, mode, query, self.trace_memory)
+        if profile.trace_memory:
+            self._start_memory_trace(profile)
+        profile._started = time.perf_counter()
+        with self._lock:
+            self._active.append(profile)
+            self._ensure_sampler()
+        self._wake.set()
+        return profile
+
+    def finish(self, profile: RequestProfile):
+        profile.duration_seconds = round(time.perf_counter() - profile._started, 4)
+        with self._lock:
+            self._active.remove(profile)
+        if profile.trace_memory:
+            self._stop_memory_trace(profile)
+        self._save(profile)
+
+    def run(self, profile: RequestProfile, func, *args, **kwargs):
+        token = active_profile.set(profile)
+        try:
+            with profiled_thread():
+                return func(*args, **kwargs)
+        except Exception as e:
+            profile.error = str(e)
+            raise
+        finally:
+            active_profile.reset(token)
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}{suffix}")
+
+    def _save(self, profile: RequestProfile):
+        try:
+            with open(self._path(profile.profile_id, ".folded"), "w", encoding="utf-8") as folded:
+                for stack, count in profile.stacks.most_common():
+                    folded.write(f"{stack} {count}\n")
+            with open(self._path(profile.profile_id, ".alloc.txt"), "w", encoding="utf-8") as allocations:
+                allocations.write("\n".join(profile.allocations) + ("\n" if profile.allocations else ""))
+            with open(self._path(profile.profile_id, ".json"), "w", encoding="utf-8") as meta:
+                json.dump(profile.summary(), meta)
+            logger.info(f"Saved profile {profile.profile_id} ({profile.samples} samples over {profile.duration_seconds}s)")
+        except Exception as e:
+            logger.error(f"Failed to save profile {profile.profile_id}: {e}")
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        try:
+            profiles = sorted(self.list_profiles(), key=lambda item: item["started_at"], reverse=True)
+            for stale in profiles[self.max_profiles:]:
+                for suffix in (".folded", ".alloc.txt", ".json"):
+                    path = self._path(stale["profile_id"], suffix)
+                    if os.path.exists(path):
+                        os.remove(path)
+        except Exception as e:
+            logger.error(f"Failed to enforce profile retention: {e}")
+
+    def list_profiles(self) -> List[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as meta:
+                    profiles.append(json.load(meta))
+            except Exception:
+                continue
+        return sorted(profiles, key=lambda item: item["started_at"], reverse=True)
+
+    def _valid_id(self, profile_id: str) -> bool:
+        return profile_id.isalnum() and os.path.exists(self._path(profile_id, ".json"))
+
+    def get_summary(self, profile_id: str) -> Optional[dict]:
+        if not self._valid_id(profile_id):
+            return None
+        with open(self._path(profile_id, ".json"), encoding="utf-8") as meta:
+            summary = json.load(meta)
+        # the hottest leaf frames are usually what a slow request is looking for
+        leaf_counts = Counter()
+        with open(self._path(profile_id, ".folded"), encoding="utf-8") as folded:
+            for line in folded:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                leaf_counts[stack.rsplit(";", 1)[-1]] += int(count)
+        summary["top_frames"] = [{"frame": frame, "samples": count} for frame, count in leaf_counts.most_common(15)]
+        return summary
+
+    def read_file(self, profile_id: str, suffix: str) -> Optional[str]:
+        if not self._valid_id(profile_id):
+            return None
+        with open(self._path(profile_id, suffix), encoding="utf-8") as handle:
+            return handle.read()
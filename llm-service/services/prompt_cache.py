@@ -0,0 +1,131 @@
+"""
+prompt_cache.py
+
+What is this file for: Tracks whether Ollama reuses its cached KV state for a chat session's prompts, whose system prompt and append-only history come first so the prefix stays stable from turn to turn.
+
+What the flow of the functions are: expect_prefix() notes the prompt prefix up to the end of the history before a call and how much of it last turn's prefix covers, and record_prefix() compares that with Ollama's prompt_eval_count afterwards to classify the call as a hit, evicted or new.
+
+How this service is used: main.py opens a prefix_scope() per chat request with a session_id, the RAG services call expect_prefix() and ScheduledLLM calls record_prefix().
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+import contextvars
+import hashlib
+import logging
+import threading
+
+from .metrics import PROMPT_PREFIX_CACHE_TOTAL, PROMPT_PREFIX_REUSED_TOKENS
+from .session_store import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+HIT = "hit"
+EVICTED = "evicted"
+NEW = "new"
+
+current_prefix_scope = contextvars.ContextVar("current_prefix_scope", default=None)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class PromptPrefixCache:
+    def __init__(self, max_entries: int = 4000):
+        self.max_entries = max_entries
+        self._prefixes: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reusable_tokens(self, session_id: str, call_name: str, prefix: str) -> int:
+        with self._lock:
+            entry = self._prefixes.get((session_id, call_name))
+        if entry is None or len(prefix) < entry["chars"] or _digest(prefix[:entry["chars"]]) != entry["digest"]:
+            return 0
+        return entry["tokens"]
+
+    def remember(self, session_id: str, call_name: str, prefix: str, outcome: str):
+        key = (session_id, call_name)
+        with self._lock:
+            entry = self._prefixes.get(key) or {HIT: 0, EVICTED: 0, NEW: 0}
+            entry.update({"chars": len(prefix), "digest": _digest(prefix), "tokens": estimate_tokens(prefix)})
+            entry[outcome] += 1
+            self._prefixes[key] = entry
+            self._prefixes.move_to_end(key)
+            while len(self._prefixes) > self.max_entries:
+                self._prefixes.popitem(last=False)
+
+    def describe(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                call_name: {"prefix_tokens": entry["tokens"], "hits": entry[HIT], "evictions": entry[EVICTED], "new_prefixes": entry[NEW]}
+                for (entry_session, call_name), entry in self._prefixes.items()
+                if entry_session == session_id
+            }
+
+    def forget(self, session_id: str):
+        with self._lock:
+            for key in [key for key in self._prefixes if key[0] == session_id]:
+                del self._prefixes[key]
+
+
+class PrefixScope:
+    def __init__(self, cache: PromptPrefixCache, session_id: str):
+        self.cache = cache
+        self.session_id = session_id
+        self.pending: Dict[str, Dict[str, Any]] = {}
+
+
+@contextmanager
+def prefix_scope(cache: Optional[PromptPrefixCache], session_id: Optional[str]):
+    if cache is None or not session_id:
+        yield None
+        return
+    scope = PrefixScope(cache, session_id)
+    token = current_prefix_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_prefix_scope.reset(token)
+
+
+def expect_prefix(call_name: str, prompt: str, chat_context: str):
+    scope = current_prefix_scope.get()
+    if scope is None or not chat_context:
+        return
+    end = prompt.find(chat_context)
+    if end < 0:
+        return
+    prefix = prompt[:end + len(chat_context)]
+    scope.pending[call_name] = {
+        "prefix": prefix,
+        "reusable_tokens": scope.cache.reusable_tokens(scope.session_id, call_name, prefix),
+        "prompt_tokens": estimate_tokens(prompt),
+    }
+
+
+def record_prefix(call_name: str, generation_info: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    scope = current_prefix_scope.get()
+    if scope is None:
+        return None
+    expected = scope.pending.pop(call_name, None)
+    if expected is None or not generation_info or generation_info.get("prompt_eval_count") is None:
+        return None
+
+    reusable = expected["reusable_tokens"]
+    evaluated = int(generation_info["prompt_eval_count"])
+    # Ollama only counts the prompt tokens it evaluated, token counts on our side are estimates
+    if not reusable:
+        outcome = NEW
+    elif expected["prompt_tokens"] - evaluated >= reusable / 2:
+        outcome = HIT
+    else:
+        outcome = EVICTED
+        logger.info(f"Cached prompt prefix for session {scope.session_id} ({call_name}) was evicted, evaluated {evaluated} tokens")
+
+    scope.cache.remember(scope.session_id, call_name, expected["prefix"], outcome)
+    PROMPT_PREFIX_CACHE_TOTAL.inc(call=call_name, outcome=outcome)
+    if outcome == HIT:
+        PROMPT_PREFIX_REUSED_TOKENS.inc(reusable, call=call_name)
+    return {"prefix_cache": outcome, "reused_prefix_tokens": reusable if outcome == HIT else 0}
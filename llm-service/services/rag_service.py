@@ -3,57 +3,68 @@ rag_service.py
 
 What is this file for: Provides basic RAG functionality using document retrieval and LLM generation for financial Q&A.
 
-What the flow of the functions are: get_answer() retrieves relevant document chunks, formats context with chat history, generates responses using LLM, and extracts citations from the answer to filter sources.
+What the flow of the functions are: get_answer() retrieves relevant document chunks with retrieve() and passes them to generate_answer(), which formats context with chat history, generates responses using LLM, and extracts citations from the answer to filter sources.
 
-How this service is used: Called by the main FastAPI server for basic document-based Q&A without stock data or web search capabilities.
+How this service is used: Called by the main FastAPI server for basic document-based Q&A without stock data or web search capabilities, and by the batch endpoint with documents from a batched search.
 """
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
 from langchain_ollama import OllamaLLM
 from typing import List, Dict, Any, Optional
 import logging
 import re
 
+from .document_processor import public_metadata, source_citation
+from .session_store import NO_HISTORY, format_message
+from .metrics import RETRIEVER_LATENCY, request_mode
+from .prompt_cache import expect_prefix
+from .token_usage import check_prompt_size
+
 logger = logging.getLogger(__name__)
 
 class RAGService:
-    def __init__(self, llm: OllamaLLM, retriever):
+    def __init__(self, llm: OllamaLLM, retriever, prompt_limits: Optional[Dict[str, int]] = None):
         self.llm = llm
         self.retriever = retriever
+        self.prompt_limits = prompt_limits
         self.system_prompt = (
             "You are a professional assistant for The Basics for Investing in Stocks by the Editors of Kiplinger's Personal Finance. Always answer questions directly and factually using the provided document context and chat history. If the answer is not in the context, say \"I am not sure about that.\" When asked about previous questions, use the chat history and never say you don't have access to it. CRITICAL: For document citations, use ONLY [Page X] format (for example [Page 1], [Page 5]) - do NOT use [1], [2], or any other format when referencing information from the document."
         )
     
-    def get_answer(self, question: str, chat_history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    def retrieve(self, question: str, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
         try:
-            
-            retrieved_docs = self.retriever.invoke(question)
-            
-            for idx, doc in enumerate(retrieved_docs):
-                page_num = doc.metadata.get('page', 'Unknown')
-            
+            with RETRIEVER_LATENCY.time(mode=request_mode.get()):
+                if filters:
+                    return self.retriever.invoke(question, filters=filters)
+                return self.retriever.invoke(question)
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {e}")
+            raise
+
+    def get_answer(self, question: str, chat_history: Optional[List[Dict[str, str]]] = None, chat_context: Optional[str] = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        retrieved_docs = self.retrieve(question, filters)
+        return self.generate_answer(question, retrieved_docs, chat_history, chat_context)
 
+    def generate_answer(self, question: str, retrieved_docs: List[Document], chat_history: Optional[List[Dict[str, str]]] = None, chat_context: Optional[str] = None) -> Dict[str, Any]:
+        try:
             docs_content = "\n\n".join(f"=== PAGE {doc.metadata.get('page', 'Unknown')} ===\n{doc.page_content}" for doc in retrieved_docs) # Combine all docs contents
             
 
-            chat_context = ""
-            if chat_history:
-                for msg in chat_history:
-                    role = msg.get('role', 'unknown')
-                    content = msg.get('content', '')
-                    chat_context += f"{role.capitalize()}: {content}\n"
-            else:
-                chat_context = "No previous conversation."
-            
+            if chat_context is None:
+                chat_context = "".join(format_message(msg) for msg in chat_history) if chat_history else NO_HISTORY
+            check_prompt_size("chat_context", chat_context, self.prompt_limits)
             
+            # instructions and the append-only history first, so the prompt prefix stays the same from turn to turn
             messages = ChatPromptTemplate.from_messages([
-                ("system", self.system_prompt + "\n\nDocument Context:\n{context}\n\nChat History:\n{chat_history}"),
-                ("human", "{question}"),
+                ("system", self.system_prompt + "\n\nChat History:\n{chat_history}"),
+                ("human", "Document Context:\n{context}\n\nQuestion: {question}"),
             ]).invoke({"question": question, "context": docs_content, "chat_history": chat_context})
+            expect_prefix("answer", messages.to_string(), chat_context)
             
 
-            response = self.llm.invoke(messages)
+            response = self.llm.invoke(messages, config={"run_name": "answer"})
             answer_content = response if isinstance(response, str) else response.content
             
 
@@ -67,16 +78,12 @@ class RAGService:
             sources = []
             for i, doc in enumerate(retrieved_docs):
                 page_number = doc.metadata.get('page', 'Unknown page')
-                source_title = doc.metadata.get('source', 'The Basics for Investing in Stocks')
-                base_url = "https://www.rld.nm.gov/wp-content/uploads/2021/06/IPT_Stocks_2012.pdf"
-                if page_number and page_number != 'Unknown page':
-                    url = f"{base_url}#page={page_number}"
-                else:
-                    url = base_url
+                source_title, url = source_citation(doc.metadata)
                 sources.append({
                     "id": i + 1,
                     "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "metadata": doc.metadata,
+                    "metadata": public_metadata(doc.metadata),
+                    "score": doc.metadata.get("_score"),
                     "page": page_number,
                     "title": source_title,
                     "citation_text": f"[{i + 1}] {source_title}, Page {page_number}",
@@ -0,0 +1,195 @@
+"""
+rate_limiter.py
+
+What is this file for: Keeps Polygon calls inside the plan's request rate on the client side, so concurrent requests queue by priority instead of bursting into rate-limit errors.
+
+What the flow of the functions are: RateLimitedClient.call() merges identical in-flight requests, waits for a TokenBucket token (price before news before financials) and falls back to the last cached response, or RateLimitExceededError, when the wait would exceed its budget.
+
+How this service is used: main.py creates one client sized by POLYGON_REQUESTS_PER_MINUTE and hands it to StockService.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+
+from .deadline import current_deadline
+from .metrics import RATE_LIMIT_OUTCOMES_TOTAL, RATE_LIMIT_QUEUE_DEPTH, RATE_LIMIT_WAIT
+from .resilience import DependencyGuard
+
+logger = logging.getLogger(__name__)
+
+# lower runs first: price data answers most stock questions, news and then financials add context around it
+POLYGON_PRIORITIES = {
+    "aggregates": 0,
+    "ticker_news": 1,
+    "financials": 2,
+}
+
+
+class RateLimitExceededError(Exception):
+    def __init__(self, name: str, wait_seconds: float):
+        super().__init__(f"Rate limit for {name} would need a {wait_seconds:.1f}s wait")
+        self.name = name
+        self.wait_seconds = wait_seconds
+
+
+class TokenBucket:
+    def __init__(self, service: str, rate_per_second: float, capacity: float):
+        self.service = service
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def _expected_wait(self, priority: int) -> float:
+        ahead = sum(1 for ticket in self._queue if ticket[0] <= priority)
+        return max(0.0, (ahead + 1 - self.tokens) / self.rate_per_second)
+
+    def acquire(self, priority: int, max_wait_seconds: float, name: str) -> float:
+        enqueued = time.monotonic()
+        with self._cond:
+            self._refill()
+            expected = self._expected_wait(priority)
+            if expected > max_wait_seconds:
+                raise RateLimitExceededError(name, expected)
+
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            RATE_LIMIT_QUEUE_DEPTH.set(len(self._queue), service=self.service)
+            try:
+                while True:
+                    self._refill()
+                    if self._queue[0] == ticket and self.tokens >= 1:
+                        break
+                    waited = time.monotonic() - enqueued
+                    if waited >= max_wait_seconds:
+                        raise RateLimitExceededError(name, waited)
+                    # sleep until the next token is due, or until another waiter gives up its place
+                    next_token = max(0.0, (1 - self.tokens) / self.rate_per_second)
+                    self._cond.wait(timeout=min(max_wait_seconds - waited, next_token or max_wait_seconds))
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                RATE_LIMIT_QUEUE_DEPTH.set(len(self._queue), service=self.service)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            self.tokens -= 1
+            RATE_LIMIT_QUEUE_DEPTH.set(len(self._queue), service=self.service)
+            self._cond.notify_all()
+        return time.monotonic() - enqueued
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            self._refill()
+            if self._queue or self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            self._refill()
+            return {
+                "requests_per_minute": round(self.rate_per_second * 60, 2),
+                "burst": self.capacity,
+                "tokens": round(self.tokens, 2),
+                "queued": len(self._queue),
+            }
+
+
+class RateLimitedClient:
+    def __init__(self, guard: DependencyGuard, service: str = "polygon", requests_per_minute: float = 0.0, burst: Optional[int] = None, max_wait_seconds: float = 2.0, priorities: Optional[Dict[str, int]] = None, cache_ttl_seconds: float = 6 * 3600.0, cache_size: int = 512):
+        self.guard = guard
+        self.service = service
+        self.max_wait_seconds = max_wait_seconds
+        self.priorities = priorities if priorities is not None else POLYGON_PRIORITIES
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.cache_size = cache_size
+        # 0 requests per minute leaves the provider unlimited, duplicates are still merged
+        self.bucket = TokenBucket(service, requests_per_minute / 60.0, float(burst or max(1, int(requests_per_minute)))) if requests_per_minute > 0 else None
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def call(self, endpoint: str, func: Callable, params: dict, is_failure: Optional[Callable[[Exception], bool]] = None) -> Any:
+        key = (endpoint, json.dumps(params, sort_keys=True, default=str))
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = Future()
+                self._pending[key] = pending
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            RATE_LIMIT_OUTCOMES_TOTAL.inc(service=self.service, endpoint=endpoint, outcome="merged")
+            return pending.result()
+
+        try:
+            result = self._fetch(endpoint, key, func, params, is_failure)
+            pending.set_result(result)
+            return result
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _fetch(self, endpoint: str, key: Tuple[str, str], func: Callable, params: dict, is_failure: Optional[Callable[[Exception], bool]]) -> Any:
+        if self.bucket is not None:
+            max_wait = self.max_wait_seconds
+            deadline = current_deadline.get()
+            if deadline is not None:
+                max_wait = min(max_wait, deadline.remaining())
+            try:
+                waited = self.bucket.acquire(self.priorities.get(endpoint, len(self.priorities)), max_wait, f"{self.service}.{endpoint}")
+                RATE_LIMIT_WAIT.observe(waited, service=self.service, endpoint=endpoint)
+            except RateLimitExceededError:
+                cached = self._cached(key)
+                if cached is not None:
+                    RATE_LIMIT_OUTCOMES_TOTAL.inc(service=self.service, endpoint=endpoint, outcome="cache_fallback")
+                    logger.info(f"Rate limit for {self.service}.{endpoint} would exceed {max_wait:.1f}s, answering from cache")
+                    return cached
+                RATE_LIMIT_OUTCOMES_TOTAL.inc(service=self.service, endpoint=endpoint, outcome="rejected")
+                raise
+
+        # hedged duplicates are real requests too, they only go out when a token is free right away
+        allow_hedge = self.bucket.try_acquire if self.bucket is not None else None
+        result = self.guard.call(self.service, endpoint, func, params, is_failure=is_failure, allow_hedge=allow_hedge)
+        with self._lock:
+            self._cache[key] = (time.monotonic(), result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _cached(self, key: Tuple[str, str]) -> Any:
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.cache_ttl_seconds:
+            return None
+        return entry[1]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            info = {"in_flight": len(self._pending), "cached_responses": len(self._cache), "max_wait_seconds": self.max_wait_seconds}
+        if self.bucket is not None:
+            info.update(self.bucket.snapshot())
+        return info
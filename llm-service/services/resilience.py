@@ -0,0 +1,246 @@
+"""
+resilience.py
+
+What is this file for: Keeps a circuit breaker for every external dependency and endpoint so an outage or rate limiting fails fast, and optionally hedges slow idempotent reads.
+
+What the flow of the functions are: DependencyGuard.call() rejects calls with CircuitOpenError while an endpoint's breaker is open, runs them directly or hedged with a second request, and records the outcome in the breaker's failure-rate window.
+
+How this service is used: StockService and WebSearchService route every Polygon and SerpAPI call through it, and main.py reports its state on /dependencies.
+"""
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Tuple
+import contextvars
+import logging
+import math
+import threading
+import time
+
+from .deadline import current_deadline
+from .metrics import BREAKER_REJECTED_TOTAL, BREAKER_STATE, HEDGED_CALLS_TOTAL, track_external_call
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, service: str, endpoint: str, window_seconds: float = 60.0, min_calls: int = 5, failure_rate: float = 0.5, open_seconds: float = 30.0, half_open_probes: int = 1):
+        self.service = service
+        self.endpoint = endpoint
+        self.name = f"{service}.{endpoint}"
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(STATE_VALUES[CLOSED], service=service, endpoint=endpoint)
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit {self.name} {self.state} -> {state}")
+        self.state = state
+        BREAKER_STATE.set(STATE_VALUES[state], service=self.service, endpoint=self.endpoint)
+
+    def _trim(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def before_call(self) -> bool:
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self._set_state(HALF_OPEN)
+                self._probes_in_flight = 0
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 1.0)
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def record_success(self, probe: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if probe or self.state == HALF_OPEN:
+                # one good probe is enough to trust the dependency again
+                self._outcomes.clear()
+                self._probes_in_flight = 0
+                self._set_state(CLOSED)
+            self._outcomes.append((now, True))
+            self._trim(now)
+
+    def release_probe(self):
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def record_failure(self, probe: bool = False):
+        with self._lock:
+            now = time.monotonic()
+            if probe or self.state == HALF_OPEN:
+                self._probes_in_flight = 0
+                self.opened_at = now
+                self._set_state(OPEN)
+                return
+            self._outcomes.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self.opened_at = now
+                self._set_state(OPEN)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            return {
+                "state": self.state,
+                "calls_in_window": len(self._outcomes),
+                "failure_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "retry_in_seconds": round(max(0.0, self.opened_at + self.open_seconds - now), 1) if self.state == OPEN else None,
+                "rejected_total": self.rejected,
+            }
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class DependencyGuard:
+    def __init__(self, window_seconds: float = 60.0, min_calls: int = 5, failure_rate: float = 0.5, open_seconds: float = 30.0, hedged_services: Iterable[str] = (), hedge_percentile: float = 0.95, hedge_min_delay_seconds: float = 0.05):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.hedged_services = set(hedged_services)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_seconds = hedge_min_delay_seconds
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+        self._lock = threading.Lock()
+        # hedges that lose keep running here until their client returns
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedged-call")
+
+    def breaker(self, service: str, endpoint: str) -> CircuitBreaker:
+        key = (service, endpoint)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(service, endpoint, self.window_seconds, self.min_calls, self.failure_rate, self.open_seconds)
+                self._latencies[key] = LatencyWindow()
+            return self._breakers[key]
+
+    def call(self, service: str, endpoint: str, func: Callable, *args, is_failure: Optional[Callable[[Exception], bool]] = None, allow_hedge: Optional[Callable[[], bool]] = None) -> Any:
+        breaker = self.breaker(service, endpoint)
+        try:
+            probe = breaker.before_call()
+        except CircuitOpenError:
+            BREAKER_REJECTED_TOTAL.inc(service=service, endpoint=endpoint)
+            deadline = current_deadline.get()
+            if deadline is not None:
+                deadline.degrade(breaker.name, "circuit_open")
+            raise
+
+        recorded = False
+        try:
+            if service in self.hedged_services and not probe:
+                result = self._hedged(service, endpoint, func, *args, allow_hedge=allow_hedge)
+            else:
+                result = self._timed(service, endpoint, func, *args)
+        except Exception as e:
+            # some providers raise for responses that are still usable, those are not outages
+            if is_failure is None or is_failure(e):
+                breaker.record_failure(probe)
+            else:
+                breaker.record_success(probe)
+            recorded = True
+            raise
+        else:
+            breaker.record_success(probe)
+            recorded = True
+        finally:
+            # a cancelled or interrupted probe says nothing about the dependency, so another call may probe
+            if probe and not recorded:
+                breaker.release_probe()
+        return result
+
+    def _timed(self, service: str, endpoint: str, func: Callable, *args) -> Any:
+        started = time.perf_counter()
+        with track_external_call(service, endpoint):
+            result = func(*args)
+        self._latencies[(service, endpoint)].add(time.perf_counter() - started)
+        return result
+
+    def _hedged(self, service: str, endpoint: str, func: Callable, *args, allow_hedge: Optional[Callable[[], bool]] = None) -> Any:
+        threshold = self._latencies[(service, endpoint)].percentile(self.hedge_percentile)
+        if threshold is None:
+            return self._timed(service, endpoint, func, *args)
+
+        primary = self._executor.submit(contextvars.copy_context().run, self._timed, service, endpoint, func, *args)
+        done, _ = wait([primary], timeout=max(threshold, self.hedge_min_delay_seconds))
+        if done:
+            return primary.result()
+        # a rate-limited caller only hedges when the second request fits its budget
+        if allow_hedge is not None and not allow_hedge():
+            return primary.result()
+
+        hedge = self._executor.submit(contextvars.copy_context().run, self._timed, service, endpoint, func, *args)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    HEDGED_CALLS_TOTAL.inc(service=service, endpoint=endpoint, winner="primary" if future is primary else "hedge")
+                    return future.result()
+                first_error = first_error or future.exception()
+        HEDGED_CALLS_TOTAL.inc(service=service, endpoint=endpoint, winner="none")
+        raise first_error
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            breakers = list(self._breakers.items())
+        snapshot = {}
+        for key, breaker in breakers:
+            info = breaker.snapshot()
+            info["hedged"] = breaker.service in self.hedged_services
+            threshold = self._latencies[key].percentile(self.hedge_percentile) if info["hedged"] else None
+            info["hedge_after_seconds"] = round(max(threshold, self.hedge_min_delay_seconds), 3) if threshold is not None else None
+            snapshot[breaker.name] = info
+        return snapshot
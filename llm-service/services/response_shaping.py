@@ -0,0 +1,57 @@
+"""
+response_shaping.py
+
+What is this file for: Shapes chat responses to what the client asked for and serializes them with orjson, so clients that only render the answer and its citations are not sent the raw stock and web search data.
+
+What the flow of the functions are: shape_response() dumps a ChatResponse for a response profile ("compact" drops the raw stock news and financials, web search results, source metadata and None fields) and optional top-level fields, render_json() serializes it with orjson, and json_response() wraps both for a FastAPI route.
+
+How this service is used: main.py returns json_response() from /chat, /chat/normal and /chat/compare and uses shape_response() with render_json() for the NDJSON lines of /chat/batch and the streamed compare.
+"""
+
+from typing import Any, Iterable, Optional
+import logging
+import time
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from .metrics import RESPONSE_BYTES, RESPONSE_SERIALIZATION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FULL = "full"
+COMPACT = "compact"
+PROFILES = (FULL, COMPACT)
+
+# raw provider payloads the answer was built from; the cleaned price data and analytics stay
+COMPACT_EXCLUDE = {
+    "sources": {"__all__": {"metadata"}},
+    "stock_data": {"__all__": {"news", "financials", "prompt_block"}},
+    "web_search_results": True,
+}
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def shape_response(response: BaseModel, profile: str = FULL, fields: Optional[Iterable[str]] = None) -> dict:
+    include = set(fields) | {"answer"} if fields else None
+    if profile == COMPACT:
+        return response.model_dump(include=include, exclude=COMPACT_EXCLUDE, exclude_none=True)
+    return response.model_dump(include=include)
+
+
+def render_json(payload: Any, endpoint: str, profile: str = FULL, started: Optional[float] = None) -> bytes:
+    started = started if started is not None else time.perf_counter()
+    # metadata from uploads and providers can carry dates and other non-JSON types
+    body = orjson.dumps(payload, default=str, option=ORJSON_OPTIONS)
+    RESPONSE_SERIALIZATION_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, profile=profile)
+    RESPONSE_BYTES.observe(len(body), endpoint=endpoint, profile=profile)
+    return body
+
+
+def json_response(content: Any, endpoint: str, profile: str = FULL, fields: Optional[Iterable[str]] = None, headers: Optional[dict] = None) -> Response:
+    started = time.perf_counter()
+    payload = shape_response(content, profile, fields) if isinstance(content, BaseModel) else content
+    body = render_json(payload, endpoint, profile, started)
+    return Response(content=body, media_type="application/json", headers=headers)
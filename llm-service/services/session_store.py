@@ -0,0 +1,289 @@
+"""
+session_store.py
+
+What is this file for: Keeps chat sessions on the server so clients only send the new message instead of the full chat_history on every turn.
+
+What the flow of the functions are: get_or_create() loads a session from memory or the optional SQLite backend, sync_history() and append_turn() add only new messages, _compact() folds old turns into a short summary once the history is over budget, and evict_idle() drops unused sessions.
+
+How this service is used: main.py resolves the chat context through the store whenever a session_id is present and exposes /sessions/{session_id}.
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NO_HISTORY = "No previous conversation."
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+
+def format_message(message) -> str:
+    if isinstance(message, dict):
+        role = str(message.get('role', 'unknown'))
+        content = str(message.get('content', ''))
+    else:
+        role = 'unknown'
+        content = str(message)
+    return f"{role.capitalize()}: {content}\n"
+
+
+def _summarize_message(message: dict, max_chars: int = 160) -> str:
+    content = " ".join(str(message.get('content', '')).split())
+    sentence = content.split(". ")[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rstrip() + "..."
+    return f"- {str(message.get('role', 'unknown')).capitalize()}: {sentence}"
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages: List[dict] = []
+        self.formatted: List[str] = []
+        self.chat_context = ""
+        self.token_count = 0
+        self.summary = ""
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    def render_context(self) -> str:
+        if not self.chat_context and not self.summary:
+            return NO_HISTORY
+        if self.summary:
+            return f"Summary of earlier conversation:\n{self.summary}\n\n{self.chat_context}"
+        return self.chat_context
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "messages": self.messages,
+            "summary": self.summary,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Session":
+        session = cls(data["session_id"])
+        session.summary = data.get("summary", "")
+        session.created_at = data.get("created_at", time.time())
+        session.updated_at = data.get("updated_at", session.created_at)
+        for message in data.get("messages", []):
+            session._append(message)
+        return session
+
+    def _append(self, message: dict):
+        line = format_message(message)
+        self.messages.append(message)
+        self.formatted.append(line)
+        self.chat_context += line
+        self.token_count += estimate_tokens(line)
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 1000, idle_ttl_seconds: float = 3600.0, max_history_tokens: int = 2000, persist_path: Optional[str] = None, compact_to_ratio: float = 1.0):
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_history_tokens = max_history_tokens
+        self.compact_to_ratio = compact_to_ratio
+        self.persist_path = persist_path
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._db = None
+        self._last_sweep = time.monotonic()
+        if persist_path:
+            self._initialize_db()
+
+    def _initialize_db(self):
+        try:
+            self._db = sqlite3.connect(self.persist_path, check_same_thread=False, timeout=10)
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._db.commit()
+            logger.info(f"Session store persisting to {self.persist_path}")
+        except Exception as e:
+            logger.error(f"Failed to open session database, keeping sessions in memory only: {e}")
+            self._db = None
+
+    def _persist(self, session: Session):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session.session_id, json.dumps(session.to_dict()), session.updated_at),
+            )
+            self._db.commit()
+        except Exception as e:
+            logger.error(f"Failed to persist session {session.session_id}: {e}")
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            return Session.from_dict(json.loads(row[0])) if row else None
+        except Exception as e:
+            logger.error(f"Failed to load session {session_id}: {e}")
+            return None
+
+    def _is_stale(self, session: Session) -> bool:
+        # another worker sharing the database may have appended turns since this copy was cached
+        if self._db is None:
+            return False
+        try:
+            row = self._db.execute("SELECT updated_at FROM sessions WHERE session_id = ?", (session.session_id,)).fetchone()
+            return row is not None and row[0] > session.updated_at
+        except Exception as e:
+            logger.error(f"Failed to check session {session.session_id} freshness: {e}")
+            return False
+
+    def _is_idle(self, session: Session) -> bool:
+        return self.idle_ttl_seconds is not None and time.time() - session.updated_at > self.idle_ttl_seconds
+
+    def _remember(self, session: Session):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            self._maybe_sweep()
+            session = self._sessions.get(session_id)
+            if session is None or self._is_stale(session):
+                session = self._load(session_id) or session
+            if session is None:
+                return None
+            if self._is_idle(session):
+                self.delete(session_id)
+                return None
+            self._remember(session)
+            return session
+
+    def get_or_create(self, session_id: str) -> Session:
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                session = Session(session_id)
+                self._remember(session)
+            return session
+
+    def sync_history(self, session_id: str, chat_history: List[dict]) -> Session:
+        with self._lock:
+            session = self.get_or_create(session_id)
+            new_messages = self._unseen_messages(session, chat_history)
+            if new_messages is None:
+                session = Session(session_id)
+                self._remember(session)
+                new_messages = chat_history
+
+            for message in new_messages:
+                session._append(message)
+            if new_messages:
+                self._compact(session)
+                session.updated_at = time.time()
+                self._persist(session)
+            return session
+
+    def _unseen_messages(self, session: Session, chat_history: List[dict]) -> Optional[List[dict]]:
+        known = len(session.messages)
+        if known == 0:
+            return None if session.summary else chat_history
+        # a client resending its full history still has the turns folded into the summary, so the kept turns can end anywhere
+        ends = range(len(chat_history), known - 1, -1) if session.summary else [known]
+        for end in ends:
+            if chat_history[end - known:end] == session.messages:
+                return chat_history[end:]
+        return None
+
+    def append_turn(self, session_id: str, question: str, answer: str) -> Session:
+        with self._lock:
+            session = self.get_or_create(session_id)
+            session._append({"role": "user", "content": question})
+            session._append({"role": "assistant", "content": answer})
+            self._compact(session)
+            session.updated_at = time.time()
+            self._persist(session)
+            return session
+
+    def _compact(self, session: Session):
+        if session.token_count <= self.max_history_tokens:
+            return
+        # compacting below the budget leaves the rendered history (the start of every prompt) unchanged for the next few turns
+        target = int(self.max_history_tokens * self.compact_to_ratio)
+        folded = []
+        while session.token_count > target and len(session.messages) > 2:
+            message = session.messages.pop(0)
+            line = session.formatted.pop(0)
+            session.chat_context = session.chat_context[len(line):]
+            session.token_count -= estimate_tokens(line)
+            folded.append(_summarize_message(message))
+
+        if folded:
+            lines = (session.summary.splitlines() if session.summary else []) + folded
+            while lines and estimate_tokens("\n".join(lines)) > self.max_history_tokens // 4:
+                lines.pop(0)
+            session.summary = "\n".join(lines)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            existed = self._sessions.pop(session_id, None) is not None
+            if self._db is not None:
+                try:
+                    cursor = self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    self._db.commit()
+                    existed = existed or cursor.rowcount > 0
+                except Exception as e:
+                    logger.error(f"Failed to delete session {session_id}: {e}")
+            return existed
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep > 60:
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            self._last_sweep = time.monotonic()
+            if self.idle_ttl_seconds is None:
+                return 0
+            idle = [session_id for session_id, session in self._sessions.items() if self._is_idle(session)]
+            for session_id in idle:
+                self._sessions.pop(session_id, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.idle_ttl_seconds,))
+                    self._db.commit()
+                except Exception as e:
+                    logger.error(f"Failed to evict idle sessions from database: {e}")
+            if idle:
+                logger.info(f"Evicted {len(idle)} idle sessions")
+            return len(idle)
+
+    def describe(self, session: Session) -> Dict:
+        return {
+            "session_id": session.session_id,
+            "messages": len(session.messages),
+            "token_count": session.token_count,
+            "summary": session.summary or None,
+            "created_at": session.created_at,
+            "updated_at": session.updated_at,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "persistent": self._db is not None,
+            }
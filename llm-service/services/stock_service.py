@@ -3,7 +3,7 @@ stock_service.py
 
 What is this file for: Provides real-time stock data retrieval using Polygon.io API for financial ticker information and news.
 
-What the flow of the functions are: extract_stock_tickers() identifies stock symbols in queries, get_stock_data() fetches price data, news, and financials from Polygon API, and should_use_stock_api() determines when stock data is needed.
+What the flow of the functions are: extract_stock_tickers() identifies stock symbols in queries, get_stocks_data() fetches price data, news, and financials from Polygon API through the shared rate limiter, and should_use_stock_api() determines when stock data is needed.
 
 How this service is used: Integrated into the advanced RAG service to provide real-time stock information when users ask about specific companies or market data.
 """
@@ -15,21 +15,42 @@ from langchain_community.tools.polygon.ticker_news import PolygonTickerNews
 from langchain_community.tools.polygon.last_quote import PolygonLastQuote
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
+import ast
+import contextvars
+import json
 import logging
 import re
 import os
 
+from .deadline import DeadlineExceededError
+from .llm_scheduler import SchedulerOverloadedError
+from .resilience import DependencyGuard
+from .rate_limiter import RateLimitExceededError, RateLimitedClient
+from .price_store import PriceStore
+from .financial_records import PromptBlockCache, parse_financials, parse_news
+
 logger = logging.getLogger(__name__)
 
+def _is_delayed_response(error: Exception) -> bool:
+    error_str = str(error)
+    return "API Error:" in error_str and "DELAYED" in error_str
+
 class StockService:
-    def __init__(self, llm=None):
+    def __init__(self, llm=None, price_store: Optional[PriceStore] = None, prompt_block_tokens: int = 300, guard: Optional[DependencyGuard] = None, limiter: Optional[RateLimitedClient] = None):
+        self.guard = guard or DependencyGuard()
+        self.limiter = limiter or RateLimitedClient(self.guard, "polygon")
         self.api_wrapper = None
         self.aggregates_tool = None
         self.financials_tool = None
         self.news_tool = None
         self.last_quote_tool = None
         self.llm = llm
+        self.price_store = price_store
+        self.prompt_blocks = PromptBlockCache(max_tokens=prompt_block_tokens)
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="polygon-call")
         self._initialize_polygon()
     
     def _initialize_polygon(self):
@@ -82,7 +103,6 @@ class StockService:
         latest = results[-1]
         
 
-        from datetime import datetime
         timestamp_ms = latest.get('t', 0)
         date = datetime.fromtimestamp(timestamp_ms / 1000).strftime('%Y-%m-%d')
         
@@ -102,127 +122,131 @@ class StockService:
         
         return cleaned_data
     
-    def get_stock_data(self, ticker: str) -> Dict[str, Any]:
-        if not self.is_available():
-            return {"error": "Stock service not available"}
-        
+    def _fetch_aggregates(self, ticker: str, from_date: str, to_date: str) -> Optional[dict]:
+        request_params = {
+            "ticker": ticker,
+            "timespan": "day",
+            "timespan_multiplier": 1,
+            "from_date": from_date,
+            "to_date": to_date,
+        }
         try:
-            ticker = ticker.upper().replace('$', '')
-            result = {
-                "ticker": ticker,
-                "data": {},
-                "news": [],
-                "financials": {}
-            }
-            
+            aggregates_result = self.limiter.call("aggregates", self.aggregates_tool.invoke, request_params, is_failure=lambda e: not _is_delayed_response(e))
 
-            if self.news_tool:
-                try:
-                    news_result = self.news_tool.invoke({"query": ticker})
-                    if news_result and hasattr(news_result, 'content'):
-                        result["news"] = news_result.content
-                except Exception as e:
-                    result["news"] = []
-            else:
-                result["news"] = []
-            
+            raw_data = aggregates_result.content if hasattr(aggregates_result, 'content') else aggregates_result
+            if isinstance(raw_data, str):
+                raw_data = json.loads(raw_data)
+            if isinstance(raw_data, list):
+                return {"status": "OK", "resultsCount": len(raw_data), "results": raw_data}
+            if isinstance(raw_data, dict):
+                return raw_data
+            return None
 
-            if self.financials_tool:
-                try:
-                    financials_result = self.financials_tool.invoke({"query": ticker})
-                    if financials_result and hasattr(financials_result, 'content'):
-                        result["financials"] = financials_result.content
-                except Exception as e:
-                    result["financials"] = {}
-            else:
-                result["financials"] = {}
-
-            if self.aggregates_tool:
+        except RateLimitExceededError as e:
+            logger.warning(f"Skipping aggregates for {ticker}: {e}")
+            return None
+        except Exception as e:
+            # delayed (free tier) responses are raised as an API error that still carries the full response
+            error_str = str(e)
+            if not _is_delayed_response(e):
+                logger.error(f"Error fetching aggregates for {ticker}: {e}")
+                return None
+            start_idx = error_str.find("{")
+            if start_idx == -1:
+                return None
+            api_response_str = error_str[start_idx:]
+            try:
+                return ast.literal_eval(api_response_str)
+            except Exception:
                 try:
-                    from datetime import datetime, timedelta
-                    end_date = datetime.now()
-                    start_date = end_date - timedelta(days=5)
-                    
+                    return json.loads(api_response_str)
+                except Exception:
+                    return None
 
-                    request_params = {
-                        "ticker": ticker,
-                        "timespan": "day",
-                        "timespan_multiplier": 1,
-                        "from_date": start_date.strftime("%Y-%m-%d"),
-                        "to_date": end_date.strftime("%Y-%m-%d"),
-                    }
-                    
-                    aggregates_result = self.aggregates_tool.invoke(request_params)
-                    
-                    if aggregates_result:
+    def get_stock_data(self, ticker: str) -> Dict[str, Any]:
+        return self.get_stocks_data([ticker])[ticker.upper().replace('$', '')]
 
-                        raw_data = None
-                        if hasattr(aggregates_result, 'content'):
-                            raw_data = aggregates_result.content
-                        else:
-                            raw_data = aggregates_result
-                        
+    def get_stocks_data(self, tickers: List[str], results: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        results = {} if results is None else results
+        tickers = [ticker.upper().replace('$', '') for ticker in tickers]
+        if not self.is_available():
+            for ticker in tickers:
+                results[ticker] = {"error": "Stock service not available"}
+            return results
 
-                        if isinstance(raw_data, dict):
-                            results_count = raw_data.get('resultsCount', 0)
-                            
-                            if results_count > 0:
+        # every call reaches the rate limiter at once, price data for all tickers first, so its priorities decide
+        # what gets the budget instead of the order the calls would otherwise be made in
+        fetchers = [("price", self._fetch_price), ("news", self._fetch_news), ("financials", self._fetch_financials)]
+        pending = {ticker: {} for ticker in tickers}
+        for name, fetch in fetchers:
+            for ticker in tickers:
+                pending[ticker][name] = self._executor.submit(contextvars.copy_context().run, fetch, ticker)
 
-                                result["data"] = self._clean_price_data(raw_data)
-                            else:
-                                result["data"] = {}
-                        else:
-                            result["data"] = {}
-                    else:
-                        result["data"] = {}
-                    
-                except Exception as e:
+        # filled ticker by ticker, so a caller cut short by its deadline keeps the tickers that did arrive
+        for ticker in tickers:
+            try:
+                fetched = {name: future.result() for name, future in pending[ticker].items()}
+                price_data, analytics = fetched["price"]
+                news, news_digest = fetched["news"]
+                financials, financial_snapshot = fetched["financials"]
+                result = {"ticker": ticker, "data": price_data, "news": news, "financials": financials}
+                if analytics is not None:
+                    result["analytics"] = analytics
+                result["prompt_block"] = self.prompt_blocks.render(
+                    ticker,
+                    price_data=price_data,
+                    analytics=analytics,
+                    financials=financial_snapshot,
+                    news=news_digest,
+                )
+                results[ticker] = result
+            except Exception as e:
+                logger.error(f"Error getting stock data for {ticker}: {e}")
+                results[ticker] = {"ticker": ticker, "data": {}, "news": [], "financials": {}}
+        return results
 
-                    if "API Error:" in str(e) and "DELAYED" in str(e):
-                        try:
- 
-                            error_str = str(e)
-                            if "API Error:" in error_str:
+    def _fetch_price(self, ticker: str) -> tuple:
+        if not self.aggregates_tool:
+            return {}, None
+        analytics = None
+        if self.price_store:
+            missing_range = self.price_store.missing_range(ticker)
+            if missing_range:
+                fetched = self._fetch_aggregates(ticker, *missing_range)
+                if fetched is not None:
+                    self.price_store.merge(ticker, fetched.get('results') or [])
+            raw_data = self.price_store.latest_bars(ticker)
+            analytics = self.price_store.analytics(ticker)
+        else:
+            end_date = datetime.now()
+            start_date = end_date - timedelta(days=5)
+            raw_data = self._fetch_aggregates(ticker, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
 
-                                start_idx = error_str.find("{")
-                                if start_idx != -1:
-                                    import json
-                                    import ast
-                                    api_response_str = error_str[start_idx:]
+        if raw_data and raw_data.get('resultsCount', 0) > 0:
+            return self._clean_price_data(raw_data), analytics
+        return {}, analytics
 
-                                    try:
-                                        api_response = ast.literal_eval(api_response_str)
-                                    except:
+    def _fetch_news(self, ticker: str) -> tuple:
+        if not self.news_tool:
+            return [], None
+        try:
+            news_result = self.limiter.call("ticker_news", self.news_tool.invoke, {"query": ticker})
+            digest = parse_news(ticker, news_result)
+            return (digest.to_dict() if digest.headlines else []), digest
+        except Exception as e:
+            return [], None
 
-                                        try:
-                                            api_response = json.loads(api_response_str)
-                                        except:
-                                            result["data"] = {}
-                                            return result
-                                    
-  
-                                    if api_response.get('resultsCount', 0) > 0 and api_response.get('results'):
-    
-                                        result["data"] = self._clean_price_data(api_response)
-                                        return result
-                                    else:
-                                        result["data"] = {}
-                                else:
-                                    result["data"] = {}
-                            else:
-                                result["data"] = {}
-                        except Exception as parse_error:
-                            result["data"] = {}
-                    else:
-                        result["data"] = {}
-            else:
-                result["data"] = {}
-            
-            return result
-            
+    def _fetch_financials(self, ticker: str) -> tuple:
+        if not self.financials_tool:
+            return {}, None
+        try:
+            financials_result = self.limiter.call("financials", self.financials_tool.invoke, {"query": ticker})
+            snapshot = parse_financials(ticker, financials_result)
+            if snapshot and snapshot.metrics:
+                return snapshot.to_dict(), snapshot
+            return {}, None
         except Exception as e:
-            logger.error(f"Error getting stock data for {ticker}: {e}")
-            return {"ticker": ticker, "data": {}, "news": [], "financials": {}}
+            return {}, None
 
     def should_use_stock_api(self, query: str) -> tuple[bool, List[str]]:
         if not self.llm:
@@ -261,7 +285,7 @@ Only return the exact format above - no other text."""),
             ("human", "Query: {query}")
         ])
         
-        chain = prompt | self.llm | StrOutputParser()
+        chain = prompt | self.llm.with_config(run_name="ticker_classification") | StrOutputParser()
         
         try:
             response = chain.invoke({"query": query})
@@ -285,6 +309,12 @@ Only return the exact format above - no other text."""),
             else:
                 return (False, [])
                 
+        except DeadlineExceededError:
+            raise
+        except SchedulerOverloadedError as e:
+            # the guess below would send Polygon calls for every capitalized word, not worth it while overloaded
+            logger.warning(f"Skipping stock API decision, LLM scheduler is overloaded: {e}")
+            return (False, [])
         except Exception as e:
             logger.error(f"Error using LLM for stock API decision: {e}")
             tickers = self.extract_stock_tickers(query)
@@ -0,0 +1,134 @@
+"""
+token_usage.py
+
+What is this file for: Accounts for the prompt and completion tokens and time of every Ollama call, per call and per request, and flags prompts that grow past their configured size.
+
+What the flow of the functions are: usage_scope() collects a request's RequestUsage, record_generation() reads Ollama's response metadata into metrics and that usage, and check_prompt_size() flags oversized prompt parts.
+
+How this service is used: ScheduledLLM records every generation, the RAG services check their prompt sizes, and main.py returns the summary as usage when include_usage is set.
+"""
+
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.outputs import LLMResult
+from typing import Any, Dict, List, Optional
+import contextvars
+import logging
+import threading
+
+from .metrics import LLM_PHASE_DURATION, LLM_PROMPT_OVERSIZE_TOTAL, LLM_TOKENS_TOTAL
+from .session_store import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPT_LIMITS = {
+    "chat_context": 2000,
+    "final_context": 3000,
+}
+
+# Ollama reports durations in nanoseconds
+PHASES = {
+    "load": "load_duration",
+    "prompt_eval": "prompt_eval_duration",
+    "eval": "eval_duration",
+}
+
+current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+class GenerationInfoCapture(BaseCallbackHandler):
+    def __init__(self):
+        self.generation_info: Optional[Dict[str, Any]] = None
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        if response.generations and response.generations[0]:
+            self.generation_info = response.generations[0][0].generation_info
+
+
+def with_capture(config: Optional[dict], capture: GenerationInfoCapture) -> dict:
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(capture, inherit=False)
+    else:
+        callbacks = list(callbacks or []) + [capture]
+    config["callbacks"] = callbacks
+    return config
+
+
+class RequestUsage:
+    def __init__(self):
+        self._calls: List[Dict[str, Any]] = []
+        self._oversized: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_call(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._calls.append(entry)
+
+    def add_oversized(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._oversized.append(entry)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self._calls)
+            oversized = list(self._oversized)
+        summary = {
+            "llm_calls": len(calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+        }
+        summary["total_tokens"] = summary["prompt_tokens"] + summary["completion_tokens"]
+        for phase in PHASES:
+            summary[f"{phase}_seconds"] = round(sum(call[f"{phase}_seconds"] for call in calls), 4)
+        summary["calls"] = calls
+        if oversized:
+            summary["oversized_prompts"] = oversized
+        return summary
+
+
+@contextmanager
+def usage_scope():
+    usage = RequestUsage()
+    token = current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        current_usage.reset(token)
+
+
+def record_generation(call_name: str, generation_info: Optional[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None):
+    if not generation_info:
+        return
+    entry = {
+        "call": call_name,
+        "prompt_tokens": int(generation_info.get("prompt_eval_count") or 0),
+        "completion_tokens": int(generation_info.get("eval_count") or 0),
+    }
+    for phase, key in PHASES.items():
+        entry[f"{phase}_seconds"] = round((generation_info.get(key) or 0) / 1e9, 4)
+        if generation_info.get(key):
+            LLM_PHASE_DURATION.observe(entry[f"{phase}_seconds"], call=call_name, phase=phase)
+    LLM_TOKENS_TOTAL.inc(entry["prompt_tokens"], call=call_name, kind="prompt")
+    LLM_TOKENS_TOTAL.inc(entry["completion_tokens"], call=call_name, kind="completion")
+
+    if extra:
+        entry.update(extra)
+
+    usage = current_usage.get()
+    if usage is not None:
+        usage.add_call(entry)
+
+
+def check_prompt_size(prompt: str, text: str, limits: Optional[Dict[str, int]] = None) -> int:
+    tokens = estimate_tokens(text)
+    limit = (limits or DEFAULT_PROMPT_LIMITS).get(prompt)
+    if limit and tokens > limit:
+        LLM_PROMPT_OVERSIZE_TOTAL.inc(prompt=prompt)
+        logger.warning(f"Prompt part {prompt} is about {tokens} tokens, over its {limit} token limit")
+        usage = current_usage.get()
+        if usage is not None:
+            usage.add_oversized({"prompt": prompt, "estimated_tokens": tokens, "limit": limit})
+    return tokens
@@ -3,31 +3,106 @@ vector_store.py
 
 What is this file for: Manages Qdrant vector database for storing and retrieving document embeddings for similarity search.
 
-What the flow of the functions are: _initialize_client() sets up Qdrant connection, _initialize_collection() creates or connects to existing collection, add_documents() stores document chunks with embeddings, and get_retriever() creates search interface for RAG operations.
+What the flow of the functions are: _initialize_client() sets up an embedded or server Qdrant connection, _initialize_collection() creates or connects to existing collection, add_documents() stores document chunks with embeddings without duplicating existing ones, and get_retriever() and similarity_search_batch() search it, optionally restricted by build_filter() document filters.
 
 How this service is used: Provides the core vector storage and retrieval functionality for the RAG system, enabling semantic search across financial documents.
 """
 
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from qdrant_client.http.models import DatetimeRange, Distance, FieldCondition, Filter, MatchAny, PayloadSchemaType, QueryRequest, VectorParams
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
-from langchain_ollama import OllamaEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from typing import Any, Dict, Optional
+import hashlib
+import httpx
 import logging
 import os
+import uuid
+
+from .embedding_cache import CachedEmbeddings
+from .metrics import EMBEDDING_LATENCY, request_mode, track_external_call
 
 logger = logging.getLogger(__name__)
 
-class VectorStoreService:
-    def __init__(self, embeddings: OllamaEmbeddings, db_path: str = "../vector-db"):
+# metadata fields retrieval can be filtered on, indexed so filtered search does not scan every point
+PAYLOAD_INDEXES = {
+    "source": PayloadSchemaType.KEYWORD,
+    "doc_type": PayloadSchemaType.KEYWORD,
+    "date": PayloadSchemaType.DATETIME,
+}
+
+def build_filter(filters: Optional[Dict[str, Any]], metadata_key: str = "metadata") -> Optional[Filter]:
+    if not filters:
+        return None
+    conditions = []
+    if filters.get("sources"):
+        conditions.append(FieldCondition(key=f"{metadata_key}.source", match=MatchAny(any=list(filters["sources"]))))
+    if filters.get("doc_types"):
+        conditions.append(FieldCondition(key=f"{metadata_key}.doc_type", match=MatchAny(any=list(filters["doc_types"]))))
+    if filters.get("date_from") or filters.get("date_to"):
+        conditions.append(FieldCondition(key=f"{metadata_key}.date", range=DatetimeRange(gte=filters.get("date_from"), lte=filters.get("date_to"))))
+    return Filter(must=conditions) if conditions else None
+
+class InstrumentedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, cache: str = "none"):
         self.embeddings = embeddings
+        self.cache = cache
+        self.service = getattr(embeddings, "service_name", "ollama")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with EMBEDDING_LATENCY.time(operation="documents", mode=request_mode.get(), cache="none"):
+            with track_external_call(self.service, "embed"):
+                return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        with EMBEDDING_LATENCY.time(operation="query", mode=request_mode.get(), cache=self.cache):
+            with track_external_call(self.service, "embed"):
+                return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        with EMBEDDING_LATENCY.time(operation="query_batch", mode=request_mode.get(), cache=self.cache):
+            with track_external_call(self.service, "embed"):
+                return self.embeddings.embed_documents(texts)
+
+class ScoredRetriever(BaseRetriever):
+    vector_store: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun, filters: Optional[Dict[str, Any]] = None) -> list[Document]:
+        documents = []
+        qdrant_filter = build_filter(filters, self.vector_store.metadata_payload_key)
+        for doc, score in self.vector_store.similarity_search_with_score(query, k=self.k, filter=qdrant_filter):
+            doc.metadata["_score"] = float(score)
+            documents.append(doc)
+        return documents
+
+def document_id(doc: Document) -> str:
+    metadata = doc.metadata or {}
+    content_hash = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{metadata.get('source', '')}:{metadata.get('page', '')}:{metadata.get('chunk_id', '')}:{content_hash}"))
+
+class VectorStoreService:
+    def __init__(self, embeddings: Embeddings, db_path: str = "../vector-db", cache_size: int = 2048, cache_ttl_seconds: float = 3600.0, url: Optional[str] = None, api_key: Optional[str] = None, prefer_grpc: bool = False, pool_size: int = 16):
+        if cache_size > 0:
+            model_name = getattr(embeddings, "model", type(embeddings).__name__)
+            self.embeddings = CachedEmbeddings(InstrumentedEmbeddings(embeddings, cache="miss"), model_name, cache_size, cache_ttl_seconds)
+        else:
+            self.embeddings = InstrumentedEmbeddings(embeddings)
         self.db_path = db_path
+        self.url = url
+        self.api_key = api_key
+        self.prefer_grpc = prefer_grpc
+        self.pool_size = pool_size
         self.client = None
         self.vector_store = None
         self.collection_name = "financial_docs"
 
         #make vector db directory
-        os.makedirs(db_path, exist_ok=True)
+        if not url:
+            os.makedirs(db_path, exist_ok=True)
         
         self._initialize_client()
         self._initialize_collection()
@@ -35,8 +110,19 @@ class VectorStoreService:
     
     def _initialize_client(self):
         try:
-            self.client = QdrantClient(path=f"{self.db_path}/qdrant_data")
-            logger.info("Qdrant client initialized successfully")
+            if self.url:
+                # a Qdrant server can be shared by every worker, unlike the embedded store which locks its directory
+                self.client = QdrantClient(
+                    url=self.url,
+                    api_key=self.api_key,
+                    prefer_grpc=self.prefer_grpc,
+                    timeout=30,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                )
+                logger.info(f"Qdrant client connected to server at {self.url}")
+            else:
+                self.client = QdrantClient(path=f"{self.db_path}/qdrant_data")
+                logger.info("Qdrant client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Qdrant client: {e}")
             raise
@@ -53,17 +139,38 @@ class VectorStoreService:
                 logger.info(f"Collection {self.collection_name} already exists")
                 logger.info(f"Using existing collection: {self.collection_name}")
             else:
+                try:
+                    self.client.create_collection(
+                        collection_name=self.collection_name,
+                        vectors_config=VectorParams(size=768, distance=Distance.COSINE),
+                    )
+                    logger.info(f"Created new collection: {self.collection_name} with 768 dimensions")
+                except Exception:
+                    # another worker sharing the server may have created it first
+                    if not self.client.collection_exists(self.collection_name):
+                        raise
+                    logger.info(f"Collection {self.collection_name} was created by another worker")
 
-                self.client.create_collection(
-                    collection_name=self.collection_name,
-                    vectors_config=VectorParams(size=768, distance=Distance.COSINE),
-                )
-                logger.info(f"Created new collection: {self.collection_name} with 768 dimensions")
+            if self.url:
+                self._ensure_payload_indexes()
             
         except Exception as e:
             logger.error(f"Failed to initialize collection: {e}")
             raise
     
+    def _ensure_payload_indexes(self):
+        # the embedded store ignores payload indexes, so they are only created on a Qdrant server
+        indexed = set((self.client.get_collection(self.collection_name).payload_schema or {}).keys())
+        for field, schema in PAYLOAD_INDEXES.items():
+            field_name = f"metadata.{field}"
+            if field_name in indexed:
+                continue
+            try:
+                self.client.create_payload_index(self.collection_name, field_name=field_name, field_schema=schema)
+                logger.info(f"Created {schema.value} payload index on {field_name}")
+            except Exception as e:
+                logger.error(f"Failed to create payload index on {field_name}: {e}")
+
     def _initialize_vector_store(self):
 
         try:
@@ -86,16 +193,25 @@ class VectorStoreService:
             if not self.vector_store:
                 raise ValueError("Vector store not initialized")
             
-            logger.info(f"Adding documents to vector store")
+            # deterministic ids make ingestion idempotent: chunks already stored are neither re-embedded nor duplicated
+            ids = [document_id(doc) for doc in documents]
+            existing = self._stored_metadata(ids)
+            pending = [(doc, doc_id) for doc, doc_id in zip(documents, ids) if doc_id not in existing]
+            self._refresh_metadata([(doc, doc_id) for doc, doc_id in zip(documents, ids) if doc_id in existing and existing[doc_id] != doc.metadata])
+            if not pending:
+                logger.info(f"All {len(documents)} documents already in vector store, skipping ingestion")
+                return True
+
+            logger.info(f"Adding {len(pending)} documents to vector store ({len(existing)} already stored)")
             
             batch_size = 100
-            total_batches = (len(documents) + batch_size - 1) // batch_size
+            total_batches = (len(pending) + batch_size - 1) // batch_size
             
-            for i in range(0, len(documents), batch_size):
-                batch = documents[i:i + batch_size]
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
                 batch_num = (i // batch_size) + 1
                 
-                self.vector_store.add_documents(batch)
+                self.vector_store.add_documents([doc for doc, _ in batch], ids=[doc_id for _, doc_id in batch])
                 logger.info(f"Completed batch {batch_num}/{total_batches}")
             
             logger.info(f"Successfully added all documents to vector store")
@@ -104,15 +220,34 @@ class VectorStoreService:
             logger.error(f"Failed to add documents: {e}")
             return False
     
+    def _stored_metadata(self, ids: list[str]) -> dict:
+        metadata_key = self.vector_store.metadata_payload_key
+        stored = {}
+        for i in range(0, len(ids), 256):
+            points = self.client.retrieve(self.collection_name, ids=ids[i:i + 256], with_payload=[metadata_key], with_vectors=False)
+            stored.update({str(point.id): (point.payload or {}).get(metadata_key) or {} for point in points})
+        return stored
+
+    def _refresh_metadata(self, stale: list):
+        # chunks stored before their document gained a url, type or date only need a payload update, not re-embedding
+        for doc, doc_id in stale:
+            self.client.set_payload(self.collection_name, payload={self.vector_store.metadata_payload_key: doc.metadata}, points=[doc_id])
+        if stale:
+            logger.info(f"Refreshed metadata of {len(stale)} stored documents")
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception as e:
+                logger.error(f"Failed to close Qdrant client: {e}")
+
     def get_retriever(self, k: int = 4):
         try:
             if not self.vector_store:
                 raise ValueError("Vector store not initialized")
             
-            retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": k}
-            )
+            retriever = ScoredRetriever(vector_store=self.vector_store, k=k)
             logger.info(f"Created retriever with k={k}")
             return retriever
             
@@ -120,6 +255,55 @@ class VectorStoreService:
             logger.error(f"Failed to create retriever: {e}")
             raise
     
+    def similarity_search_batch(self, queries: list[str], k: int = 4, filters: Optional[Dict[str, Any]] = None) -> list[list[Document]]:
+        try:
+            if self.client is None or not self.vector_store:
+                raise ValueError("Vector store not initialized")
+            if not queries:
+                return []
+
+            unique_queries = list(dict.fromkeys(queries))
+            vectors = self.embeddings.embed_queries(unique_queries)
+            qdrant_filter = build_filter(filters, self.vector_store.metadata_payload_key)
+            responses = self.client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[QueryRequest(query=vector, filter=qdrant_filter, limit=k, with_payload=True) for vector in vectors],
+            )
+
+            # chunks shared between queries are parsed once, each result gets its own copy carrying that query's score
+            payloads_by_id = {}
+            results_by_query = {}
+            for query, response in zip(unique_queries, responses):
+                docs = []
+                for point in response.points:
+                    doc = payloads_by_id.get(point.id)
+                    if doc is None:
+                        doc = self._document_from_point(point)
+                        payloads_by_id[point.id] = doc
+                    docs.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "_score": float(point.score)}))
+                results_by_query[query] = docs
+
+            logger.info(f"Batched search for {len(queries)} queries ({len(unique_queries)} unique) returned {len(payloads_by_id)} unique chunks")
+            return [results_by_query[query] for query in queries]
+        except Exception as e:
+            logger.error(f"Failed batched similarity search: {e}")
+            raise
+
+    def _document_from_point(self, point) -> Document:
+        payload = point.payload or {}
+        metadata = dict(payload.get(self.vector_store.metadata_payload_key) or {})
+        metadata["_id"] = point.id
+        metadata["_collection_name"] = self.collection_name
+        return Document(
+            page_content=payload.get(self.vector_store.content_payload_key, ""),
+            metadata=metadata,
+        )
+
+    def get_embedding_cache_stats(self) -> dict:
+        if isinstance(self.embeddings, CachedEmbeddings):
+            return self.embeddings.stats()
+        return {"enabled": False}
+
     def get_collection_info(self) -> dict:
         try:
             if self.client is None:
@@ -3,21 +3,110 @@ web_search_service.py
 
 What is this file for: Provides web search capabilities using SerpAPI to supplement document knowledge with current information.
 
-What the flow of the functions are: _initialize_serpapi() sets up Google search API, search() performs web queries, and should_use_web_search() determines when RAG answers need web supplementation based on insufficient indicators or current information requests.
+What the flow of the functions are: _initialize_serpapi() sets up Google search API, search() performs web queries and returns the deduplicated results most relevant to the query, assess_retrieval() judges from the retrieved chunks whether the document can answer, and should_use_web_search() remains the answer-based fallback.
 
-How this service is used: Integrated into the advanced RAG service as a fallback when document knowledge is insufficient or when users request current information not available in the reference document.
+How this service is used: Integrated into the advanced RAG service when document knowledge is insufficient or when users request current information not available in the reference document.
 """
 
 from langchain_community.utilities.serpapi import SerpAPIWrapper
 from typing import Dict, Any, Optional, List
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from urllib.parse import urlsplit
 import logging
+import math
 import os
+import re
+
+from .metrics import WEB_SEARCH_SNIPPETS_TOTAL
+from .resilience import CircuitOpenError, DependencyGuard
+from .session_store import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+CURRENT_INFO_KEYWORDS = [
+    "current", "latest", "recent", "today", "now", "latest news",
+    "current price", "current market", "recent developments", "this week", "this month"
+    "search", "find", "look up", "check", "search for", "find out", "web search",
+    "web results", "web search results", "search the web", "search online", "find online", 
+    "web", "online"
+]
+
+STOPWORDS = {
+    "the", "and", "for", "are", "was", "were", "what", "when", "where", "which", "who", "why", "how",
+    "does", "did", "can", "could", "should", "would", "will", "with", "about", "from", "that", "this",
+    "there", "their", "them", "they", "have", "has", "had", "into", "your", "you", "its", "is", "a",
+    "an", "of", "to", "in", "on", "me", "my", "tell", "explain", "please", "some", "any", "do",
+}
+
+
+def query_terms(text: str) -> List[str]:
+    terms = re.findall(r"[a-z0-9][a-z0-9'-]+", text.lower())
+    return list(dict.fromkeys(term for term in terms if len(term) > 2 and term not in STOPWORDS))
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip().lower())
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    return f"{host}{parts.path.rstrip('/')}"
+
+
+def normalize_snippet(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
+
+
+def parse_results(raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    results = []
+    answer_box = raw.get("answer_box_list") or raw.get("answer_box")
+    if isinstance(answer_box, list):
+        answer_box = answer_box[0] if answer_box else None
+    if isinstance(answer_box, dict):
+        snippet = answer_box.get("result") or answer_box.get("answer") or answer_box.get("snippet")
+        if isinstance(snippet, str) and snippet.strip():
+            results.append({"title": answer_box.get("title") or "Google answer", "snippet": snippet, "url": answer_box.get("link"), "date": answer_box.get("date")})
+
+    for item in raw.get("organic_results") or []:
+        if item.get("snippet"):
+            results.append({"title": item.get("title") or item.get("source") or "Web result", "snippet": item["snippet"], "url": item.get("link"), "date": item.get("date")})
+
+    # news results have no snippet, the headline is what there is to go on
+    for item in raw.get("top_stories") or raw.get("news_results") or []:
+        if item.get("title"):
+            results.append({"title": item.get("source") or item["title"], "snippet": item.get("snippet") or item["title"], "url": item.get("link"), "date": item.get("date")})
+    return results
+
+
+def web_source(source_id: int, result: Dict[str, Any]) -> Dict[str, Any]:
+    site = urlsplit(result["url"]).netloc if result.get("url") else None
+    dated = f", {result['date']}" if result.get("date") else ""
+    return {
+        "id": source_id,
+        "content": result["snippet"],
+        "metadata": {"source_type": "web", "site": site, "date": result.get("date")},
+        "score": result.get("score"),
+        "page": None,
+        "title": result["title"],
+        "citation_text": f"[{source_id}] {result['title']}{f' ({site})' if site else ''}{dated}",
+        "url": result.get("url")
+    }
+
+
 class WebSearchService:
-    def __init__(self):
+    def __init__(self, in_corpus_score: float = 0.62, out_of_corpus_score: float = 0.45, min_term_coverage: float = 0.5, standout_spread: float = 0.1, guard: Optional[DependencyGuard] = None, embeddings: Optional[Embeddings] = None, snippet_token_budget: int = 400, min_relevance: float = 0.0):
         self.search_wrapper = None
+        self.guard = guard or DependencyGuard()
+        self.embeddings = embeddings
+        self.snippet_token_budget = snippet_token_budget
+        self.min_relevance = min_relevance
+        self.in_corpus_score = in_corpus_score
+        self.out_of_corpus_score = out_of_corpus_score
+        self.min_term_coverage = min_term_coverage
+        self.standout_spread = standout_spread
         self._initialize_serpapi()
     
     def _initialize_serpapi(self):
@@ -58,20 +147,76 @@ class WebSearchService:
                 return {"error": "Search wrapper not initialized", "query": query}
             
 
-            result = self.search_wrapper.run(query)
-            
+            raw = self.guard.call("serpapi", "search", self._raw_results, query)
+            results = self.rank_results(query, parse_results(raw), num_results)
 
-            if result and len(str(result).strip()) > 0:
+            if results:
                 return {
                     "query": query,
-                    "results": result
+                    "results": results
                 }
             else:
                 return {"error": "No results found", "query": query}
             
+        except CircuitOpenError as e:
+            return {"error": str(e), "query": query, "circuit_open": True}
         except Exception as e:
             return {"error": str(e), "query": query}
     
+    def _raw_results(self, query: str) -> Dict[str, Any]:
+        raw = self.search_wrapper.results(query)
+        if "error" in raw:
+            raise ValueError(f"Got error from SerpAPI: {raw['error']}")
+        return raw
+
+    def rank_results(self, query: str, results: List[Dict[str, Any]], num_results: int = 5) -> List[Dict[str, Any]]:
+        unique = []
+        seen_urls = set()
+        seen_snippets = set()
+        for result in results:
+            url_key = normalize_url(result["url"]) if result.get("url") else None
+            snippet_key = normalize_snippet(result["snippet"])
+            if (url_key and url_key in seen_urls) or snippet_key in seen_snippets:
+                WEB_SEARCH_SNIPPETS_TOTAL.inc(outcome="duplicate")
+                continue
+            seen_urls.add(url_key)
+            seen_snippets.add(snippet_key)
+            unique.append(result)
+        if not unique:
+            return []
+
+        scores = self._relevance_scores(query, unique)
+        ranked = sorted(zip(scores, unique), key=lambda pair: pair[0], reverse=True)
+
+        kept = []
+        used_tokens = 0
+        for score, result in ranked:
+            if score < self.min_relevance:
+                WEB_SEARCH_SNIPPETS_TOTAL.inc(outcome="irrelevant")
+                continue
+            tokens = estimate_tokens(f"{result['title']}: {result['snippet']}")
+            # the best snippet always goes in, even when it alone is over the budget
+            if len(kept) >= num_results or (kept and used_tokens + tokens > self.snippet_token_budget):
+                WEB_SEARCH_SNIPPETS_TOTAL.inc(outcome="over_budget")
+                continue
+            used_tokens += tokens
+            kept.append({**result, "score": round(score, 4)})
+        WEB_SEARCH_SNIPPETS_TOTAL.inc(len(kept), outcome="kept")
+        return kept
+
+    def _relevance_scores(self, query: str, results: List[Dict[str, Any]]) -> List[float]:
+        texts = [f"{result['title']}. {result['snippet']}" for result in results]
+        if self.embeddings is not None:
+            try:
+                query_vector = self.embeddings.embed_query(query)
+                return [cosine_similarity(query_vector, vector) for vector in self.embeddings.embed_documents(texts)]
+            except Exception as e:
+                logger.warning(f"Embedding web search snippets failed, ranking by query terms: {e}")
+        terms = query_terms(query)
+        if not terms:
+            return [0.0] * len(texts)
+        return [sum(1 for term in terms if term in text.lower()) / len(terms) for text in texts]
+
     def should_use_web_search(self, query: str, rag_answer: str) -> bool:
         insufficient_keywords = [
             "i am not sure", "i don't know", "cannot find", "not available",
@@ -84,14 +229,37 @@ class WebSearchService:
         
         is_too_short = len(rag_answer.strip()) < 50
         
-        current_keywords = [
-            "current", "latest", "recent", "today", "now", "latest news",
-            "current price", "current market", "recent developments", "this week", "this month"
-            "search", "find", "look up", "check", "search for", "find out", "web search",
-            "web results", "web search results", "search the web", "search online", "find online", 
-            "web", "online"
-        ]
+        return has_insufficient_indicators or is_too_short or self.asks_for_current_info(query)
+
+    def asks_for_current_info(self, query: str) -> bool:
         query_lower = query.lower()
-        asks_for_current_info = any(keyword in query_lower for keyword in current_keywords)
-        
-        return has_insufficient_indicators or is_too_short or asks_for_current_info 
\ No newline at end of file
+        return any(keyword in query_lower for keyword in CURRENT_INFO_KEYWORDS)
+
+    def assess_retrieval(self, query: str, retrieved_docs: List[Document]) -> Dict[str, Any]:
+        scores = [doc.metadata["_score"] for doc in retrieved_docs if doc.metadata.get("_score") is not None]
+        terms = query_terms(query)
+        corpus_text = " ".join(doc.page_content.lower() for doc in retrieved_docs)
+        term_coverage = sum(1 for term in terms if term in corpus_text) / len(terms) if terms else 1.0
+
+        if not retrieved_docs:
+            decision = "out_of_corpus"
+        elif not scores:
+            decision = "uncertain"
+        else:
+            top_score = max(scores)
+            # one chunk standing well clear of the rest is a match even below the in-corpus score
+            stands_out = top_score - min(scores) >= self.standout_spread
+            if top_score < self.out_of_corpus_score or (top_score < self.in_corpus_score and term_coverage < self.min_term_coverage):
+                decision = "out_of_corpus"
+            elif term_coverage >= self.min_term_coverage and (top_score >= self.in_corpus_score or stands_out):
+                decision = "in_corpus"
+            else:
+                decision = "uncertain"
+
+        return {
+            "decision": decision,
+            "top_score": round(max(scores), 4) if scores else None,
+            "score_spread": round(max(scores) - min(scores), 4) if scores else None,
+            "term_coverage": round(term_coverage, 4),
+            "asks_for_current_info": self.asks_for_current_info(query),
+        }
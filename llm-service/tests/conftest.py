@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    # main.py resolves the reference document and its log file relative to the working directory
+    os.chdir(SERVICE_DIR)
+    import main
+    from tools.fakes import install_fake_services
+
+    install_fake_services(main, llm_latency=0.01, classify_latency=0.01, embed_latency=0, polygon_latency=0, serpapi_latency=0)
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_module):
+    from fastapi.testclient import TestClient
+
+    return TestClient(app_module.app)
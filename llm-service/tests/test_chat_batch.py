@@ -0,0 +1,39 @@
+import json
+
+from services.llm_scheduler import PRIORITY_BATCH
+
+
+def read_lines(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_batch_answers_every_query_with_scored_sources(client):
+    queries = [{"id": "a", "query": "What are the main risks of investing?"}, {"id": "b", "query": "How does diversification work?"}]
+    response = client.post("/chat/batch", json={"queries": queries})
+
+    assert response.status_code == 200
+    items = sorted(read_lines(response), key=lambda item: item["index"])
+    assert [item["id"] for item in items] == ["a", "b"]
+    assert all(item["status"] == 200 for item in items)
+    for item in items:
+        for source in item["sources"]:
+            assert isinstance(source["score"], float)
+            assert not any(key.startswith("_") for key in source["metadata"])
+
+
+def test_batch_generations_use_batch_priority(app_module, client, monkeypatch):
+    scheduler = app_module.llm_scheduler
+    priorities = []
+    original = scheduler.priority_for
+
+    def recording_priority(call_name):
+        priority = original(call_name)
+        priorities.append(priority)
+        return priority
+
+    monkeypatch.setattr(scheduler, "priority_for", recording_priority)
+    queries = [{"query": f"Question {i} about market risk"} for i in range(4)]
+    response = client.post("/chat/batch", json={"queries": queries, "max_parallel": 2})
+
+    assert response.status_code == 200
+    assert priorities and all(priority == PRIORITY_BATCH for priority in priorities)
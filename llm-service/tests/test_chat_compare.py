@@ -0,0 +1,45 @@
+import json
+
+
+def test_compare_answers_both_modes_over_one_retrieval(app_module, client, monkeypatch):
+    rag_service = app_module.rag_service
+    calls = []
+    original = rag_service.retrieve
+
+    def counting_retrieve(question, filters=None):
+        calls.append(question)
+        return original(question, filters)
+
+    monkeypatch.setattr(rag_service, "retrieve", counting_retrieve)
+    response = client.post("/chat/compare", json={"query": "What are the main risks of investing in stocks?"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["normal"]["answer"] and body["advanced"]["answer"]
+    assert body.get("errors") is None
+    assert set(body["timings"]) == {"retrieval_ms", "normal_ms", "advanced_ms", "total_ms"}
+    assert len(calls) == 1
+
+
+def test_compare_returns_the_other_mode_when_one_fails(app_module, client, monkeypatch):
+    def failing_answer(*args, **kwargs):
+        raise RuntimeError("advanced pipeline down")
+
+    monkeypatch.setattr(app_module.advanced_rag_service, "get_answer", failing_answer)
+    response = client.post("/chat/compare", json={"query": "How does diversification work?"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["normal"]["answer"]
+    assert body.get("advanced") is None
+    assert "advanced pipeline down" in body["errors"]["advanced"]
+
+
+def test_compare_streams_retrieval_then_each_answer(client):
+    response = client.post("/chat/compare", json={"query": "What is a dividend?", "stream": True})
+
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    assert events[0]["event"] == "retrieval"
+    assert sorted(event["mode"] for event in events[1:]) == ["advanced", "normal"]
+    assert all(event["event"] == "answer" and "response" in event for event in events[1:])
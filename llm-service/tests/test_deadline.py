@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from services.deadline import STAGE_MAX_IN_FLIGHT, deadline_scope, generation_budget, generation_cap, run_enrichment
+from services.llm_scheduler import LLMScheduler, ScheduledLLM
+
+
+class SlowStreamingLLM(LLM):
+    tokens: int = 50
+    seconds_per_token: float = 0.02
+    streamed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-streaming"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt))
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        for i in range(self.tokens):
+            time.sleep(self.seconds_per_token)
+            self.streamed += 1
+            yield GenerationChunk(text=f"t{i} ")
+
+
+def test_no_deadline_means_no_limits():
+    assert generation_cap("answer", 512) is None
+    assert generation_budget("answer") is None
+    assert run_enrichment("get_stock_data", lambda: "data") == "data"
+
+
+def test_ordinary_request_is_not_capped():
+    with deadline_scope(60, tokens_per_second=20) as deadline:
+        assert generation_cap("rag_answer") is None
+        assert generation_cap("final_answer") is None
+        assert deadline.degraded_stages() == []
+
+
+def test_cap_applies_once_a_normal_answer_no_longer_fits():
+    with deadline_scope(10, tokens_per_second=20, answer_tokens=512) as deadline:
+        cap = generation_cap("answer")
+        assert cap is not None and 64 <= cap < 512
+        assert deadline.degraded_stages()[0]["reason"] == "generation_capped"
+
+
+def test_generation_is_cut_at_its_share_of_the_deadline():
+    llm = SlowStreamingLLM()
+    scheduled = ScheduledLLM(llm, LLMScheduler())
+    with deadline_scope(0.3) as deadline:
+        started = time.perf_counter()
+        answer = scheduled.invoke("question", {"run_name": "answer"})
+        elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.5
+    assert 0 < len(answer.split()) < llm.tokens
+    assert "generation_cut" in [stage["reason"] for stage in deadline.degraded_stages()]
+
+
+def test_generation_without_deadline_runs_to_completion():
+    llm = SlowStreamingLLM(tokens=5, seconds_per_token=0)
+    assert len(ScheduledLLM(llm, LLMScheduler()).invoke("question", {"run_name": "answer"}).split()) == 5
+
+
+def test_slow_enrichment_times_out_with_default():
+    with deadline_scope(1.0, min_stage_seconds=0.05) as deadline:
+        result = run_enrichment("get_stock_data", time.sleep, 1.0, default="fallback")
+    assert result == "fallback"
+    assert deadline.degraded_stages()[0]["reason"] == "timed_out"
+
+
+def test_enrichment_is_skipped_when_its_share_is_too_small():
+    with deadline_scope(0.5, min_stage_seconds=0.5) as deadline:
+        assert run_enrichment("check_stock_needed", lambda: "ran", default="skipped") == "skipped"
+    assert deadline.degraded_stages()[0]["reason"] == "skipped"
+
+
+def test_saturated_stage_is_skipped_without_blocking_other_stages():
+    release = threading.Event()
+    with deadline_scope(0.2, min_stage_seconds=0.01) as deadline:
+        for _ in range(STAGE_MAX_IN_FLIGHT):
+            # each abandoned call keeps its thread until the event is set
+            run_enrichment("get_stock_data", release.wait, 5, default=None)
+            deadline.expires_at = time.perf_counter() + 0.2
+        started = time.perf_counter()
+        assert run_enrichment("get_stock_data", lambda: "ran", default="saturated") == "saturated"
+        assert time.perf_counter() - started < 0.1
+        assert run_enrichment("start_web_search", lambda: "web") == "web"
+    release.set()
+    assert "saturated" in [stage["reason"] for stage in deadline.degraded_stages()]
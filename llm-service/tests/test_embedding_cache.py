@@ -0,0 +1,80 @@
+import time
+
+from langchain_core.embeddings import Embeddings
+
+from services.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.queries = []
+        self.documents = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 1.0]
+
+    def embed_documents(self, texts):
+        self.documents.append(list(texts))
+        return [[float(len(text)), 0.0] for text in texts]
+
+
+def test_equivalent_queries_share_one_embedding():
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, "nomic-embed-text")
+
+    first = cache.embed_query("What is  a Stock?")
+    second = cache.embed_query("what is a stock?")
+
+    assert first == second
+    assert inner.queries == ["What is  a Stock?"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_cached_vectors_cannot_be_mutated_by_callers():
+    cache = CachedEmbeddings(CountingEmbeddings(), "model")
+    cache.embed_query("bonds").append(99.0)
+    assert cache.embed_query("bonds") == [5.0, 1.0]
+
+
+def test_least_recently_used_entry_is_evicted():
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, "model", max_entries=2)
+    for text in ("a", "b", "a", "c", "b"):
+        cache.embed_query(text)
+    assert inner.queries == ["a", "b", "c", "b"]
+
+
+def test_entries_expire_after_the_ttl():
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, "model", ttl_seconds=0.01)
+    cache.embed_query("etf")
+    time.sleep(0.02)
+    cache.embed_query("etf")
+    assert inner.queries == ["etf", "etf"]
+
+
+def test_batch_embeds_only_unique_missing_queries():
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, "model")
+    cache.embed_query("cached")
+
+    vectors = cache.embed_queries(["cached", "new", "New ", "other"])
+
+    assert inner.documents == [["new", "other"]]
+    assert vectors[1] == vectors[2]
+    assert vectors[0] == [6.0, 1.0]
+
+
+def test_documents_bypass_the_cache():
+    inner = CountingEmbeddings()
+    cache = CachedEmbeddings(inner, "model")
+    cache.embed_documents(["chunk"])
+    cache.embed_documents(["chunk"])
+    assert len(inner.documents) == 2 and cache.stats()["entries"] == 0
+
+
+def test_cache_is_keyed_by_model():
+    first = CachedEmbeddings(CountingEmbeddings(), "model-a")
+    second = CachedEmbeddings(CountingEmbeddings(), "model-b")
+    assert first._key("q") != second._key("q")
@@ -0,0 +1,62 @@
+import json
+
+from services.financial_records import PromptBlockCache, parse_financials, parse_news
+from services.session_store import estimate_tokens
+
+
+def period(end_date, fiscal_year, revenue, net_income, fiscal_period="Q2"):
+    return {
+        "end_date": end_date,
+        "fiscal_period": fiscal_period,
+        "fiscal_year": fiscal_year,
+        "company_name": "Apple Inc.",
+        "financials": {"income_statement": {"revenues": {"value": revenue}, "net_income_loss": {"value": net_income}}},
+    }
+
+
+def test_parse_financials_reads_latest_period_and_year_over_year_growth():
+    raw = json.dumps({"results": [
+        period("2023-03-31", "2023", 100e9, 20e9),
+        period("2024-03-31", "2024", 110e9, 25e9),
+        period("2023-12-31", "2024", 150e9, 40e9, fiscal_period="Q1"),
+    ]})
+
+    snapshot = parse_financials("AAPL", raw)
+
+    assert (snapshot.fiscal_period, snapshot.fiscal_year, snapshot.end_date) == ("Q2", "2024", "2024-03-31")
+    assert snapshot.metrics == {"Revenue": 110e9, "Net income": 25e9}
+    assert snapshot.revenue_growth_percent == 10.0
+    assert snapshot.net_income_growth_percent == 25.0
+
+
+def test_parse_financials_handles_empty_or_invalid_payloads():
+    assert parse_financials("AAPL", "not json") is None
+    assert parse_financials("AAPL", {"results": []}) is None
+
+
+def test_parse_news_dedupes_titles_and_keeps_ticker_sentiment():
+    raw = {"results": [
+        {"title": "Apple beats estimates", "published_utc": "2024-05-02T20:00:00Z", "publisher": {"name": "Wire"},
+         "insights": [{"ticker": "MSFT", "sentiment": "negative"}, {"ticker": "AAPL", "sentiment": "positive"}]},
+        {"title": "Apple  beats estimates!", "published_utc": "2024-05-01T20:00:00Z"},
+        {"title": "Apple launches a new iPad", "published_utc": "2024-05-03T10:00:00Z"},
+    ]}
+
+    digest = parse_news("AAPL", raw)
+
+    assert [headline.title for headline in digest.headlines] == ["Apple launches a new iPad", "Apple beats estimates"]
+    assert digest.headlines[1].sentiment == "positive"
+    assert digest.headlines[1].published == "2024-05-02"
+
+
+def test_prompt_block_stays_within_budget_and_is_reused_while_unchanged():
+    cache = PromptBlockCache(max_tokens=60)
+    price = {"date": "2024-05-03", "current_price": 183.38, "open_price": 186.65, "high_price": 187.0, "low_price": 182.66, "price_change_percent": -1.75, "volume": 163224109}
+    news = parse_news("AAPL", {"results": [{"title": f"Headline number {i} about Apple", "published_utc": f"2024-05-0{i}"} for i in range(1, 9)]})
+
+    block = cache.render("AAPL", price_data=price, news=news)
+
+    assert block.startswith("ticker: AAPL\nPrice 2024-05-03")
+    assert sum(estimate_tokens(line) for line in block.splitlines()) <= 60
+    assert cache.render("AAPL", price_data=price, news=news) is block
+    assert cache.render("AAPL", price_data={**price, "current_price": 190.0}, news=news) != block
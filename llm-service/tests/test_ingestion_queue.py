@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+from services.ingestion_queue import IngestionQueue, IngestionQueueFullError
+
+
+class RecordingVectorStore:
+    def __init__(self):
+        self.batches = []
+
+    def add_documents(self, documents):
+        self.batches.append(documents)
+        return True
+
+
+def wait_for(queue, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get_job(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.fixture
+def ingestion(tmp_path):
+    vector_store = RecordingVectorStore()
+    queue = IngestionQueue(vector_store, upload_dir=str(tmp_path), batch_size=2)
+    queue.start()
+    yield queue, vector_store
+    queue.stop()
+
+
+def test_text_upload_is_chunked_indexed_in_batches_and_removed(ingestion, tmp_path):
+    queue, vector_store = ingestion
+    text = "\f".join(["Diversification spreads risk across many holdings. " * 40] * 3)
+    job = queue.submit("notes.txt", text.encode(), title="Notes", doc_type="memo", published="2026-01-02")
+
+    finished = wait_for(queue, job.job_id)
+
+    assert finished["status"] == "completed"
+    assert finished["chunks_indexed"] == finished["chunks_total"] > 2
+    assert all(len(batch) <= 2 for batch in vector_store.batches)
+    chunk = vector_store.batches[0][0]
+    assert chunk.metadata["title"] == "Notes" and chunk.metadata["doc_type"] == "memo" and chunk.metadata["job_id"] == job.job_id
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_job_reports_error_and_removes_files(tmp_path):
+    class RejectingVectorStore(RecordingVectorStore):
+        def add_documents(self, documents):
+            return False
+
+    queue = IngestionQueue(RejectingVectorStore(), upload_dir=str(tmp_path))
+    queue.start()
+    try:
+        job = queue.submit("notes.md", b"# Title\n\nSome text about bonds.")
+        finished = wait_for(queue, job.job_id)
+    finally:
+        queue.stop()
+
+    assert finished["status"] == "failed" and "rejected" in finished["error"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_unsupported_files_are_rejected(tmp_path):
+    queue = IngestionQueue(RecordingVectorStore(), upload_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        queue.submit("slides.pptx", b"data")
+
+
+def test_submissions_beyond_the_queue_limit_are_refused(tmp_path):
+    queue = IngestionQueue(RecordingVectorStore(), upload_dir=str(tmp_path), max_queued=1)
+    queue.submit("a.txt", b"first")
+    with pytest.raises(IngestionQueueFullError):
+        queue.submit("b.txt", b"second")
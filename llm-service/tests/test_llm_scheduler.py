@@ -0,0 +1,133 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+from services.llm_scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_CLASSIFY,
+    PRIORITY_IN_PROGRESS,
+    PRIORITY_NEW,
+    LLMScheduler,
+    SchedulerOverloadedError,
+    start_batch_tracking,
+    start_request_tracking,
+    _request_llm_calls,
+)
+
+
+def in_context(func, *args):
+    return contextvars.copy_context().run(func, *args)
+
+
+def test_priority_follows_request_progress():
+    scheduler = LLMScheduler()
+
+    def classify():
+        start_request_tracking()
+        first = scheduler.priority_for("rag_answer")
+        _request_llm_calls.get()[0] += 1
+        return scheduler.priority_for("ticker_classification"), first, scheduler.priority_for("rag_answer")
+
+    assert in_context(classify) == (PRIORITY_CLASSIFY, PRIORITY_NEW, PRIORITY_IN_PROGRESS)
+
+
+def test_batch_calls_stay_below_new_requests():
+    scheduler = LLMScheduler()
+
+    def batch():
+        start_request_tracking()
+        start_batch_tracking()
+        _request_llm_calls.get()[0] += 1
+        return scheduler.priority_for("answer")
+
+    assert in_context(batch) == PRIORITY_BATCH
+    assert PRIORITY_BATCH > PRIORITY_NEW
+
+
+def run_waiting(scheduler, priority, order, name):
+    with scheduler.acquire(priority, name):
+        order.append(name)
+
+
+def test_interactive_call_runs_before_queued_batch_calls():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_depth=16)
+    order = []
+    with scheduler.acquire(PRIORITY_NEW, "holder"):
+        threads = [threading.Thread(target=run_waiting, args=(scheduler, PRIORITY_BATCH, order, f"batch-{i}")) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=run_waiting, args=(scheduler, PRIORITY_NEW, order, "interactive"))
+        interactive.start()
+        time.sleep(0.05)
+    for thread in threads + [interactive]:
+        thread.join(timeout=2)
+    assert order[0] == "interactive"
+
+
+def test_new_and_batch_calls_are_shed_when_queue_is_full():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_depth=1, max_wait_seconds=5)
+    with scheduler.acquire(PRIORITY_NEW, "holder"):
+        waiter = threading.Thread(target=lambda: run_waiting(scheduler, PRIORITY_IN_PROGRESS, [], "waiting"))
+        waiter.start()
+        time.sleep(0.05)
+        for priority in (PRIORITY_NEW, PRIORITY_BATCH):
+            with pytest.raises(SchedulerOverloadedError):
+                with scheduler.acquire(priority, "shed"):
+                    pass
+    waiter.join(timeout=2)
+
+
+def test_batch_calls_are_shed_after_max_wait():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_depth=16, max_wait_seconds=0.05)
+    with scheduler.acquire(PRIORITY_NEW, "holder"):
+        with pytest.raises(SchedulerOverloadedError):
+            with scheduler.acquire(PRIORITY_BATCH, "batch"):
+                pass
+
+
+def test_admission_is_refused_with_retry_after_when_queue_is_full():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue_depth=1)
+    with scheduler.acquire(PRIORITY_NEW, "holder"):
+        waiter = threading.Thread(target=lambda: run_waiting(scheduler, PRIORITY_IN_PROGRESS, [], "waiting"))
+        waiter.start()
+        time.sleep(0.05)
+        with pytest.raises(SchedulerOverloadedError) as overloaded:
+            scheduler.check_admission()
+        assert overloaded.value.retry_after >= 1
+    waiter.join(timeout=2)
+
+
+def test_concurrency_is_bounded():
+    scheduler = LLMScheduler(max_concurrency=2)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with scheduler.acquire(PRIORITY_NEW, "answer"):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+
+
+def test_chat_is_answered_with_429_when_overloaded(app_module, client, monkeypatch):
+    def overloaded():
+        raise SchedulerOverloadedError(3, 16)
+
+    monkeypatch.setattr(app_module.llm_scheduler, "check_admission", overloaded)
+    response = client.post("/chat/normal", json={"query": "What is a bond?"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import random
+
+import httpx
+
+from tools.load_test import load_corpus, percentile, run_level, summarize
+
+
+def test_sessions_carry_growing_chat_history(tmp_path):
+    corpus = tmp_path / "corpus.jsonl"
+    corpus.write_text("\n".join([
+        json.dumps({"session": ["First?", "Second?", "Third?"]}),
+        json.dumps({"query": "Standalone?"}),
+    ]))
+    requests = load_corpus(str(corpus))
+
+    assert requests[0] == {"query": "Standalone?", "chat_history": []}
+    assert [len(request["chat_history"]) for request in requests[1:]] == [0, 2, 4]
+    assert {request["session_id"] for request in requests[1:]} == {"loadtest-0"}
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) != percentile([], 50)
+
+
+def test_summary_separates_errors_and_queueing():
+    records = [
+        {"status": 200, "latency": 1.0, "process_time": 0.5, "finished": 2.0, "dispatch_lag": 0.0},
+        {"status": 200, "latency": 2.0, "process_time": 2.0, "finished": 4.0, "dispatch_lag": 0.0},
+        {"status": 429, "latency": 0.1, "process_time": None, "finished": 1.0, "dispatch_lag": 0.0},
+    ]
+    summary = summarize("/chat", 1.0, records)
+
+    assert summary["requests"] == 3
+    assert summary["throughput_rps"] == 0.5
+    assert round(summary["error_rate"], 3) == 0.333
+    assert summary["queue_p95"] == 0.5
+
+
+def test_open_loop_level_against_the_app(app_module):
+    async def run():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            return await run_level(client, "/chat/normal", load_corpus(None), rate=20, duration=0.5, timeout=10, rng=random.Random(1))
+
+    records = asyncio.run(run())
+    assert records and all(record["status"] == 200 for record in records)
+    assert all(record["process_time"] is not None for record in records)
@@ -0,0 +1,70 @@
+import pytest
+
+from services.metrics import EXTERNAL_CALL_LATENCY, STAGE_LATENCY, Counter, Gauge, Histogram, MetricsRegistry, request_mode, timed_stage, track_external_call
+
+
+def test_counter_renders_labelled_values():
+    registry = MetricsRegistry()
+    counter = Counter("test_requests_total", "Requests.", ["endpoint"], registry=registry)
+    counter.inc(endpoint="/chat")
+    counter.inc(2, endpoint="/chat")
+
+    assert counter.get(endpoint="/chat") == 3
+    assert 'test_requests_total{endpoint="/chat"} 3' in registry.render()
+    with pytest.raises(ValueError):
+        counter.inc(-1, endpoint="/chat")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+
+    rendered = registry.render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'test_latency_seconds_bucket{le="1"} 2' in rendered
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in rendered
+    assert "test_latency_seconds_count 3" in rendered
+
+
+def test_gauge_tracks_in_progress_work():
+    gauge = Gauge("test_in_flight", "In flight.", registry=MetricsRegistry())
+    with gauge.track_inprogress():
+        assert gauge.get() == 1
+    assert gauge.get() == 0
+
+
+def test_duplicate_metric_names_are_rejected():
+    registry = MetricsRegistry()
+    Counter("test_duplicate_total", "First.", registry=registry)
+    with pytest.raises(ValueError):
+        Counter("test_duplicate_total", "Second.", registry=registry)
+
+
+def test_timed_stage_records_under_the_request_mode():
+    @timed_stage("unit_test_stage")
+    def stage():
+        return "done"
+
+    token = request_mode.set("normal")
+    try:
+        before = STAGE_LATENCY.snapshot(stage="unit_test_stage", mode="normal")["count"]
+        assert stage() == "done"
+        assert STAGE_LATENCY.snapshot(stage="unit_test_stage", mode="normal")["count"] == before + 1
+    finally:
+        request_mode.reset(token)
+
+
+def test_external_call_outcome_is_recorded():
+    with pytest.raises(RuntimeError):
+        with track_external_call("unit_test", "fails"):
+            raise RuntimeError("boom")
+    assert EXTERNAL_CALL_LATENCY.snapshot(service="unit_test", endpoint="fails", outcome="error")["count"] == 1
+
+
+def test_metrics_endpoint_reports_chat_requests(client):
+    assert client.post("/chat/normal", json={"query": "What is a bond?"}).status_code == 200
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'llm_service_requests_total{endpoint="/chat/normal",mode="normal",status="200"}' in response.text
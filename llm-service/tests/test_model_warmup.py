@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from services.model_warmup import ModelWarmer
+
+
+class FakeOllamaClient:
+    def __init__(self):
+        self.loaded = set()
+        self.calls = []
+
+    def generate(self, model, prompt, keep_alive, options=None):
+        self.calls.append(("generate", model))
+        self.loaded.add(model)
+        return SimpleNamespace(load_duration=0)
+
+    def embed(self, model, input, keep_alive):
+        self.calls.append(("embed", model))
+        self.loaded.add(model)
+        return SimpleNamespace(load_duration=0)
+
+    def ps(self):
+        expires = datetime.now(timezone.utc) + timedelta(minutes=30)
+        return SimpleNamespace(models=[SimpleNamespace(model=f"{name}:latest", name=name, expires_at=expires, size_vram=1) for name in self.loaded])
+
+
+def make_warmer(**kwargs):
+    warmer = ModelWarmer("llama3.2", "nomic-embed-text", **kwargs)
+    warmer.client = FakeOllamaClient()
+    return warmer
+
+
+def test_not_ready_before_models_are_loaded():
+    assert make_warmer().readiness()["ready"] is False
+
+
+def test_ready_after_warm_up():
+    warmer = make_warmer()
+    assert warmer.warm_up()
+    readiness = warmer.readiness()
+    assert readiness["ready"] is True
+    assert all(info["resident"] for info in readiness["models"].values())
+
+
+def test_not_ready_when_a_warmed_model_was_unloaded():
+    warmer = make_warmer()
+    warmer.warm_up()
+    warmer.client.loaded.discard("llama3.2")
+    assert warmer.readiness()["ready"] is False
+
+
+def test_background_load_makes_service_ready_without_warm_up():
+    warmer = make_warmer(interval_seconds=60)
+    warmer.start(load_now=True)
+    try:
+        for _ in range(100):
+            if warmer.readiness()["ready"]:
+                break
+            time.sleep(0.01)
+        assert warmer.readiness()["ready"] is True
+        assert ("generate", "llama3.2") in warmer.client.calls
+    finally:
+        warmer.stop()
+
+
+def test_in_process_embeddings_only_need_the_llm():
+    warmer = ModelWarmer("llama3.2", None)
+    warmer.client = FakeOllamaClient()
+    warmer.warm_up()
+    assert set(warmer.readiness()["models"]) == {"llama3.2"}
+    assert warmer.readiness()["ready"] is True
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from services import onnx_embeddings
+from services.onnx_embeddings import MicroBatcher, OnnxEmbeddings
+
+
+def test_concurrent_queries_share_one_encode_call():
+    calls = []
+    release = threading.Event()
+
+    def encode(texts):
+        release.wait(1)
+        calls.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = MicroBatcher(encode, max_batch_size=8, max_wait_seconds=0.2)
+    futures = [batcher.submit(text) for text in ["a", "bb", "ccc"]]
+    release.set()
+
+    assert [future.result(timeout=2) for future in futures] == [[1.0], [2.0], [3.0]]
+    assert calls == [["a", "bb", "ccc"]]
+
+
+def test_batch_size_is_capped_and_errors_reach_every_caller():
+    def encode(texts):
+        if "bad" in texts:
+            raise ValueError("encode failed")
+        return [[0.0] for _ in texts]
+
+    batcher = MicroBatcher(encode, max_batch_size=2, max_wait_seconds=0.05)
+    futures = [batcher.submit(text) for text in ["bad", "x", "y"]]
+
+    for future in futures[:2]:
+        with pytest.raises(ValueError):
+            future.result(timeout=2)
+    assert futures[2].result(timeout=2) == [0.0]
+
+
+def test_documents_are_encoded_in_length_sorted_batches_and_returned_in_order():
+    batches = []
+    embeddings = OnnxEmbeddings.__new__(OnnxEmbeddings)
+    embeddings.max_batch_size = 2
+
+    def encode(texts):
+        batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    embeddings._encode = encode
+
+    assert embeddings.embed_documents(["cccc", "a", "bbb", "dd"]) == [[4.0], [1.0], [3.0], [2.0]]
+    assert batches == [["a", "dd"], ["bbb", "cccc"]]
+
+
+@pytest.mark.skipif(onnx_embeddings.onnxruntime is not None, reason="onnxruntime is installed")
+def test_missing_runtime_raises_an_actionable_import_error():
+    with pytest.raises(ImportError, match="onnxruntime"):
+        OnnxEmbeddings(model_dir="unused")
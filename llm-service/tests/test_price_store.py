@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from services.price_store import PriceStore
+
+DAY_MS = 86_400_000
+
+
+def bars(start_ms, closes):
+    return [{"t": start_ms + i * DAY_MS, "o": c, "h": c, "l": c, "c": c, "v": 1000} for i, c in enumerate(closes)]
+
+
+def test_new_ticker_needs_the_full_lookback(tmp_path):
+    store = PriceStore(str(tmp_path), lookback_days=30)
+    now = datetime(2026, 1, 31)
+    assert store.missing_range("aapl", now) == ((now - timedelta(days=30)).strftime("%Y-%m-%d"), "2026-01-31")
+
+
+def test_merge_keeps_newest_copy_of_each_day_in_order(tmp_path):
+    store = PriceStore(str(tmp_path))
+    start = 1_700_000_000_000
+    store.merge("AAPL", bars(start, [10, 11, 12]))
+    series = store.merge("AAPL", bars(start + 2 * DAY_MS, [13, 14]))
+
+    assert list(series.c) == [10, 11, 13, 14]
+    assert list(series.t) == sorted(series.t)
+    assert store.latest_bars("AAPL", 2)["results"][-1]["c"] == 14.0
+
+
+def test_merge_persists_between_stores(tmp_path):
+    PriceStore(str(tmp_path)).merge("MSFT", bars(1_700_000_000_000, [1, 2, 3]))
+    assert len(PriceStore(str(tmp_path)).get_series("msft")) == 3
+
+
+def test_refresh_window_skips_fetch_after_a_successful_merge(tmp_path):
+    store = PriceStore(str(tmp_path), refresh_seconds=900)
+    store.merge("AAPL", bars(1_700_000_000_000, [10, 11]))
+    assert store.missing_range("AAPL") is None
+
+
+def test_failed_fetch_does_not_block_retries(tmp_path):
+    store = PriceStore(str(tmp_path), refresh_seconds=900)
+    store.merge("AAPL", bars(1_700_000_000_000, [10, 11]))
+    store.get_series("AAPL").fetched_at = 0.0
+
+    store.merge("AAPL", [])
+
+    assert store.missing_range("AAPL") is not None
+    assert len(store.get_series("AAPL")) == 2
+
+
+def test_analytics_reports_returns_and_moving_averages(tmp_path):
+    store = PriceStore(str(tmp_path))
+    store.merge("AAPL", bars(1_700_000_000_000, [100 + i for i in range(30)]))
+    analytics = store.analytics("AAPL")
+
+    assert analytics["history_days"] == 30
+    assert analytics["returns_percent"]["1d"] == round((129 / 128 - 1) * 100, 2)
+    assert analytics["moving_averages"]["sma_20"] == sum(range(110, 130)) / 20
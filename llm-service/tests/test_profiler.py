@@ -0,0 +1,67 @@
+import asyncio
+import json
+import os
+
+from services.profiler import RequestProfiler
+
+
+def busy_work():
+    return sum(i * i for i in range(200_000))
+
+
+def test_profile_writes_folded_stacks_allocations_and_summary(tmp_path):
+    profiler = RequestProfiler(enabled=True, interval_seconds=0.001, directory=str(tmp_path))
+    profile = profiler.begin("/chat", "advanced", "What is a stock?")
+    assert profiler.run(profile, busy_work) > 0
+    profiler.finish(profile)
+
+    summary = json.loads((tmp_path / f"{profile.profile_id}.json").read_text())
+    assert summary["samples"] > 0 and summary["error"] is None
+    assert "busy_work" in (tmp_path / f"{profile.profile_id}.folded").read_text()
+    assert os.path.exists(tmp_path / f"{profile.profile_id}.alloc.txt")
+
+
+def test_failed_call_is_recorded_on_the_profile(tmp_path):
+    profiler = RequestProfiler(enabled=True, directory=str(tmp_path), trace_memory=False)
+    profile = profiler.begin("/chat", "advanced", "q")
+    try:
+        profiler.run(profile, lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    profiler.finish(profile)
+    assert profiler.get_summary(profile.profile_id)["error"] == "division by zero"
+
+
+def test_retention_keeps_the_newest_profiles(tmp_path):
+    profiler = RequestProfiler(enabled=True, directory=str(tmp_path), max_profiles=2, trace_memory=False)
+    ids = []
+    for _ in range(3):
+        profile = profiler.begin("/chat", "advanced", "q")
+        profiler.finish(profile)
+        ids.append(profile.profile_id)
+    assert {item["profile_id"] for item in profiler.list_profiles()} == set(ids[1:])
+
+
+def test_chat_profiling_runs_snapshots_and_saves_off_the_event_loop(app_module, client, monkeypatch, tmp_path):
+    profiler = RequestProfiler(enabled=True, directory=str(tmp_path))
+    on_loop = []
+
+    def off_loop(method):
+        def wrapper(*args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(method.__name__)
+            except RuntimeError:
+                pass
+            return method(*args)
+        return wrapper
+
+    monkeypatch.setattr(profiler, "begin", off_loop(profiler.begin))
+    monkeypatch.setattr(profiler, "finish", off_loop(profiler.finish))
+    monkeypatch.setattr(app_module, "request_profiler", profiler)
+
+    response = client.post("/chat/normal", json={"query": "What are the risks of investing?"}, headers={"X-Profile": "1"})
+
+    assert response.status_code == 200
+    assert profiler.get_summary(response.headers["X-Profile-Id"]) is not None
+    assert on_loop == []
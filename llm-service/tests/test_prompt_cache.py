@@ -0,0 +1,63 @@
+from services.prompt_cache import EVICTED, HIT, NEW, PromptPrefixCache, expect_prefix, prefix_scope, record_prefix
+from services.session_store import estimate_tokens
+
+SYSTEM = "You are a helpful assistant. " * 20
+HISTORY = "User: What is a stock?\nAssistant: A share of a company.\n" * 10
+
+
+def turn(cache, history, question, evaluated=None):
+    prompt = f"{SYSTEM}\n{history}\nQuestion: {question}"
+    with prefix_scope(cache, "s"):
+        expect_prefix("rag_answer", prompt, history)
+        evaluated = estimate_tokens(prompt) if evaluated is None else evaluated
+        return record_prefix("rag_answer", {"prompt_eval_count": evaluated})
+
+
+def test_first_turn_is_new_and_an_unchanged_prefix_is_a_hit():
+    cache = PromptPrefixCache()
+
+    assert turn(cache, HISTORY, "What is a bond?")["prefix_cache"] == NEW
+    result = turn(cache, HISTORY + "User: What is a bond?\nAssistant: A loan.\n", "And a fund?", evaluated=20)
+
+    assert result["prefix_cache"] == HIT
+    assert result["reused_prefix_tokens"] == estimate_tokens(f"{SYSTEM}\n{HISTORY}")
+    assert cache.describe("s")["rag_answer"]["hits"] == 1
+
+
+def test_reevaluating_the_whole_prompt_means_the_prefix_was_evicted():
+    cache = PromptPrefixCache()
+    turn(cache, HISTORY, "What is a bond?")
+
+    assert turn(cache, HISTORY, "And a fund?")["prefix_cache"] == EVICTED
+
+
+def test_a_rewritten_history_starts_a_new_prefix():
+    cache = PromptPrefixCache()
+    turn(cache, HISTORY, "What is a bond?")
+
+    assert turn(cache, "Summary of earlier conversation:\n- User: stocks\n", "And a fund?", evaluated=5)["prefix_cache"] == NEW
+
+
+def test_calls_outside_a_session_are_not_tracked():
+    with prefix_scope(PromptPrefixCache(), None) as scope:
+        expect_prefix("rag_answer", f"{SYSTEM}{HISTORY}", HISTORY)
+        assert scope is None
+        assert record_prefix("rag_answer", {"prompt_eval_count": 10}) is None
+
+
+def test_forget_drops_a_sessions_prefixes():
+    cache = PromptPrefixCache()
+    turn(cache, HISTORY, "What is a bond?")
+    cache.forget("s")
+
+    assert cache.describe("s") == {}
+
+
+def test_session_endpoint_reports_prefix_reuse(client):
+    for question in ("What is a stock?", "And what is a bond?", "And a mutual fund?"):
+        assert client.post("/chat/normal", json={"query": question, "session_id": "prefix-reuse"}).status_code == 200
+
+    stats = client.get("/sessions/prefix-reuse").json()["prompt_cache"]["answer"]
+
+    assert stats["new_prefixes"] >= 1
+    assert stats["hits"] >= 1
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from services.rate_limiter import RateLimitedClient, RateLimitExceededError, TokenBucket
+from services.resilience import DependencyGuard
+
+
+def test_bucket_allows_its_burst_then_rejects_waits_over_budget():
+    bucket = TokenBucket("test", rate_per_second=1.0, capacity=2)
+
+    assert bucket.acquire(0, 0.1, "test") < 0.05
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    with pytest.raises(RateLimitExceededError):
+        bucket.acquire(0, 0.1, "test")
+
+
+def test_queued_callers_are_served_by_priority():
+    bucket = TokenBucket("test", rate_per_second=10.0, capacity=1)
+    bucket.acquire(0, 1.0, "drain")
+    order = []
+
+    def waiter(priority, name):
+        bucket.acquire(priority, 2.0, name)
+        order.append(name)
+
+    low = threading.Thread(target=waiter, args=(2, "financials"))
+    low.start()
+    time.sleep(0.02)
+    high = threading.Thread(target=waiter, args=(0, "aggregates"))
+    high.start()
+    low.join()
+    high.join()
+
+    assert order == ["aggregates", "financials"]
+
+
+def test_identical_in_flight_calls_are_merged():
+    client = RateLimitedClient(DependencyGuard())
+    release = threading.Event()
+    calls = []
+
+    def fetch(params):
+        calls.append(params)
+        release.wait(1)
+        return {"ticker": params["ticker"]}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.call("aggregates", fetch, {"ticker": "AAPL"}))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"ticker": "AAPL"}] * 3
+
+
+def test_over_budget_calls_fall_back_to_the_cache_or_raise():
+    client = RateLimitedClient(DependencyGuard(), requests_per_minute=1, max_wait_seconds=0.05)
+    fetch = lambda params: {"ticker": params["ticker"], "fetched_at": time.monotonic()}
+
+    first = client.call("aggregates", fetch, {"ticker": "AAPL"})
+
+    assert client.call("aggregates", fetch, {"ticker": "AAPL"}) == first
+    with pytest.raises(RateLimitExceededError):
+        client.call("aggregates", fetch, {"ticker": "MSFT"})
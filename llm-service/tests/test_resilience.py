@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from services.resilience import CLOSED, HALF_OPEN, OPEN, CircuitOpenError, DependencyGuard
+
+
+def fail():
+    raise RuntimeError("provider down")
+
+
+def open_breaker(guard, service="polygon", endpoint="news"):
+    for _ in range(guard.min_calls):
+        with pytest.raises(RuntimeError):
+            guard.call(service, endpoint, fail)
+    return guard.breaker(service, endpoint)
+
+
+def test_breaker_opens_on_failure_rate_and_rejects_fast():
+    guard = DependencyGuard(min_calls=3, failure_rate=0.5, open_seconds=30)
+    breaker = open_breaker(guard)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        guard.call("polygon", "news", lambda: "never called")
+
+
+def test_usable_errors_do_not_count_as_failures():
+    guard = DependencyGuard(min_calls=2)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            guard.call("polygon", "aggregates", lambda: (_ for _ in ()).throw(ValueError("DELAYED")), is_failure=lambda e: False)
+    assert guard.breaker("polygon", "aggregates").state == CLOSED
+
+
+def test_successful_probe_closes_and_failed_probe_reopens():
+    guard = DependencyGuard(min_calls=2, open_seconds=0.01)
+    breaker = open_breaker(guard)
+    time.sleep(0.02)
+    with pytest.raises(RuntimeError):
+        guard.call("polygon", "news", fail)
+    assert breaker.state == OPEN
+    time.sleep(0.02)
+    assert guard.call("polygon", "news", lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_only_one_probe_runs_while_half_open():
+    guard = DependencyGuard(min_calls=2, open_seconds=0.01)
+    breaker = open_breaker(guard)
+    time.sleep(0.02)
+    release = threading.Event()
+    probe = threading.Thread(target=guard.call, args=("polygon", "news", release.wait, 2))
+    probe.start()
+    time.sleep(0.05)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        guard.call("polygon", "news", lambda: "second probe")
+    release.set()
+    probe.join()
+    assert breaker.state == CLOSED
+
+
+def test_interrupted_probe_releases_its_slot():
+    guard = DependencyGuard(min_calls=2, open_seconds=0.01)
+    breaker = open_breaker(guard)
+    time.sleep(0.02)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        guard.call("polygon", "news", interrupted)
+    assert breaker.state == HALF_OPEN
+    assert guard.call("polygon", "news", lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_slow_hedged_call_is_won_by_the_hedge():
+    guard = DependencyGuard(hedged_services=["serpapi"], hedge_min_delay_seconds=0.01)
+    for _ in range(20):
+        guard.call("serpapi", "search", lambda: "fast")
+    calls = []
+
+    def first_slow():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "hedge"
+
+    started = time.perf_counter()
+    assert guard.call("serpapi", "search", first_slow) == "hedge"
+    assert time.perf_counter() - started < 0.4
+
+
+def test_hedge_is_skipped_when_the_budget_refuses_it():
+    guard = DependencyGuard(hedged_services=["polygon"], hedge_min_delay_seconds=0.01)
+    for _ in range(20):
+        guard.call("polygon", "news", lambda: "fast")
+    calls = []
+
+    def slow():
+        calls.append(None)
+        time.sleep(0.1)
+        return "primary"
+
+    assert guard.call("polygon", "news", slow, allow_hedge=lambda: False) == "primary"
+    assert len(calls) == 1
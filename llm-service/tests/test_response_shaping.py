@@ -0,0 +1,60 @@
+import datetime
+import json
+
+from services.response_shaping import COMPACT, json_response, render_json, shape_response
+
+
+def chat_response(app_module):
+    return app_module.ChatResponse(
+        answer="Stocks are ownership [Page 1].",
+        sources=[{"id": 1, "content": "Stocks...", "metadata": {"source": "basics.pdf"}, "page": 1}],
+        timestamp="2024-05-03T10:00:00",
+        document_loaded=True,
+        stock_data={"AAPL": {"current_price": 183.38, "news": [{"title": "Apple beats"}], "financials": {}, "prompt_block": "ticker: AAPL"}},
+        web_search_results={"results": [{"title": "Web"}]},
+    )
+
+
+def test_compact_drops_raw_payloads_and_none_fields(app_module):
+    shaped = shape_response(chat_response(app_module), COMPACT)
+
+    assert "metadata" not in shaped["sources"][0]
+    assert shaped["stock_data"] == {"AAPL": {"current_price": 183.38}}
+    assert "web_search_results" not in shaped
+    assert "session_id" not in shaped
+
+
+def test_full_profile_keeps_everything(app_module):
+    shaped = shape_response(chat_response(app_module))
+
+    assert shaped["sources"][0]["metadata"] == {"source": "basics.pdf"}
+    assert shaped["web_search_results"] == {"results": [{"title": "Web"}]}
+    assert shaped["session_id"] is None
+
+
+def test_fields_select_top_level_keys_and_always_keep_the_answer(app_module):
+    shaped = shape_response(chat_response(app_module), fields=["sources"])
+
+    assert set(shaped) == {"answer", "sources"}
+
+
+def test_render_json_serializes_non_json_metadata():
+    body = render_json({"date": datetime.date(2024, 5, 3), 1: "one"}, "/test")
+
+    assert json.loads(body) == {"date": "2024-05-03", "1": "one"}
+
+
+def test_json_response_shapes_models(app_module):
+    response = json_response(chat_response(app_module), "/test", COMPACT, ["answer"])
+
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {"answer": "Stocks are ownership [Page 1]."}
+
+
+def test_chat_endpoint_honours_profile_and_rejects_unknown_fields(client):
+    compact = client.post("/chat/normal", json={"query": "What is a stock?", "response_profile": "compact", "fields": ["sources"]})
+    assert compact.status_code == 200
+    assert set(compact.json()) == {"answer", "sources"}
+    assert all("metadata" not in source for source in compact.json()["sources"])
+
+    assert client.post("/chat/normal", json={"query": "What is a stock?", "fields": ["nope"]}).status_code == 400
@@ -0,0 +1,51 @@
+import math
+
+import pytest
+from qdrant_client import QdrantClient
+
+from tools.fakes import FakeEmbeddings
+from tools.retrieval_eval import _parse_chunks, build_index, build_labeled_set, evaluate, percentile
+
+PAGES = [
+    ("1", "Common stocks represent partial ownership of a public company and give shareholders voting rights at annual meetings. Dividends are usually paid every quarter."),
+    ("2", "Bonds are loans made to governments or corporations that pay a fixed rate of interest until the bond matures. Dividends are usually paid every quarter."),
+    ("3", "Mutual funds pool money from many investors to buy a diversified portfolio of stocks bonds and other securities managed by professionals."),
+]
+
+
+def test_percentile_uses_nearest_rank():
+    assert percentile([5, 1, 3, 2, 4], 50) == 3
+    assert percentile([5, 1, 3, 2, 4], 95) == 5
+    assert math.isnan(percentile([], 50))
+
+
+def test_parse_chunks_defaults_overlap_to_a_fifth():
+    assert _parse_chunks("400:80, 800") == [(400, 80), (800, 160)]
+
+
+def test_labeled_set_is_seeded_and_labels_every_page_with_the_passage():
+    pages = [(page, text + " Investors should always compare the annual fees charged by different brokers.") for page, text in PAGES]
+
+    labeled = build_labeled_set(pages, per_page=5, seed=7)
+
+    assert labeled == build_labeled_set(pages, per_page=5, seed=7)
+    shared = [item for item in labeled if item["passage"].startswith("Investors should always compare")]
+    assert shared and all(item["pages"] == ["1", "2", "3"] for item in shared)
+    assert all(len(item["question"].split()) >= 3 for item in labeled)
+
+
+def test_evaluate_scores_recall_and_mrr_against_a_built_index():
+    client = QdrantClient(":memory:")
+    backend = FakeEmbeddings(latency_seconds=0, dimensions=64)
+    stats = build_index(client, "eval", PAGES, chunk_size=400, chunk_overlap=0, backend=backend, profile="default")
+    assert stats["chunks"] == 3 and stats["dimensions"] == 64
+
+    labeled = [
+        {"question": "bonds loans governments corporations fixed interest", "pages": ["2"]},
+        {"question": "zzzz qqqq", "pages": ["9"]},
+    ]
+    result = evaluate(client, "eval", labeled, backend.embed_documents([item["question"] for item in labeled]), k=1, profile="default")
+
+    assert result["recall"] == pytest.approx(0.5)
+    assert result["mrr"] == pytest.approx(0.5)
+    assert result["search_p95_ms"] >= result["search_p50_ms"] >= 0
@@ -0,0 +1,88 @@
+import time
+
+from services.session_store import NO_HISTORY, SessionStore
+
+
+def turn(index):
+    return [{"role": "user", "content": f"Question {index}"}, {"role": "assistant", "content": f"Answer {index}"}]
+
+
+def test_sync_history_appends_only_new_messages():
+    store = SessionStore()
+    store.sync_history("s", turn(1))
+    session = store.sync_history("s", turn(1) + turn(2))
+
+    assert session.messages == turn(1) + turn(2)
+    assert session.render_context() == "User: Question 1\nAssistant: Answer 1\nUser: Question 2\nAssistant: Answer 2\n"
+
+
+def test_diverging_history_replaces_the_session():
+    store = SessionStore()
+    store.sync_history("s", turn(1))
+    session = store.sync_history("s", turn(7))
+
+    assert session.messages == turn(7)
+
+
+def test_append_turn_records_question_and_answer():
+    store = SessionStore()
+    assert store.get_or_create("s").render_context() == NO_HISTORY
+
+    session = store.append_turn("s", "What is a bond?", "A loan to an issuer.")
+
+    assert session.messages == [{"role": "user", "content": "What is a bond?"}, {"role": "assistant", "content": "A loan to an issuer."}]
+
+
+def test_compaction_folds_old_turns_into_a_summary_below_the_budget():
+    store = SessionStore(max_history_tokens=40, compact_to_ratio=0.5)
+    for index in range(10):
+        session = store.append_turn("s", f"Question number {index} about markets", f"Answer number {index} about markets")
+
+    assert session.token_count <= 40
+    assert len(session.messages) >= 2
+    assert session.summary.startswith("- ")
+    assert session.render_context().startswith("Summary of earlier conversation:")
+
+
+def test_full_history_resent_after_compaction_only_adds_the_new_turn():
+    store = SessionStore(max_history_tokens=30)
+    history = []
+    for index in range(6):
+        history += turn(index)
+        session = store.sync_history("s", list(history))
+    assert session.summary
+
+    session = store.sync_history("s", history + turn(6))
+
+    assert session.summary
+    assert session.messages[-2:] == turn(6)
+    assert len({message["content"] for message in session.messages}) == len(session.messages)
+
+
+def test_evict_idle_drops_unused_sessions():
+    store = SessionStore(idle_ttl_seconds=60)
+    store.append_turn("old", "q", "a")
+    store.append_turn("fresh", "q", "a")
+    store.get("old").updated_at = time.time() - 120
+
+    assert store.evict_idle() == 1
+    assert store.get("old") is None
+    assert store.get("fresh") is not None
+
+
+def test_sessions_persist_to_sqlite(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    SessionStore(persist_path=path).append_turn("s", "What is a bond?", "A loan to an issuer.")
+
+    session = SessionStore(persist_path=path).get("s")
+
+    assert session is not None and len(session.messages) == 2
+
+
+def test_empty_chat_history_keeps_the_server_side_session(client):
+    first = client.post("/chat", json={"query": "What is a dividend?", "session_id": "keep-me"})
+    assert first.status_code == 200
+    second = client.post("/chat", json={"query": "And a bond?", "session_id": "keep-me", "chat_history": []})
+    assert second.status_code == 200
+
+    assert client.get("/sessions/keep-me").json()["messages"] == 4
@@ -0,0 +1,32 @@
+import threading
+
+from langchain_core.documents import Document
+
+
+class SignallingRetriever:
+    def __init__(self, started: threading.Event):
+        self.started = started
+
+    def invoke(self, question, filters=None):
+        self.started.set()
+        return [Document(page_content="Apple shares pay a dividend", metadata={"page": 1, "_score": 0.9})]
+
+
+def test_ticker_detection_runs_alongside_retrieval(app_module, monkeypatch):
+    service = app_module.advanced_rag_service
+    retrieval_started = threading.Event()
+    seen = {}
+
+    def classify(query):
+        # only returns promptly when retrieval has started while the classification is still running
+        seen["overlapped"] = retrieval_started.wait(2)
+        return True, ["AAPL"]
+
+    monkeypatch.setattr(service, "retriever", SignallingRetriever(retrieval_started))
+    monkeypatch.setattr(service.stock_service, "should_use_stock_api", classify)
+
+    result = service.get_answer("How is AAPL doing?")
+
+    assert seen["overlapped"] is True
+    assert result["stock_tickers"] == ["AAPL"]
+    assert "AAPL" in result["stock_data"]
@@ -0,0 +1,44 @@
+from services.metrics import LLM_PROMPT_OVERSIZE_TOTAL, LLM_TOKENS_TOTAL
+from services.token_usage import check_prompt_size, record_generation, usage_scope
+
+GENERATION_INFO = {"prompt_eval_count": 120, "eval_count": 30, "load_duration": 0, "prompt_eval_duration": 200_000_000, "eval_duration": 800_000_000}
+
+
+def test_generations_are_summed_per_request():
+    before = LLM_TOKENS_TOTAL.get(call="test_call", kind="prompt")
+    with usage_scope() as usage:
+        record_generation("test_call", GENERATION_INFO)
+        record_generation("test_call", GENERATION_INFO, extra={"cached_prefix": True})
+        record_generation("test_call", None)
+
+    summary = usage.summary()
+    assert summary["llm_calls"] == 2
+    assert (summary["prompt_tokens"], summary["completion_tokens"], summary["total_tokens"]) == (240, 60, 300)
+    assert (summary["prompt_eval_seconds"], summary["eval_seconds"]) == (0.4, 1.6)
+    assert summary["calls"][1]["cached_prefix"] is True
+    assert LLM_TOKENS_TOTAL.get(call="test_call", kind="prompt") - before == 240
+
+
+def test_generations_outside_a_scope_only_reach_the_metrics():
+    before = LLM_TOKENS_TOTAL.get(call="unscoped_call", kind="completion")
+    record_generation("unscoped_call", GENERATION_INFO)
+
+    assert LLM_TOKENS_TOTAL.get(call="unscoped_call", kind="completion") - before == 30
+
+
+def test_oversized_prompt_parts_are_flagged():
+    before = LLM_PROMPT_OVERSIZE_TOTAL.get(prompt="chat_context")
+    with usage_scope() as usage:
+        assert check_prompt_size("chat_context", "x" * 400, {"chat_context": 50}) == 100
+        check_prompt_size("chat_context", "x" * 40, {"chat_context": 50})
+
+    assert usage.summary()["oversized_prompts"] == [{"prompt": "chat_context", "estimated_tokens": 100, "limit": 50}]
+    assert LLM_PROMPT_OVERSIZE_TOTAL.get(prompt="chat_context") - before == 1
+
+
+def test_chat_returns_usage_when_asked(client):
+    body = client.post("/chat/normal", json={"query": "What is a stock?", "include_usage": True}).json()
+
+    assert body["usage"]["llm_calls"] >= 1
+    assert body["usage"]["prompt_tokens"] > 0
+    assert client.post("/chat/normal", json={"query": "What is a stock?"}).json().get("usage") is None
@@ -0,0 +1,61 @@
+import pytest
+from langchain_core.documents import Document
+
+from services.document_processor import public_metadata
+from services.vector_store import VectorStoreService, build_filter
+from tools.fakes import FakeEmbeddings
+
+DOCUMENTS = [
+    Document(page_content="Stocks represent ownership in a company and pay dividends", metadata={"source": "basics.pdf", "doc_type": "guide", "date": "2020-01-15", "page": 1}),
+    Document(page_content="Apple reported quarterly revenue and dividends growth", metadata={"source": "aapl-10q.pdf", "doc_type": "filing", "date": "2024-05-02", "page": 1}),
+    Document(page_content="Market commentary on dividends and interest rates", metadata={"source": "notes.txt", "doc_type": "note", "date": "2023-07-01", "page": 1}),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    service = VectorStoreService(FakeEmbeddings(latency_seconds=0), db_path=str(tmp_path))
+    assert service.add_documents(DOCUMENTS)
+    yield service
+    service.close()
+
+
+def sources(documents):
+    return sorted(doc.metadata["source"] for doc in documents)
+
+
+def test_build_filter_maps_each_field_to_a_condition():
+    assert build_filter(None) is None
+    assert build_filter({}) is None
+
+    qdrant_filter = build_filter({"sources": ["a.pdf"], "doc_types": ["guide"], "date_from": "2024-01-01"})
+
+    assert [condition.key for condition in qdrant_filter.must] == ["metadata.source", "metadata.doc_type", "metadata.date"]
+
+
+def test_retrieval_is_restricted_by_source_type_and_date(store):
+    retriever = store.get_retriever(k=3)
+
+    assert sources(retriever.invoke("dividends")) == ["aapl-10q.pdf", "basics.pdf", "notes.txt"]
+    assert sources(retriever.invoke("dividends", filters={"sources": ["notes.txt"]})) == ["notes.txt"]
+    assert sources(retriever.invoke("dividends", filters={"doc_types": ["guide", "filing"]})) == ["aapl-10q.pdf", "basics.pdf"]
+    assert sources(retriever.invoke("dividends", filters={"date_from": "2023-01-01", "date_to": "2023-12-31"})) == ["notes.txt"]
+
+
+def test_batch_search_applies_the_same_filters(store):
+    results = store.similarity_search_batch(["dividends", "revenue"], k=3, filters={"doc_types": ["filing"]})
+
+    assert [sources(documents) for documents in results] == [["aapl-10q.pdf"], ["aapl-10q.pdf"]]
+
+
+def test_reingesting_only_refreshes_changed_metadata(store):
+    updated = [Document(page_content=DOCUMENTS[0].page_content, metadata={**DOCUMENTS[0].metadata, "doc_type": "primer"})]
+
+    assert store.add_documents(updated)
+
+    assert store.client.count(store.collection_name).count == 3
+    assert sources(store.get_retriever(k=3).invoke("dividends", filters={"doc_types": ["primer"]})) == ["basics.pdf"]
+
+
+def test_public_metadata_hides_retrieval_fields():
+    assert public_metadata({"source": "a.pdf", "_score": 0.9, "_id": "x", "_collection_name": "c"}) == {"source": "a.pdf"}
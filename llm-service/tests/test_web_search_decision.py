@@ -0,0 +1,57 @@
+from langchain_core.documents import Document
+
+from services.web_search_service import WebSearchService
+
+
+def chunk(text, score):
+    return Document(page_content=text, metadata={"page": 1, "_score": score})
+
+
+def test_strong_covered_match_is_in_corpus():
+    service = WebSearchService()
+    docs = [chunk("Diversification spreads risk across many stocks", 0.8), chunk("Bonds pay interest", 0.7)]
+
+    assert service.assess_retrieval("How does diversification reduce risk?", docs)["decision"] == "in_corpus"
+
+
+def test_weak_uncovered_match_is_out_of_corpus():
+    service = WebSearchService()
+    docs = [chunk("Bonds pay interest to holders", 0.4), chunk("Stocks are shares of a company", 0.38)]
+
+    signals = service.assess_retrieval("Who won the football championship?", docs)
+
+    assert signals["decision"] == "out_of_corpus"
+    assert signals["top_score"] == 0.4
+
+
+def test_standout_chunk_counts_as_a_match_below_the_in_corpus_score():
+    service = WebSearchService()
+    docs = [chunk("Dividends are paid from company earnings", 0.58), chunk("Unrelated text", 0.4)]
+
+    assert service.assess_retrieval("How are dividends paid?", docs)["decision"] == "in_corpus"
+
+
+def test_missing_scores_and_current_info_are_reported():
+    service = WebSearchService()
+    signals = service.assess_retrieval("What is the latest dividend news?", [Document(page_content="Dividends", metadata={})])
+
+    assert signals["decision"] == "uncertain"
+    assert signals["asks_for_current_info"] is True
+    assert service.assess_retrieval("anything", [])["decision"] == "out_of_corpus"
+
+
+def test_out_of_corpus_question_skips_the_document_answer(app_module):
+    docs = [chunk("Bonds pay interest to holders", 0.1)]
+
+    result = app_module.advanced_rag_service.get_answer("Who won the football championship?", retrieved_docs=docs)
+
+    assert result["services_used"]["rag_used"] is False
+
+
+def test_follow_up_keeps_the_document_answer_when_out_of_corpus(app_module):
+    docs = [chunk("Bonds pay interest to holders", 0.1)]
+    history = [{"role": "user", "content": "What is a bond?"}, {"role": "assistant", "content": "A loan to an issuer."}]
+
+    result = app_module.advanced_rag_service.get_answer("And who won the football championship?", chat_history=history, retrieved_docs=docs)
+
+    assert result["services_used"]["rag_used"] is True
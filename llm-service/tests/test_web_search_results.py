@@ -0,0 +1,69 @@
+from services.web_search_service import WebSearchService, normalize_url, parse_results, web_source
+from tools.fakes import FakeEmbeddings
+
+
+def result(title, snippet, url=None):
+    return {"title": title, "snippet": snippet, "url": url, "date": None}
+
+
+def test_parse_results_reads_answer_box_organic_and_news():
+    raw = {
+        "answer_box": {"title": "Apple stock", "answer": "183.38 USD", "link": "https://google.com/finance"},
+        "organic_results": [{"title": "Apple Inc.", "snippet": "Apple designs iPhones.", "link": "https://apple.com"}, {"title": "No snippet"}],
+        "top_stories": [{"title": "Apple beats estimates", "source": "Wire", "link": "https://wire.com/a", "date": "2 hours ago"}],
+    }
+
+    results = parse_results(raw)
+
+    assert [item["snippet"] for item in results] == ["183.38 USD", "Apple designs iPhones.", "Apple beats estimates"]
+    assert results[2]["title"] == "Wire" and results[2]["date"] == "2 hours ago"
+
+
+def test_normalize_url_ignores_scheme_www_case_and_trailing_slash():
+    assert normalize_url("https://www.Example.com/News/") == normalize_url("http://example.com/news")
+
+
+def test_rank_results_dedupes_and_keeps_the_most_relevant_first():
+    service = WebSearchService()
+    results = [
+        result("Weather", "Sunny with light wind today", "https://weather.com"),
+        result("Apple dividend", "Apple raises its quarterly dividend", "https://www.news.com/apple/"),
+        result("Apple dividend again", "Different text", "https://news.com/apple"),
+        result("Copy", "Apple raises its quarterly DIVIDEND!", "https://other.com"),
+    ]
+
+    ranked = service.rank_results("Apple quarterly dividend", results)
+
+    assert [item["title"] for item in ranked] == ["Apple dividend", "Weather"]
+    assert ranked[0]["score"] == 1.0
+
+
+def test_rank_results_drops_irrelevant_snippets_and_respects_the_token_budget():
+    service = WebSearchService(snippet_token_budget=20, min_relevance=0.5)
+    results = [
+        result("Apple dividend", "Apple raises its quarterly dividend " + "detail " * 10),
+        result("Apple dividend history", "Apple dividend history " + "detail " * 10),
+        result("Weather", "Sunny with light wind today"),
+    ]
+
+    ranked = service.rank_results("Apple dividend", results)
+
+    assert [item["title"] for item in ranked] == ["Apple dividend"]
+
+
+def test_embeddings_rank_snippets_by_similarity():
+    service = WebSearchService(embeddings=FakeEmbeddings(latency_seconds=0))
+    results = [result("Weather", "Sunny with light wind today"), result("Dividend", "Apple raises its quarterly dividend")]
+
+    ranked = service.rank_results("Apple quarterly dividend", results)
+
+    assert ranked[0]["title"] == "Dividend"
+    assert ranked[0]["score"] > ranked[1]["score"]
+
+
+def test_web_source_cites_the_site_and_date():
+    source = web_source(3, {"title": "Apple beats", "snippet": "Apple beat estimates", "url": "https://wire.com/a", "date": "May 2, 2024", "score": 0.8})
+
+    assert source["citation_text"] == "[3] Apple beats (wire.com), May 2, 2024"
+    assert source["metadata"] == {"source_type": "web", "site": "wire.com", "date": "May 2, 2024"}
+    assert source["score"] == 0.8
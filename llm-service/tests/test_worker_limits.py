@@ -0,0 +1,27 @@
+import json
+import os
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPORT = "import json, main; print(json.dumps({'llm': main.llm_scheduler.max_concurrency, 'queue': main.llm_scheduler.max_queue_depth, 'polygon_burst': main.polygon_limiter.bucket.capacity}))"
+
+
+def limits(tmp_path, **env):
+    environment = {key: value for key, value in os.environ.items() if key not in ("LLM_SERVICE_WORKERS", "WEB_CONCURRENCY")}
+    environment.update({"PYTHONPATH": SERVICE_DIR, "LLM_MAX_CONCURRENCY": "4", "LLM_MAX_QUEUE_DEPTH": "16", "POLYGON_REQUESTS_PER_MINUTE": "5", **env})
+    output = subprocess.run([sys.executable, "-c", REPORT], cwd=tmp_path, env=environment, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_single_worker_gets_the_full_limits(tmp_path):
+    assert limits(tmp_path) == {"llm": 4, "queue": 16, "polygon_burst": 5}
+
+
+def test_limits_are_split_by_web_concurrency(tmp_path):
+    assert limits(tmp_path, WEB_CONCURRENCY="2") == {"llm": 2, "queue": 8, "polygon_burst": 3}
+
+
+def test_llm_service_workers_takes_precedence(tmp_path):
+    assert limits(tmp_path, WEB_CONCURRENCY="4", LLM_SERVICE_WORKERS="2") == {"llm": 2, "queue": 8, "polygon_burst": 3}
@@ -0,0 +1,188 @@
+"""
+embedding_benchmark.py
+
+What is this file for: Compares embedding backends on query latency and throughput, and checks that a candidate's vectors are compatible with the index built by the baseline.
+
+What the flow of the functions are: build_backend() creates each requested embeddings backend, benchmark_backend() times sequential queries, a concurrent burst and a document batch, compatibility() checks the candidate's vectors against the baseline's, and main() prints the results.
+
+How this service is used: Run from the llm-service directory before setting EMBEDDINGS_BACKEND=onnx, e.g. `python -m tools.embedding_benchmark --backends ollama,onnx --concurrency 8`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = [
+    "What is a stock?",
+    "How do dividends work?",
+    "What is the difference between growth and value stocks?",
+    "What is a P/E ratio?",
+    "How does diversification reduce risk?",
+    "What does market capitalization mean?",
+    "How do I read a stock quote?",
+    "What are the risks of investing in individual stocks?",
+    "Should I reinvest my dividends?",
+    "What is a stock split?",
+    "How are preferred shares different from common shares?",
+    "What is dollar-cost averaging?",
+]
+
+
+def load_texts(chunks_path: str, pdf_path: str, max_chunks: int) -> List[str]:
+    from services.document_processor import DocumentProcessor
+    processor = DocumentProcessor(chunk_size=800, chunk_overlap=150)
+    if os.path.exists(chunks_path):
+        chunks = processor.load_from_txt(chunks_path)
+    else:
+        chunks = processor.process_pdf(pdf_path, txt_path=os.devnull)
+    return [chunk.page_content for chunk in chunks[:max_chunks]]
+
+
+def build_backend(name: str, args: argparse.Namespace):
+    if name == "ollama":
+        from langchain_ollama import OllamaEmbeddings
+        return OllamaEmbeddings(model=args.ollama_model, base_url=args.ollama_url)
+    if name == "onnx":
+        from services.onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(model_dir=args.onnx_model_dir, max_length=args.max_length, threads=args.threads)
+    if name == "fake":
+        from tools.fakes import FakeEmbeddings
+        return FakeEmbeddings(latency_seconds=args.fake_latency)
+    raise ValueError(f"Unknown backend '{name}', expected ollama, onnx or fake")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))]
+
+
+def _timed_query(backend, text: str) -> Tuple[float, List[float]]:
+    started = time.perf_counter()
+    vector = backend.embed_query(text)
+    return time.perf_counter() - started, vector
+
+
+def benchmark_backend(backend, queries: List[str], documents: List[str], rounds: int, concurrency: int) -> Dict[str, Any]:
+    backend.embed_query("warm up")
+
+    sequential = [_timed_query(backend, query)[0] for _ in range(rounds) for query in queries]
+
+    burst = [query for _ in range(rounds) for query in queries]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        concurrent = [elapsed for elapsed, _ in executor.map(lambda text: _timed_query(backend, text), burst)]
+    burst_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    backend.embed_documents(documents)
+    documents_seconds = time.perf_counter() - started
+
+    return {
+        "query_p50_ms": round(percentile(sequential, 50) * 1000, 2),
+        "query_p95_ms": round(percentile(sequential, 95) * 1000, 2),
+        "query_mean_ms": round(sum(sequential) / len(sequential) * 1000, 2),
+        "concurrent_p50_ms": round(percentile(concurrent, 50) * 1000, 2),
+        "concurrent_p95_ms": round(percentile(concurrent, 95) * 1000, 2),
+        "queries_per_second": round(len(burst) / burst_seconds, 1),
+        "documents_per_second": round(len(documents) / documents_seconds, 1) if documents_seconds > 0 else None,
+    }
+
+
+def _unit(vectors: List[List[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float64)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def compatibility(baseline, candidate, queries: List[str], documents: List[str], k: int) -> Dict[str, Any]:
+    baseline_docs = _unit(baseline.embed_documents(documents))
+    candidate_docs = _unit(candidate.embed_documents(documents))
+    baseline_queries = _unit([baseline.embed_query(query) for query in queries])
+    candidate_queries = _unit([candidate.embed_query(query) for query in queries])
+    if baseline_docs.shape[1] != candidate_docs.shape[1]:
+        return {"compatible_dimensions": False, "baseline_dimensions": baseline_docs.shape[1], "candidate_dimensions": candidate_docs.shape[1]}
+
+    cosines = np.concatenate([(baseline_docs * candidate_docs).sum(axis=1), (baseline_queries * candidate_queries).sum(axis=1)])
+
+    # the existing index keeps the baseline's document vectors, so candidate queries must find the same chunks
+    k = min(k, len(documents))
+    expected = np.argsort(-(baseline_queries @ baseline_docs.T), axis=1)[:, :k]
+    found = np.argsort(-(candidate_queries @ baseline_docs.T), axis=1)[:, :k]
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(expected.tolist(), found.tolist())]
+
+    return {
+        "compatible_dimensions": True,
+        "dimensions": int(baseline_docs.shape[1]),
+        "cosine_mean": round(float(cosines.mean()), 4),
+        "cosine_min": round(float(cosines.min()), 4),
+        f"top{k}_overlap_mean": round(float(np.mean(overlap)), 4),
+        f"top{k}_overlap_min": round(float(np.min(overlap)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and cross-check embedding backends for the LLM service")
+    parser.add_argument("--backends", default="ollama,onnx", help="comma-separated backends (ollama, onnx, fake); the first is the baseline")
+    parser.add_argument("--chunks", default="reference_doc_chunks.txt")
+    parser.add_argument("--pdf", default="reference_doc.pdf")
+    parser.add_argument("--max-chunks", type=int, default=128)
+    parser.add_argument("--rounds", type=int, default=3, help="times each query is embedded in the latency and throughput runs")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--min-overlap", type=float, default=0.75)
+    parser.add_argument("--ollama-model", default=os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text"))
+    parser.add_argument("--ollama-url", default=os.getenv("OLLAMA_BASE_URL"))
+    parser.add_argument("--onnx-model-dir", default=os.getenv("ONNX_EMBEDDING_MODEL_DIR"))
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--fake-latency", type=float, default=0.03)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    documents = load_texts(args.chunks, args.pdf, args.max_chunks)
+    names = [name.strip() for name in args.backends.split(",") if name.strip()]
+    backends = {name: build_backend(name, args) for name in names}
+
+    results = {"backends": {}, "compatibility": {}}
+    print(f"{'backend':<8} {'q p50 ms':>9} {'q p95 ms':>9} {'conc p95':>9} {'q/s':>8} {'docs/s':>8}")
+    for name, backend in backends.items():
+        row = benchmark_backend(backend, DEFAULT_QUERIES, documents, args.rounds, args.concurrency)
+        results["backends"][name] = row
+        print(f"{name:<8} {row['query_p50_ms']:>9} {row['query_p95_ms']:>9} {row['concurrent_p95_ms']:>9} {row['queries_per_second']:>8} {row['documents_per_second']:>8}")
+
+    compatible = True
+    baseline_name = names[0]
+    for name in names[1:]:
+        check = compatibility(backends[baseline_name], backends[name], DEFAULT_QUERIES, documents, args.k)
+        passed = check["compatible_dimensions"] and check["cosine_min"] >= args.min_cosine and check[f"top{min(args.k, len(documents))}_overlap_mean"] >= args.min_overlap
+        check["passed"] = passed
+        compatible = compatible and passed
+        results["compatibility"][f"{name}_vs_{baseline_name}"] = check
+        print(f"{name} vs {baseline_name}: {json.dumps(check)}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if not compatible:
+        print("Candidate vectors are not compatible with the baseline index; re-index before switching backends")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
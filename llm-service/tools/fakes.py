@@ -0,0 +1,249 @@
+"""
+fakes.py
+
+What is this file for: Latency-injecting local stand-ins for Ollama, Polygon and SerpAPI so the LLM service can be load tested without its external dependencies.
+
+What the flow of the functions are: FakeOllamaLLM, FakeEmbeddings, FakePolygonTool and FakeSearchWrapper sleep for a configured latency and return deterministic, provider-shaped responses, and install_fake_services() builds every service on top of them and installs them into main.py.
+
+How this service is used: Called by tools/load_test.py when --fakes is passed, so the service's own scaling limits can be measured in isolation from model and provider latency.
+"""
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, LLMResult
+from pydantic import PrivateAttr
+from typing import Any, List, Optional
+from datetime import datetime, timedelta
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyProfile:
+    def __init__(self, mean_seconds: float, jitter: float = 0.2):
+        self.mean_seconds = mean_seconds
+        self.jitter = jitter
+
+    def sample(self) -> float:
+        if self.mean_seconds <= 0:
+            return 0.0
+        low = self.mean_seconds * (1 - self.jitter)
+        high = self.mean_seconds * (1 + self.jitter)
+        return random.uniform(low, high)
+
+    def sleep(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeOllamaLLM(LLM):
+    latency_seconds: float = 0.8
+    classify_latency_seconds: float = 0.2
+    jitter: float = 0.2
+    num_predict: Optional[int] = None
+    num_parallel: int = 4
+    _slots: List[str] = PrivateAttr(default_factory=list)
+    _slots_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ollama"
+
+    def _cached_prefix(self, prompt: str) -> int:
+        # like Ollama's runner with several parallel slots: continue the slot sharing the longest prefix, or copy
+        # that prefix into the oldest slot when continuing would overwrite the rest of what the slot has cached
+        with self._slots_lock:
+            best, best_length = None, 0
+            for index, cached in enumerate(self._slots):
+                length = len(os.path.commonprefix([cached, prompt]))
+                if length > best_length:
+                    best, best_length = index, length
+            if best is not None and best_length == len(self._slots[best]):
+                self._slots.pop(best)
+            elif len(self._slots) >= self.num_parallel:
+                self._slots.pop(0)
+            self._slots.append(prompt)
+            return best_length
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if "YES:TICKER1" in prompt:
+            LatencyProfile(self.classify_latency_seconds, self.jitter).sleep()
+            query = prompt.rsplit("Query:", 1)[-1]
+            tickers = [t for t in re.findall(r"\b[A-Z]{2,5}\b", query) if t not in {"I", "A", "THE", "AND", "ETF"}]
+            return f"YES:{','.join(tickers[:3])}" if tickers else "NO"
+
+        LatencyProfile(self.latency_seconds, self.jitter).sleep()
+        pages = re.findall(r"=== PAGE (\w+) ===", prompt)[:2] or ["1"]
+        citations = " ".join(f"[Page {page}]" for page in pages)
+        answer = (
+            "Stocks represent ownership in a company and their value moves with earnings, "
+            f"interest rates and investor sentiment {citations}. Diversifying across sectors "
+            "and holding for the long term reduces the impact of short-term volatility."
+        )
+        if self.num_predict:
+            answer = " ".join(answer.split()[:self.num_predict])
+        return answer
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            started = time.perf_counter()
+            cached = self._cached_prefix(prompt)
+            text = self._call(prompt, stop, run_manager, **kwargs)
+            elapsed_ns = int((time.perf_counter() - started) * 1e9)
+            # the same metadata fields Ollama sends with its final response, split roughly like a warm model's
+            generations.append([Generation(text=text, generation_info={
+                "prompt_eval_count": max(1, (len(prompt) - cached) // 4),
+                "eval_count": max(1, len(text) // 4),
+                "load_duration": 0,
+                "prompt_eval_duration": elapsed_ns // 5,
+                "eval_duration": elapsed_ns - elapsed_ns // 5,
+            })])
+        return LLMResult(generations=generations)
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, latency_seconds: float = 0.03, dimensions: int = 768, jitter: float = 0.2):
+        self.latency = LatencyProfile(latency_seconds, jitter)
+        self.dimensions = dimensions
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"[a-z0-9]{3,}", text.lower()):
+            digest = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "big")
+            vector[digest % self.dimensions] += 1.0 if digest & (1 << 63) else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.latency.sleep()
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.latency.sleep()
+        return self._vector(text)
+
+
+class FakePolygonTool:
+    def __init__(self, mode: str, latency_seconds: float = 0.3, jitter: float = 0.2, failure_rate: float = 0.0):
+        self.mode = mode
+        self.latency = LatencyProfile(latency_seconds, jitter)
+        self.failure_rate = failure_rate
+
+    def invoke(self, params: dict):
+        self.latency.sleep()
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"Fake Polygon {self.mode} outage")
+        ticker = params.get("ticker") or params.get("query", "")
+        if self.mode == "get_aggregates":
+            end = datetime.strptime(params["to_date"], "%Y-%m-%d")
+            day = datetime.strptime(params["from_date"], "%Y-%m-%d")
+            base = 50 + int.from_bytes(hashlib.sha256(ticker.encode("utf-8")).digest()[:2], "big") % 200
+            bars = []
+            while day <= end:
+                if day.weekday() < 5:
+                    # a pure function of ticker and day so stored history stays consistent across incremental fetches
+                    price = base * (1 + 0.08 * math.sin(day.toordinal() / 11.0) + 0.03 * math.sin(day.toordinal() / 3.7))
+                    bars.append({
+                        "t": int(day.timestamp() * 1000),
+                        "o": round(price * 0.995, 2), "h": round(price * 1.01, 2), "l": round(price * 0.99, 2), "c": round(price, 2), "v": 1_000_000,
+                    })
+                day += timedelta(days=1)
+            return json.dumps(bars)
+        if self.mode == "get_ticker_news":
+            now = datetime.now()
+            return json.dumps([
+                {"title": f"{ticker} shares move after earnings", "published_utc": now.isoformat(), "publisher": {"name": "Fake Wire"},
+                 "insights": [{"ticker": ticker, "sentiment": "positive"}]},
+                {"title": f"{ticker} Shares Move After Earnings", "published_utc": (now - timedelta(hours=1)).isoformat(), "publisher": {"name": "Echo News"}},
+                {"title": f"Analysts revisit {ticker} guidance", "published_utc": (now - timedelta(days=1)).isoformat(), "publisher": {"name": "Fake Wire"}},
+            ])
+        periods = []
+        for year, scale in ((2024, 1.0), (2023, 0.9)):
+            periods.append({
+                "fiscal_period": "Q2", "fiscal_year": str(year), "end_date": f"{year}-06-30", "company_name": f"{ticker} Inc.",
+                "financials": {
+                    "income_statement": {"revenues": {"value": 85e9 * scale}, "net_income_loss": {"value": 21e9 * scale}, "diluted_earnings_per_share": {"value": 1.4 * scale}},
+                    "balance_sheet": {"assets": {"value": 331e9 * scale}, "equity": {"value": 66e9 * scale}},
+                },
+            })
+        return json.dumps(periods)
+
+
+class FakeSearchWrapper:
+    def __init__(self, latency_seconds: float = 0.6, jitter: float = 0.2, failure_rate: float = 0.0):
+        self.latency = LatencyProfile(latency_seconds, jitter)
+        self.failure_rate = failure_rate
+
+    def run(self, query: str) -> str:
+        self.latency.sleep()
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Fake SerpAPI outage")
+        return f"Recent coverage of '{query}' highlights market volatility and analyst expectations for the next quarter."
+
+    def results(self, query: str) -> dict:
+        self.latency.sleep()
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Fake SerpAPI outage")
+        slug = re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-")
+        # a syndicated copy of the first result and an off-topic result, like real result pages have
+        return {
+            "organic_results": [
+                {"position": 1, "title": "Markets Daily", "link": f"https://www.example-markets.com/{slug}/", "date": "1 day ago", "snippet": f"Recent coverage of {query} highlights market volatility and analyst expectations for the next quarter."},
+                {"position": 2, "title": "Markets Daily (mirror)", "link": f"https://example-markets.com/{slug}", "snippet": f"Recent coverage of {query} highlights market volatility and analyst expectations for the next quarter."},
+                {"position": 3, "title": "Investor Weekly", "link": f"https://investor-weekly.example.com/{slug}", "date": "3 days ago", "snippet": f"Analysts discussing {query} point to earnings guidance, interest rates and sector rotation as the drivers to watch."},
+                {"position": 4, "title": "Garden Tips", "link": "https://gardening.example.org/tomatoes", "snippet": "Water tomato plants deeply twice a week and mulch to keep the soil moist through summer."},
+            ],
+            "top_stories": [
+                {"title": f"{query.rstrip('?')}: what traders are watching", "link": f"https://news.example.com/{slug}", "source": "Example News", "date": "5 hours ago"},
+            ],
+        }
+
+
+def install_fake_services(main_module, llm_latency: float = 0.8, classify_latency: float = 0.2, embed_latency: float = 0.03, polygon_latency: float = 0.3, serpapi_latency: float = 0.6, db_path: Optional[str] = None) -> bool:
+    from services.vector_store import VectorStoreService
+    from services.rag_service import RAGService
+    from services.advanced_rag_service import AdvancedRAGService
+    from services.stock_service import StockService
+    from services.price_store import PriceStore
+    from services.web_search_service import WebSearchService
+    from services.llm_scheduler import ScheduledLLM
+
+    llm = ScheduledLLM(FakeOllamaLLM(latency_seconds=llm_latency, classify_latency_seconds=classify_latency), main_module.llm_scheduler)
+    embeddings = FakeEmbeddings(latency_seconds=embed_latency)
+    db_path = db_path or tempfile.mkdtemp(prefix="investra-loadtest-")
+
+    main_module.embeddings = embeddings
+    main_module.llm = llm
+    main_module.vector_store_service = VectorStoreService(embeddings, db_path=db_path)
+    if not main_module.load_default_document():
+        logger.warning("Reference document not loaded, retrieval will return no context")
+
+    stock_service = StockService(llm=llm, price_store=PriceStore(tempfile.mkdtemp(prefix="investra-prices-")), guard=main_module.dependency_guard)
+    stock_service.api_wrapper = stock_service.api_wrapper or object()
+    stock_service.aggregates_tool = FakePolygonTool("get_aggregates", polygon_latency)
+    stock_service.news_tool = FakePolygonTool("get_ticker_news", polygon_latency)
+    stock_service.financials_tool = FakePolygonTool("get_financials", polygon_latency)
+
+    # hashed bag-of-words similarities sit far below real embedding scores
+    web_search_service = WebSearchService(in_corpus_score=0.28, out_of_corpus_score=0.15, guard=main_module.dependency_guard, embeddings=main_module.vector_store_service.embeddings, min_relevance=0.2)
+    web_search_service.search_wrapper = FakeSearchWrapper(serpapi_latency)
+
+    retriever = main_module.vector_store_service.get_retriever(k=4)
+    main_module.stock_service = stock_service
+    main_module.web_search_service = web_search_service
+    main_module.rag_service = RAGService(llm, retriever)
+    main_module.advanced_rag_service = AdvancedRAGService(llm, retriever, stock_service, web_search_service)
+    main_module.ingestion_queue = main_module.create_ingestion_queue(main_module.vector_store_service, upload_dir=tempfile.mkdtemp(prefix="investra-uploads-"))
+    logger.info(f"Installed fake services (llm={llm_latency}s, embed={embed_latency}s, polygon={polygon_latency}s, serpapi={serpapi_latency}s)")
+    return True
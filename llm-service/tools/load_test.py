@@ -0,0 +1,216 @@
+"""
+load_test.py
+
+What is this file for: Open-loop load generator that produces latency-versus-arrival-rate curves for the /chat and /chat/normal endpoints.
+
+What the flow of the functions are: load_corpus() builds requests with realistic chat histories, run_level() fires them at Poisson arrival times, summarize() computes throughput, latency percentiles and error rate, and main() sweeps the requested rates.
+
+How this service is used: Run from the llm-service directory before deploying, e.g. `python -m tools.load_test --fakes --rates 1,2,4,8 --duration 30`, to find where the service stops scaling.
+"""
+
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSIONS = [
+    ["What is a stock?", "How do dividends work?", "Should I reinvest them?"],
+    ["What's the price of AAPL?", "How does that compare to MSFT?"],
+    ["What is the difference between growth and value stocks?", "Which is riskier?", "How should a beginner split between them?"],
+    ["How are TSLA and NVDA performing?", "What is the latest news on NVDA?"],
+    ["What is a P/E ratio?", "What is a good P/E for a tech company?"],
+    ["What are the risks of investing in individual stocks?", "How does diversification help?"],
+    ["What happened in the market today?"],
+    ["How do I read a stock quote?", "What does volume mean?", "What is market capitalization?"],
+]
+
+ASSISTANT_REPLY = (
+    "Stocks represent partial ownership in a company [Page 3]. Their prices move with company earnings, "
+    "interest rates and investor sentiment, so diversifying across sectors and holding for the long term "
+    "helps reduce the impact of short-term volatility [Page 5]."
+)
+
+
+def load_corpus(path: Optional[str]) -> List[Dict[str, Any]]:
+    sessions = DEFAULT_SESSIONS
+    explicit = []
+    if path:
+        sessions = []
+        with open(path, "r", encoding="utf-8") as corpus_file:
+            for line in corpus_file:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if "session" in item:
+                    sessions.append(item["session"])
+                else:
+                    explicit.append({"query": item["query"], "chat_history": item.get("chat_history", [])})
+
+    requests = list(explicit)
+    for session_index, questions in enumerate(sessions):
+        history = []
+        for question in questions:
+            requests.append({
+                "query": question,
+                "chat_history": list(history),
+                "session_id": f"loadtest-{session_index}",
+            })
+            history.append({"role": "user", "content": question})
+            history.append({"role": "assistant", "content": ASSISTANT_REPLY})
+    return requests
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _send(client: httpx.AsyncClient, endpoint: str, payload: Dict[str, Any], scheduled_at: float, started: float, timeout: float) -> Dict[str, Any]:
+    sent_at = time.perf_counter()
+    record = {"scheduled": scheduled_at - started, "dispatch_lag": sent_at - scheduled_at}
+    try:
+        response = await client.post(endpoint, json=payload, timeout=timeout)
+        finished = time.perf_counter()
+        record["status"] = response.status_code
+        process_time = response.headers.get("X-Process-Time")
+        record["process_time"] = float(process_time) if process_time else None
+    except Exception as e:
+        finished = time.perf_counter()
+        record["status"] = 0
+        record["error"] = type(e).__name__
+        record["process_time"] = None
+    record["latency"] = finished - scheduled_at
+    record["finished"] = finished - started
+    return record
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, corpus: List[Dict[str, Any]], rate: float, duration: float, timeout: float, rng: random.Random) -> List[Dict[str, Any]]:
+    arrivals = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t > duration:
+            break
+        arrivals.append(t)
+
+    started = time.perf_counter()
+    tasks = []
+    for offset in arrivals:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        payload = rng.choice(corpus)
+        tasks.append(asyncio.create_task(_send(client, endpoint, payload, started + offset, started, timeout)))
+    return list(await asyncio.gather(*tasks))
+
+
+def summarize(endpoint: str, rate: float, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [r for r in records if 200 <= r["status"] < 300]
+    latencies = [r["latency"] for r in ok]
+    queueing = [max(0.0, r["latency"] - r["process_time"]) for r in ok if r.get("process_time") is not None]
+    span = max((r["finished"] for r in records), default=0.0)
+    return {
+        "endpoint": endpoint,
+        "offered_rps": rate,
+        "requests": len(records),
+        "throughput_rps": len(ok) / span if span > 0 else 0.0,
+        "error_rate": (len(records) - len(ok)) / len(records) if records else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "queue_p50": percentile(queueing, 50),
+        "queue_p95": percentile(queueing, 95),
+        "dispatch_lag_p95": percentile([r["dispatch_lag"] for r in records], 95),
+    }
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    header = f"{'endpoint':<14}{'offered':>9}{'reqs':>6}{'tput':>8}{'err%':>7}{'p50':>8}{'p95':>8}{'p99':>8}{'q_p50':>8}{'q_p95':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['endpoint']:<14}{row['offered_rps']:>9.2f}{row['requests']:>6}{row['throughput_rps']:>8.2f}"
+            f"{row['error_rate'] * 100:>7.1f}{row['p50']:>8.2f}{row['p95']:>8.2f}{row['p99']:>8.2f}"
+            f"{row['queue_p50']:>8.2f}{row['queue_p95']:>8.2f}"
+        )
+
+
+def _build_client(args) -> httpx.AsyncClient:
+    if args.target != "inproc":
+        return httpx.AsyncClient(base_url=args.target)
+
+    import main
+    if args.fakes:
+        from tools.fakes import install_fake_services
+        install_fake_services(
+            main,
+            llm_latency=args.llm_latency,
+            classify_latency=args.classify_latency,
+            embed_latency=args.embed_latency,
+            polygon_latency=args.polygon_latency,
+            serpapi_latency=args.serpapi_latency,
+        )
+    elif not main.initialize_services():
+        logger.error("Failed to initialize some services")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest")
+
+
+async def _run(args) -> List[Dict[str, Any]]:
+    corpus = load_corpus(args.corpus)
+    rng = random.Random(args.seed)
+    rows = []
+    async with _build_client(args) as client:
+        for endpoint in args.endpoints.split(","):
+            for rate in [float(r) for r in args.rates.split(",")]:
+                logger.info(f"Running {endpoint} at {rate} req/s for {args.duration}s")
+                records = await run_level(client, endpoint, corpus, rate, args.duration, args.timeout, rng)
+                rows.append(summarize(endpoint, rate, records))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test for the LLM service chat endpoints")
+    parser.add_argument("--target", default="inproc", help="'inproc' to drive the FastAPI app in-process, or a base URL such as http://localhost:8000")
+    parser.add_argument("--endpoints", default="/chat,/chat/normal")
+    parser.add_argument("--rates", default="0.5,1,2,4", help="comma-separated arrival rates in requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of arrivals per rate level")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--corpus", help="JSONL file of {\"session\": [...]} or {\"query\": ..., \"chat_history\": [...]} lines")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fakes", action="store_true", help="replace Ollama, Polygon and SerpAPI with latency-injecting fakes (in-process only)")
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--classify-latency", type=float, default=0.2)
+    parser.add_argument("--embed-latency", type=float, default=0.03)
+    parser.add_argument("--polygon-latency", type=float, default=0.3)
+    parser.add_argument("--serpapi-latency", type=float, default=0.6)
+    parser.add_argument("--json", dest="json_path", help="also write the result rows to this file")
+    args = parser.parse_args()
+
+    if args.fakes and args.target != "inproc":
+        parser.error("--fakes only applies to --target inproc")
+
+    rows = asyncio.run(_run(args))
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(rows, output, indent=2)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,144 @@
+"""
+response_benchmark.py
+
+What is this file for: Measures chat response sizes and serialization times on the default FastAPI path against the orjson path in the full and compact profiles.
+
+What the flow of the functions are: collect_responses() asks /chat for full responses to a set of questions, benchmark() times the default FastAPI serialization against the orjson path for each profile, and main() prints payload sizes and serialization times.
+
+How this service is used: Run from the llm-service directory, e.g. `python -m tools.response_benchmark --fakes --rounds 500`.
+"""
+
+from typing import Any, Callable, Dict, List
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = [
+    "What's the price of AAPL and the latest news on it?",
+    "How are TSLA and NVDA performing?",
+    "What happened in the market today?",
+    "What is a stock?",
+    "How do dividends work?",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))]
+
+
+def _build_client(args) -> httpx.AsyncClient:
+    if args.target != "inproc":
+        return httpx.AsyncClient(base_url=args.target)
+
+    import main
+    if args.fakes:
+        from tools.fakes import install_fake_services
+        install_fake_services(main, llm_latency=0.01, classify_latency=0.01, embed_latency=0.0, polygon_latency=0.0, serpapi_latency=0.0)
+    elif not main.initialize_services():
+        logger.error("Failed to initialize some services")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark")
+
+
+async def collect_responses(args, queries: List[str]) -> List[Dict[str, Any]]:
+    responses = []
+    async with _build_client(args) as client:
+        for query in queries:
+            reply = await client.post("/chat", json={"query": query, "chat_history": [], "response_profile": "full"}, timeout=args.timeout)
+            if reply.status_code != 200:
+                logger.warning(f"Skipping '{query}': HTTP {reply.status_code} {reply.text[:200]}")
+                continue
+            responses.append(reply.json())
+    return responses
+
+
+def default_serialize(adapter, response) -> bytes:
+    # what FastAPI does for a route with response_model=ChatResponse before this change
+    content = adapter.validate_python(response.model_dump(by_alias=True))
+    return json.dumps(adapter.dump_python(content, mode="json"), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def shaped_serialize(profile: str) -> Callable:
+    from services.response_shaping import render_json, shape_response
+    return lambda adapter, response: render_json(shape_response(response, profile), "benchmark", profile)
+
+
+def benchmark(responses: List[Any], serialize: Callable, adapter, rounds: int) -> Dict[str, Any]:
+    timings = []
+    sizes = [len(serialize(adapter, response)) for response in responses]
+    for _ in range(rounds):
+        for response in responses:
+            started = time.perf_counter()
+            serialize(adapter, response)
+            timings.append(time.perf_counter() - started)
+    return {
+        "bytes_mean": round(sum(sizes) / len(sizes)),
+        "bytes_max": max(sizes),
+        "p50_us": round(percentile(timings, 50) * 1e6, 1),
+        "p95_us": round(percentile(timings, 95) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chat response payload size and serialization time per response profile")
+    parser.add_argument("--target", default="inproc", help="'inproc' to drive the FastAPI app in-process, or a base URL such as http://localhost:8000")
+    parser.add_argument("--fakes", action="store_true", help="answer the sample questions with the local fakes (in-process only)")
+    parser.add_argument("--queries", help="file with one question per line, defaults to a mix of stock, web search and document questions")
+    parser.add_argument("--rounds", type=int, default=200, help="times each collected response is serialized per path")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.fakes and args.target != "inproc":
+        parser.error("--fakes only applies to --target inproc")
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from pydantic import TypeAdapter
+    from main import ChatResponse
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as query_file:
+            queries = [line.strip() for line in query_file if line.strip()]
+
+    responses = [ChatResponse.model_validate(payload) for payload in asyncio.run(collect_responses(args, queries))]
+    if not responses:
+        print("No responses collected")
+        sys.exit(1)
+
+    adapter = TypeAdapter(ChatResponse)
+    paths = {
+        "default": default_serialize,
+        "orjson_full": shaped_serialize("full"),
+        "orjson_compact": shaped_serialize("compact"),
+    }
+    results = {name: benchmark(responses, serialize, adapter, args.rounds) for name, serialize in paths.items()}
+
+    baseline = results["default"]
+    print(f"{len(responses)} responses, {args.rounds} rounds")
+    print(f"{'path':<16} {'bytes':>8} {'max':>8} {'p50 us':>8} {'p95 us':>8} {'size':>7} {'time':>7}")
+    for name, row in results.items():
+        row["size_ratio"] = round(row["bytes_mean"] / baseline["bytes_mean"], 3)
+        row["time_ratio"] = round(row["p50_us"] / baseline["p50_us"], 3) if baseline["p50_us"] else None
+        print(f"{name:<16} {row['bytes_mean']:>8} {row['bytes_max']:>8} {row['p50_us']:>8} {row['p95_us']:>8} {row['size_ratio']:>7} {row['time_ratio']:>7}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
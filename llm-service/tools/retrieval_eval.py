@@ -0,0 +1,273 @@
+"""
+retrieval_eval.py
+
+What is this file for: Offline evaluation of retrieval quality against latency and memory for chunk size, k, Qdrant index profile and embedding model choices.
+
+What the flow of the functions are: build_labeled_set() builds questions labeled with their source page, build_index() indexes the chunked document for one configuration, evaluate() scores recall@k, MRR and search latency, and main() prints one table for every combination.
+
+How this service is used: Run from the llm-service directory, e.g. `python -m tools.retrieval_eval --chunks 400:80,800:150 --k 2,4,8 --backends ollama,onnx`.
+"""
+
+from typing import Any, Dict, List, Tuple
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# the service's collection uses Qdrant defaults, which is the "default" profile; the others build their
+# index right away, since Qdrant otherwise scans small collections instead of indexing them
+INDEX_PROFILES = {
+    "default": {},
+    "fast": {"hnsw": {"m": 8, "ef_construct": 64}, "indexing_threshold": 1, "search": {"hnsw_ef": 32}},
+    "accurate": {"hnsw": {"m": 32, "ef_construct": 256}, "indexing_threshold": 1, "search": {"hnsw_ef": 256}},
+    "int8": {"quantization": "int8", "indexing_threshold": 1, "search": {"rescore": True}},
+    "exact": {"search": {"exact": True}},
+}
+
+STOPWORDS = set("""
+a about above after again all also an and any are as at be because been before being between both but by can could did do does doing
+down during each few for from further had has have having he her here hers him his how i if in into is it its itself just may me might
+more most much must my no nor not of off on once only or other our out over own same she should so some such than that the their them
+then there these they this those through to too under until up very was we were what when where which while who whom why will with
+would you your yours one two also many every often
+""".split())
+
+QUESTION_PROMPT = (
+    "Write one question a beginner investor might ask that the passage below answers. "
+    "Do not copy sentences from the passage and do not mention the passage. Reply with the question only.\n\n"
+    "Passage:\n{passage}\n\nQuestion:"
+)
+
+
+def load_pages(pdf_path: str, chunks_path: str) -> List[Tuple[str, str]]:
+    if os.path.exists(pdf_path):
+        from langchain_community.document_loaders import PyPDFLoader
+        return [(str(page.metadata.get("page", 0) + 1), page.page_content) for page in PyPDFLoader(pdf_path).load() if page.page_content.strip()]
+
+    # without the PDF, rebuild pages from the cached chunk file (overlapping chunks only repeat a little text)
+    from services.document_processor import DocumentProcessor
+    pages: Dict[str, List[str]] = {}
+    for chunk in DocumentProcessor().load_from_txt(chunks_path):
+        pages.setdefault(chunk.metadata["page"], []).append(chunk.page_content)
+    return [(page, "\n".join(texts)) for page, texts in pages.items()]
+
+
+def _sentences(text: str) -> List[str]:
+    text = re.sub(r"\s+", " ", text)
+    return [sentence.strip() for sentence in re.split(r"(?<=[.?!])\s+", text) if 10 <= len(sentence.split()) <= 45]
+
+
+def _keyword_question(sentence: str, max_words: int) -> str:
+    words = [word for word in re.findall(r"[A-Za-z][A-Za-z'-]+", sentence) if word.lower() not in STOPWORDS and len(word) > 2]
+    return " ".join(words[:max_words])
+
+
+def build_labeled_set(pages: List[Tuple[str, str]], per_page: int, seed: int, generate: str = "keywords", llm=None, max_words: int = 8) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    labeled = []
+    for page, text in pages:
+        sentences = _sentences(text)
+        for sentence in rng.sample(sentences, min(per_page, len(sentences))):
+            if generate == "llm":
+                question = llm.invoke(QUESTION_PROMPT.format(passage=sentence)).strip().splitlines()[0].strip()
+            else:
+                question = _keyword_question(sentence, max_words)
+            if len(question.split()) < 3:
+                continue
+            # a passage repeated on several pages (headers, summaries) makes each of them a correct answer
+            relevant = sorted({other for other, other_text in pages if sentence in re.sub(r"\s+", " ", other_text)} | {page}, key=int)
+            labeled.append({"question": question, "pages": relevant, "passage": sentence})
+    return labeled
+
+
+def _profile_config(name: str):
+    from qdrant_client.http.models import HnswConfigDiff, OptimizersConfigDiff, QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams
+    profile = INDEX_PROFILES[name]
+    hnsw = HnswConfigDiff(**profile["hnsw"]) if "hnsw" in profile else None
+    optimizers = OptimizersConfigDiff(indexing_threshold=profile["indexing_threshold"]) if "indexing_threshold" in profile else None
+    quantization = ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)) if profile.get("quantization") == "int8" else None
+    search = dict(profile.get("search", {}))
+    rescore = search.pop("rescore", None)
+    if rescore is not None:
+        search["quantization"] = QuantizationSearchParams(rescore=rescore)
+    return hnsw, optimizers, quantization, SearchParams(**search) if search else None
+
+
+def _directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def build_index(client, collection: str, pages: List[Tuple[str, str]], chunk_size: int, chunk_overlap: int, backend, profile: str) -> Dict[str, Any]:
+    from langchain_core.documents import Document
+    from qdrant_client.http.models import Distance, PointStruct, VectorParams
+    from services.document_processor import DocumentProcessor
+
+    processor = DocumentProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks: List[Document] = []
+    for page, text in pages:
+        chunks.extend(Document(page_content=chunk, metadata={"page": page}) for chunk in processor.text_splitter.split_text(text))
+
+    hnsw, optimizers, quantization, _ = _profile_config(profile)
+    started = time.perf_counter()
+    vectors = backend.embed_documents([chunk.page_content for chunk in chunks])
+    embed_seconds = time.perf_counter() - started
+    client.create_collection(collection, vectors_config=VectorParams(size=len(vectors[0]), distance=Distance.COSINE), hnsw_config=hnsw, optimizers_config=optimizers, quantization_config=quantization)
+    client.upsert(collection, points=[
+        PointStruct(id=i, vector=vector, payload={"page": chunk.metadata["page"]}) for i, (chunk, vector) in enumerate(zip(chunks, vectors))
+    ], wait=True)
+    # a server builds the index in the background after the upsert, the build is done once the collection is green
+    deadline = time.perf_counter() + 300
+    while str(getattr(client.get_collection(collection).status, "value", "green")) != "green" and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    return {
+        "chunks": len(chunks),
+        "dimensions": len(vectors[0]),
+        "embed_seconds": round(embed_seconds, 3),
+        "build_seconds": round(time.perf_counter() - started, 3),
+        "vectors_mb": round(len(chunks) * len(vectors[0]) * 4 / 1e6, 3),
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))]
+
+
+def evaluate(client, collection: str, labeled: List[Dict[str, Any]], query_vectors: List[List[float]], k: int, profile: str) -> Dict[str, Any]:
+    *_, search_params = _profile_config(profile)
+    hits, reciprocal_ranks, latencies = 0, [], []
+    for item, vector in zip(labeled, query_vectors):
+        started = time.perf_counter()
+        points = client.query_points(collection, query=vector, limit=k, search_params=search_params, with_payload=True).points
+        latencies.append(time.perf_counter() - started)
+        relevant = set(item["pages"])
+        ranks = [rank for rank, point in enumerate(points, start=1) if point.payload.get("page") in relevant]
+        hits += bool(ranks)
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+    return {
+        "recall": round(hits / len(labeled), 4),
+        "mrr": round(sum(reciprocal_ranks) / len(labeled), 4),
+        "search_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "search_p95_ms": round(percentile(latencies, 95) * 1000, 2),
+    }
+
+
+def _parse_chunks(value: str) -> List[Tuple[int, int]]:
+    configs = []
+    for item in value.split(","):
+        size, _, overlap = item.strip().partition(":")
+        configs.append((int(size), int(overlap or int(size) // 5)))
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking, k, index profiles and embedding backends for retrieval quality against latency and size")
+    parser.add_argument("--pdf", default="reference_doc.pdf")
+    parser.add_argument("--chunks-file", default="reference_doc_chunks.txt", help="used to rebuild pages when the PDF is missing")
+    parser.add_argument("--chunks", default="400:80,800:150,1200:200", help="comma-separated chunk_size:chunk_overlap pairs")
+    parser.add_argument("--k", default="1,2,4,8")
+    parser.add_argument("--profiles", default="default", help=f"comma-separated index profiles from {sorted(INDEX_PROFILES)}")
+    parser.add_argument("--backends", default="ollama", help="comma-separated embedding backends (ollama, onnx, fake)")
+    parser.add_argument("--questions", help="load the labeled set from this JSON file instead of building it")
+    parser.add_argument("--save-questions", help="write the labeled set to this JSON file")
+    parser.add_argument("--generate", choices=["keywords", "llm"], default="keywords", help="build questions from a passage's key words, or have the Ollama LLM write them")
+    parser.add_argument("--per-page", type=int, default=2, help="questions sampled from each page")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL"), help="evaluate on a Qdrant server (needed for HNSW and quantization profiles to matter)")
+    parser.add_argument("--qdrant-api-key", default=os.getenv("QDRANT_API_KEY"))
+    parser.add_argument("--ollama-model", default=os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text"))
+    parser.add_argument("--ollama-llm-model", default=os.getenv("OLLAMA_LLM_MODEL", "llama3.2:3b"))
+    parser.add_argument("--ollama-url", default=os.getenv("OLLAMA_BASE_URL"))
+    parser.add_argument("--onnx-model-dir", default=os.getenv("ONNX_EMBEDDING_MODEL_DIR"))
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--fake-latency", type=float, default=0.0)
+    parser.add_argument("--json", dest="json_path", help="also write the result rows to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from qdrant_client import QdrantClient
+    from tools.embedding_benchmark import build_backend
+
+    profiles = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    unknown = [name for name in profiles if name not in INDEX_PROFILES]
+    if unknown:
+        parser.error(f"Unknown index profiles {unknown}, expected any of {sorted(INDEX_PROFILES)}")
+    if not args.qdrant_url and profiles != ["default"]:
+        logger.warning("The embedded Qdrant store searches exhaustively, so index profiles only change results on a server (--qdrant-url)")
+    ks = sorted(int(k) for k in args.k.split(","))
+
+    pages = load_pages(args.pdf, args.chunks_file)
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as questions_file:
+            labeled = json.load(questions_file)
+    else:
+        llm = None
+        if args.generate == "llm":
+            from langchain_ollama import OllamaLLM
+            llm = OllamaLLM(model=args.ollama_llm_model, base_url=args.ollama_url, temperature=0)
+        labeled = build_labeled_set(pages, args.per_page, args.seed, args.generate, llm)
+    if args.save_questions:
+        with open(args.save_questions, "w", encoding="utf-8") as questions_file:
+            json.dump(labeled, questions_file, indent=2)
+    print(f"{len(pages)} pages, {len(labeled)} labeled questions")
+
+    rows = []
+    storage = None if args.qdrant_url else tempfile.mkdtemp(prefix="investra-retrieval-eval-")
+    server = QdrantClient(url=args.qdrant_url, api_key=args.qdrant_api_key) if args.qdrant_url else None
+    try:
+        for backend_name in [name.strip() for name in args.backends.split(",") if name.strip()]:
+            backend = build_backend(backend_name, args)
+            started = time.perf_counter()
+            query_vectors = [backend.embed_query(item["question"]) for item in labeled]
+            query_embed_ms = round((time.perf_counter() - started) / len(labeled) * 1000, 2)
+
+            for chunk_size, chunk_overlap in _parse_chunks(args.chunks):
+                for profile in profiles:
+                    collection = f"retrieval_eval_{uuid.uuid4().hex[:8]}"
+                    # a fresh embedded store per index, so its size on disk is this index alone
+                    path = os.path.join(storage, collection) if storage else None
+                    client = server or QdrantClient(path=path)
+                    built = build_index(client, collection, pages, chunk_size, chunk_overlap, backend, profile)
+                    built["index_mb"] = round(_directory_size(path) / 1e6, 3) if path else None
+                    try:
+                        for k in ks:
+                            row = {"backend": backend_name, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "profile": profile, "k": k, "query_embed_ms": query_embed_ms, **built}
+                            row.update(evaluate(client, collection, labeled, query_vectors, k, profile))
+                            rows.append(row)
+                    finally:
+                        client.delete_collection(collection)
+                        if client is not server:
+                            client.close()
+    finally:
+        if server:
+            server.close()
+        if storage:
+            shutil.rmtree(storage, ignore_errors=True)
+
+    print(f"{'backend':<8} {'chunks':>9} {'profile':<9} {'k':>2} {'n':>5} {'build s':>8} {'index MB':>9} {'recall@k':>8} {'mrr':>7} {'p50 ms':>7} {'p95 ms':>7} {'embed ms':>8}")
+    for row in rows:
+        index_mb = row["index_mb"] if row["index_mb"] is not None else row["vectors_mb"]
+        print(f"{row['backend']:<8} {str(row['chunk_size']) + ':' + str(row['chunk_overlap']):>9} {row['profile']:<9} {row['k']:>2} {row['chunks']:>5} {row['build_seconds']:>8} {index_mb:>9} {row['recall']:>8} {row['mrr']:>7} {row['search_p50_ms']:>7} {row['search_p95_ms']:>7} {row['query_embed_ms']:>8}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump(rows, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()